@@ -4,283 +4,559 @@ Microservicio OCR para extracción de datos de facturas
 Integración con Camunda BPMN para proceso de reembolsos
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import pytesseract
-from PIL import Image
+from werkzeug.datastructures import CombinedMultiDict
 import io
-import re
+import json
 import logging
 import os
-from datetime import datetime
-import json
-from pdf2image import convert_from_bytes
+import time
+import itertools
+from ocr_pipeline import InvoiceDataExtractor, OCRProcessingError, is_allowed_file, parse_options, process_document  # noqa: F401 (reexportado)
+from ocr_executor import ExecutorBusyError, get_executor
+from ocr_cache import cache_key, get_result_cache
+from ocr_deadline import Deadline, DeadlineExceeded, deadline_from_headers
+from ocr_jobs import JobQueueFullError, get_job_manager
+from ocr_batch import iter_batch, resolve_concurrency
+from ocr_multipart import MultipartStream
+from ocr_archive import ArchiveReader
+from ocr_governor import get_governor
+from ocr_admission import AdmissionRejected, estimate_megapixels, get_admission_controller
+from ocr_singleflight import get_single_flight
+from ocr_templates import get_template_store
+from ocr_similar import get_similarity_index, options_digest, process_with_hashes
+from ocr_engine import tesseract_status
+from ocr_metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_IN_FLIGHT, HTTP_REQUESTS, HTTP_SECONDS,
+                         REGISTRY as METRICS, STAGE_SECONDS, file_type, track_document)
+from ocr_trace import REQUEST_ID_HEADER, RequestTrace, get_trace_log, request_id_from_headers, server_timing, timings
+from ocr_recorder import RESULT_FIELDS, get_recorder
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Endpoints cuyas etapas se devuelven en Server-Timing y se escriben en el log de trazas
+TRACED_ENDPOINTS = ('/ocr', '/ocr/batch', '/ocr/archive')
+
 app = Flask(__name__)
 CORS(app)  # Permitir CORS para integración con Camunda
 
-# Configuración de Tesseract (ajustar según el sistema)
-if os.name == 'nt':  # Windows
-    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+@app.before_request
+def start_request_metrics():
+    """Peticiones en curso por endpoint (la regla de la ruta, no la URL, para no multiplicar series)"""
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'desconocido'
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+    if g.metrics_endpoint in TRACED_ENDPOINTS:
+        g.trace = RequestTrace(request_id_from_headers(request.headers), g.metrics_endpoint, log=get_trace_log())
+        recorder = get_recorder()
+        if recorder is not None:
+            g.trace.recording = recorder.start(g.trace.request_id, g.metrics_endpoint, request.headers)
 
-class InvoiceDataExtractor:
-    """Clase para extraer datos específicos de facturas usando OCR"""
-    
-    def __init__(self):
-        self.extracted_text = ""
-    
-    def extract_text_from_image(self, image):
-        """Extrae texto de la imagen usando Tesseract OCR"""
-        try:
-            # Configurar Tesseract para mejor reconocimiento
-            custom_config = r'--oem 3 --psm 6'
-            self.extracted_text = pytesseract.image_to_string(image, config=custom_config, lang='spa+eng')
-            logger.info("Texto extraído exitosamente")
-            logger.debug(f"Texto OCR extraído:\n{self.extracted_text}")  # Log detallado
-            if not self.extracted_text.strip():
-                logger.error("El OCR no extrajo ningún texto. Verifica la calidad de la imagen o la instalación de Tesseract.")
-                return False
-            return True
-        except Exception as e:
-            logger.error(f"Error al extraer texto: {str(e)}")
-            return False
-    
-    def extract_provider(self):
-        """Extrae el nombre del proveedor"""
-        lines = self.extracted_text.split('\n')
-        for line in lines:
-            if "razón social" in line.lower():
-                return line.split(":", 1)[-1].strip()
-            if "nombre comercial" in line.lower():
-                return line.split(":", 1)[-1].strip()
-        return "Proveedor no identificado"
-    
-    def extract_amount(self):
-        """Extrae el monto total de la factura"""
-        # Buscar línea con VALOR TOTAL USD
-        match = re.search(r'VALOR TOTAL USD\s*([\d,.]+)', self.extracted_text, re.IGNORECASE)
-        if match:
-            try:
-                return float(match.group(1).replace(',', ''))
-            except ValueError:
-                pass
-        # Fallback anterior
-        return 0.0
-    
-    def extract_date(self):
-        """Extrae la fecha de la factura"""
-        # Buscar FECHA DE EMISIÓN
-        match = re.search(r'FECHA DE EMISI[ÓO]N[:\s]*([\d/-]{8,10})', self.extracted_text, re.IGNORECASE)
-        if match:
-            return match.group(1)
-        # Fallback anterior
-        return datetime.now().strftime("%Y-%m-%d")
-    
-    def extract_invoice_number(self):
-        """Extrae el número de factura"""
-        # Buscar patrones como N°: 001-008-004080008
-        match = re.search(r'N[°º]?:?\s*([\d-]{8,})', self.extracted_text)
-        if match:
-            return match.group(1)
-        # Fallback anterior
-        return "N/A"
-    
-    def extract_ruc(self):
-        """Extrae el RUC del proveedor"""
-        # Buscar exactamente 13 dígitos
-        ruc_candidates = re.findall(r'\b\d{13}\b', self.extracted_text)
-        if ruc_candidates:
-            return ruc_candidates[0]
-        # Fallback anterior
-        return "N/A"
+@app.after_request
+def capture_status(response):
+    """
+    Código para las métricas; en las peticiones trazadas, su id y la cabecera
+    Server-Timing (no en un stream, cuyas cabeceras salen antes de procesarlo)
+    """
+    g.metrics_status = response.status_code
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers[REQUEST_ID_HEADER] = trace.request_id
+        if not response.is_streamed:
+            response.headers['Server-Timing'] = server_timing(trace.spans, trace.elapsed())
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    """Al terminar la petición (en un stream, al cerrarse) se registran su duración y su código"""
+    if 'metrics_started' not in g:
+        return
+    HTTP_IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+    HTTP_REQUESTS.inc(endpoint=g.metrics_endpoint, status=g.get('metrics_status', 500))
+    HTTP_SECONDS.observe(time.perf_counter() - g.metrics_started, endpoint=g.metrics_endpoint)
+    if 'trace' in g:
+        g.trace.finish(g.get('metrics_status', 500))
+        if g.trace.recording is not None:
+            g.trace.recording.finish(g.get('metrics_status', 500), g.trace.elapsed())
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Endpoint de salud del servicio"""
+    """Endpoint de salud del servicio: 503 si Tesseract o sus idiomas no están disponibles"""
+    tesseract = tesseract_status()
     return jsonify({
-        "status": "healthy",
+        "status": "healthy" if tesseract["available"] else "unhealthy",
         "service": "OCR Invoice Extractor",
         "version": "1.0.0",
-        "tesseract_available": True
-    })
+        "tesseract_available": tesseract["available"],
+        "tesseract_version": tesseract["version"],
+        "tesseract_backend": tesseract["backend"],
+        "idiomas_faltantes": tesseract["missing_languages"]
+    }), 200 if tesseract["available"] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(METRICS.render(), content_type=METRICS_CONTENT_TYPE)
+
+def scrape_gauges():
+    """Gauges que se leen al exponer: cola y procesos del ejecutor, disponibilidad de Tesseract"""
+    executor = get_executor().stats()
+    return [
+        ("ocr_executor_queue_depth", "gauge", "Trabajos esperando un proceso OCR", {}, executor["queue_depth"]),
+        ("ocr_executor_active_workers", "gauge", "Procesos OCR ocupados", {}, executor["active_workers"]),
+        ("ocr_tesseract_available", "gauge", "Tesseract y sus idiomas disponibles (1/0)", {},
+         1 if tesseract_status()["available"] else 0),
+    ]
+
+METRICS.register_collector(scrape_gauges)
+
+def run_document(data, filename, options=None, deadline=None, wait_admission=False, trace=None):
+    """
+    Procesa un documento en el ejecutor OCR, reutilizando resultados en caché y
+    esperando el cálculo en curso si ya se está procesando el mismo documento
+    Lanza DeadlineExceeded si el documento no se termina dentro del plazo y
+    AdmissionRejected si el servicio está saturado (con wait_admission, para los
+    archivos de un lote ya admitido, antes espera lugar mientras quede plazo). Con `trace` sus etapas se suman
+    a la traza de la petición y, si el cliente las pidió, van en `timings`; si la
+    petición se está grabando, el documento se agrega a la grabación
+    """
+    started = time.perf_counter()
+    tracker = result = None
+    try:
+        with track_document(filename, len(data)) as tracker:
+            result = _run_document(data, filename, options, deadline, wait_admission, tracker)
+    finally:
+        elapsed = time.perf_counter() - started
+        if trace is not None and tracker is not None:
+            trace.add_document(filename, tracker.file_type, tracker.outcome, tracker.spans, elapsed)
+            if trace.recording is not None:
+                trace.recording.add_document(data, filename, tracker.outcome, elapsed, result)
+    if trace is not None and trace.include:
+        result = {**result, "timings": timings(tracker.spans, elapsed)}
+    return result
+
+def _run_document(data, filename, options, deadline, wait_admission, tracker):
+    """Cuerpo de run_document; registra en `tracker` el resultado y las etapas para las métricas"""
+    cache = get_result_cache()
+    key = cache_key(data, options)
+    if cache:
+        started = time.perf_counter()
+        cached = cache.get(key)
+        tracker.spans.append(('cache', time.perf_counter() - started))
+        if cached is not None:
+            result, tier = cached
+            logger.info(f"Resultado en caché ({tier}) para {filename}")
+            result.update({"archivo_procesado": filename, "cache_hit": True, "cache_tier": tier})
+            tracker.outcome = 'cache_hit'
+            return result
+    
+    similar = get_similarity_index()
+    
+    def compute():
+        # Con el índice de casi duplicados, el proceso OCR también calcula los hashes del documento
+        job = (process_with_hashes, process_document) if similar is not None else (process_document,)
+        admission = get_admission_controller()
+        if admission:
+            with admission.admit(estimate_megapixels(data, filename, options), deadline, wait=wait_admission) as admitted:
+                outcome = get_executor().run(*job, data, filename, options, deadline,
+                                             deadline=deadline, spans=tracker.spans)
+                # Un PDF leído (aunque sea en parte) de su capa de texto no mide el costo de rasterizar
+                admitted.measured = (outcome[0] if similar is not None else outcome).get(
+                    "metodo_extraccion") in ('ocr', 'plantilla')
+        else:
+            outcome = get_executor().run(*job, data, filename, options, deadline,
+                                         deadline=deadline, spans=tracker.spans)
+        result, hashes = outcome if similar is not None else (outcome, None)
+        tracker.add_result(result)
+        if hashes is not None:
+            started = time.perf_counter()
+            duplicate = near_duplicate(similar.search(hashes, options_digest(options)), result, cache)
+            tracker.spans.append(('similitud', time.perf_counter() - started))
+            if duplicate is not None:
+                logger.info(f"{filename} es un posible duplicado de {duplicate['archivo_procesado']} "
+                            f"(distancia {duplicate['distancia_hamming']})")
+                result.update({"posible_duplicado": True, "duplicado_de": duplicate})
+        if cache:
+            cache.put(key, result)
+            if hashes is not None:
+                similar.add(hashes, options_digest(options), key)
+        result["cache_hit"] = False
+        return result
+    
+    # Un documento idéntico en curso (reintento, doble clic) no se vuelve a procesar
+    result, shared = get_single_flight().do(key, compute, deadline)
+    if shared:
+        logger.info(f"Resultado compartido con una petición idéntica en curso para {filename}")
+        result.update({"archivo_procesado": filename, "coalesced": True})
+        tracker.outcome = 'coalesced'
+    return result
+
+def near_duplicate(match, result, cache):
+    """
+    Datos del documento anterior casi idéntico (reescaneo, otra foto) o None
+    Solo marca la respuesta: los campos siempre son los del OCR de este documento,
+    y `mismos_valores` indica si coinciden con los del original
+    """
+    original = cache.peek(match[0]) if match and cache else None
+    if original is None:
+        return None
+    return {
+        "archivo_procesado": original.get("archivo_procesado"),
+        "timestamp": original.get("timestamp"),
+        "distancia_hamming": match[1],
+        "mismos_valores": all(original.get(name) == result.get(name) for name in RESULT_FIELDS),
+    }
+
+def error_response(message, status_code, **extra):
+    """
+    Respuesta JSON de error con el formato común del servicio
+    Si `extra` trae retry_after_segundos también se envía la cabecera Retry-After
+    """
+    headers = {}
+    if "retry_after_segundos" in extra:
+        headers["Retry-After"] = str(extra["retry_after_segundos"])
+    return jsonify({
+        "error": message,
+        **extra,
+        "status": "error"
+    }), status_code, headers
+
+def deadline_details(error):
+    """Campos de un error de plazo: etapa que agotó el presupuesto y presupuesto en segundos"""
+    return {"etapa": error.stage, "presupuesto_segundos": error.budget}
+
+def document_error(error):
+    """Mensaje, código HTTP y campos adicionales para un error al procesar un documento"""
+    if isinstance(error, OCRProcessingError):
+        return error.message, error.status_code, {}
+    if isinstance(error, AdmissionRejected):
+        return "Servicio OCR saturado, reintente más tarde", 429, {
+            "motivo": error.reason, "retry_after_segundos": error.retry_after}
+    if isinstance(error, ExecutorBusyError):
+        logger.warning("Ejecutor OCR saturado, petición rechazada")
+        return "Servicio OCR saturado, reintente más tarde", 503, {}
+    if isinstance(error, DeadlineExceeded):
+        logger.error(f"Tiempo de procesamiento excedido: {str(error)}")
+        return "Tiempo de procesamiento excedido", 504, deadline_details(error)
+    logger.error(f"Error general en procesamiento: {str(error)}")
+    return "Error interno del servidor", 500, {}
+
+def batch_handler(options, budget, trace=None):
+    """Procesa un archivo de un lote por el mismo camino que /ocr, con su propio plazo"""
+    def handle(data, filename):
+        if not is_allowed_file(filename):
+            raise OCRProcessingError("Tipo de archivo no soportado")
+        return run_document(data, filename, options, Deadline(budget), wait_admission=True, trace=trace)
+    return handle
+
+def admit_batch():
+    """Rechaza con AdmissionRejected un lote o paquete si el servicio ya está en su límite"""
+    admission = get_admission_controller()
+    if admission:
+        admission.check()
+
+def batch_entry(item):
+    """Entrada de la respuesta por lotes para un archivo: resultado o error, con su duración"""
+    if item.error is None:
+        result = item.result
+    else:
+        message, _, extra = document_error(item.error)
+        result = {"error": message, **extra, "archivo_procesado": item.filename, "status": "error"}
+    return {"filename": item.filename, "result": result, "tiempo_ms": item.elapsed_ms}
+
+def observe_stage(stage, seconds, filename, trace=None):
+    """Registra una etapa de la petición (fuera de un documento) en las métricas y en su traza"""
+    STAGE_SECONDS.observe(seconds, stage=stage, file_type=file_type(filename), outcome='ok')
+    if trace is not None:
+        trace.add(stage, seconds)
+
+def record_params(trace, values):
+    """Parámetros de la petición para su grabación, si se está grabando"""
+    if trace.recording is not None:
+        trace.recording.set_params(values)
+
+def wants_timings(values):
+    """El cliente pidió las etapas en el JSON (`timings=1`)"""
+    return (values.get('timings') or '').lower() in ('1', 'true', 'yes', 'si', 'sí')
+
+def timed_uploads(uploads, trace=None):
+    """Mide la espera de cada archivo de la subida (etapa lectura) a medida que llega"""
+    while True:
+        started = time.perf_counter()
+        upload = next(uploads, None)
+        if upload is None:
+            return
+        observe_stage('lectura', time.perf_counter() - started, upload[0], trace)
+        yield upload
+
+def wants_ndjson():
+    """El cliente pidió explícitamente resultados en streaming (Accept: application/x-ndjson)"""
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def stream_batch(uploads, handle, concurrency, summary=None, trace=None):
+    """
+    Genera una línea JSON por archivo en cuanto termina (con su posición `index`)
+    y una línea final de resumen; no retiene los resultados ya enviados. Un error
+    al leer la subida (p. ej. archivo demasiado grande) cierra el stream con una
+    línea de error. `summary` añade campos al resumen al terminar; si el cliente
+    pidió `timings`, el resumen lleva las etapas de toda la petición
+    """
+    started = time.perf_counter()
+    total = failed = 0
+    try:
+        for item in iter_batch(uploads, handle, concurrency):
+            entry = batch_entry(item)
+            total += 1
+            failed += item.error is not None
+            serialize_started = time.perf_counter()
+            line = json.dumps({"tipo": "resultado", "index": item.index, **entry}, ensure_ascii=False) + "\n"
+            observe_stage('serializacion', time.perf_counter() - serialize_started, item.filename, trace)
+            yield line
+    except OCRProcessingError as e:
+        yield json.dumps({"tipo": "error", "error": e.message, "status": "error"}, ensure_ascii=False) + "\n"
+        return
+    yield json.dumps({
+        "tipo": "resumen",
+        "total_processed": total,
+        "exitosos": total - failed,
+        "fallidos": failed,
+        "concurrencia": concurrency,
+        "tiempo_total_ms": round((time.perf_counter() - started) * 1000, 2),
+        **(summary() if summary else {}),
+        **({"timings": timings(trace.spans, trace.elapsed())} if trace is not None and trace.include else {}),
+        "status": "success"
+    }, ensure_ascii=False) + "\n"
+
+def request_deadline():
+    """Plazo de la petición (cabecera X-OCR-Deadline-Seconds o OCR_DEADLINE_SECONDS)"""
+    try:
+        return deadline_from_headers(request.headers)
+    except ValueError as e:
+        raise OCRProcessingError(str(e))
 
 @app.route('/ocr', methods=['POST'])
 def process_invoice():
     """
     Endpoint principal para procesar facturas
-    Recibe: archivo de imagen (PDF/JPG/PNG)
-    Retorna: JSON con datos extraídos
+    Recibe: archivo de imagen (PDF/JPG/PNG) y opcionalmente `pages`
+            (first, all, N, N-M o N,M) para seleccionar páginas del PDF y
+            `timings=1` para incluir la duración de cada etapa
+    Retorna: JSON con datos extraídos; 504 con la etapa si se agota el plazo;
+             429 con Retry-After si el servicio está saturado
     """
+    trace = g.trace
     try:
+        deadline = request_deadline()
+        read_started = time.perf_counter()
         # Verificar que se envió un archivo
         if 'file' not in request.files:
             logger.error("No se proporcionó archivo en la petición.")
-            return jsonify({
-                "error": "No se proporcionó archivo",
-                "status": "error"
-            }), 400
+            return error_response("No se proporcionó archivo", 400)
         
         file = request.files['file']
         if file.filename == '':
             logger.error("No se seleccionó archivo.")
-            return jsonify({
-                "error": "No se seleccionó archivo",
-                "status": "error"
-            }), 400
+            return error_response("No se seleccionó archivo", 400)
         
         # Verificar tipo de archivo
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'pdf', 'tiff', 'bmp'}
-        if not file.filename.lower().endswith(tuple('.' + ext for ext in allowed_extensions)):
+        if not is_allowed_file(file.filename):
             logger.error(f"Tipo de archivo no soportado: {file.filename}")
-            return jsonify({
-                "error": "Tipo de archivo no soportado",
-                "status": "error"
-            }), 400
-        
-        logger.info(f"Procesando archivo: {file.filename}")
+            return error_response("Tipo de archivo no soportado", 400)
         
-        # Procesar imagen o PDF
-        image = None
-        if file.filename.lower().endswith('.pdf'):
-            try:
-                pdf_bytes = file.read()
-                images = convert_from_bytes(pdf_bytes)
-                if not images:
-                    logger.error("No se pudo convertir el PDF a imagen.")
-                    return jsonify({
-                        "error": "No se pudo convertir el PDF a imagen",
-                        "status": "error"
-                    }), 400
-                image = images[0]  # Procesar solo la primera página
-                logger.info("PDF convertido a imagen exitosamente.")
-            except Exception as e:
-                logger.error(f"Error al convertir PDF: {str(e)}")
-                return jsonify({
-                    "error": "Error al convertir PDF a imagen",
-                    "status": "error"
-                }), 400
-        else:
-            try:
-                image = Image.open(file.stream)
-                # Convertir a RGB si es necesario
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-            except Exception as e:
-                logger.error(f"Error al abrir imagen: {str(e)}")
-                return jsonify({
-                    "error": "Error al procesar imagen",
-                    "status": "error"
-                }), 400
-        
-        # Extraer datos
-        extractor = InvoiceDataExtractor()
-        if not extractor.extract_text_from_image(image):
-            logger.error("No se pudo extraer texto de la imagen. Revisa los logs para más detalles.")
-            return jsonify({
-                "error": "No se pudo extraer texto de la imagen",
-                "status": "error"
-            }), 400
-        
-        # Extraer información específica
-        extracted_data = {
-            "proveedor": extractor.extract_provider(),
-            "monto": extractor.extract_amount(),
-            "fecha": extractor.extract_date(),
-            "numero_factura": extractor.extract_invoice_number(),
-            "ruc": extractor.extract_ruc(),
-            "texto_completo": extractor.extracted_text[:500] + "..." if len(extractor.extracted_text) > 500 else extractor.extracted_text,
-            "archivo_procesado": file.filename,
-            "timestamp": datetime.now().isoformat(),
-            "status": "success"
-        }
-        
-        logger.info(f"Datos extraídos exitosamente: {extracted_data['proveedor']} - {extracted_data['monto']}")
-        logger.debug(f"Datos extraídos completos: {json.dumps(extracted_data, ensure_ascii=False, indent=2)}")
-        
-        return jsonify(extracted_data)
+        # Decodificación, OCR y extracción en el ejecutor de procesos
+        options = parse_options(request.values)
+        trace.include = wants_timings(request.values)
+        record_params(trace, request.values)
+        data = file.read()
+        observe_stage('lectura', time.perf_counter() - read_started, file.filename, trace)
+        extracted_data = run_document(data, file.filename, options, deadline, trace=trace)
+        if trace.include:
+            # Etapas de toda la petición (con la lectura), no solo las del documento
+            extracted_data["timings"] = timings(trace.spans, trace.elapsed())
+        serialize_started = time.perf_counter()
+        response = jsonify(extracted_data)
+        observe_stage('serializacion', time.perf_counter() - serialize_started, file.filename, trace)
+        return response
         
     except Exception as e:
-        logger.error(f"Error general en procesamiento: {str(e)}")
-        return jsonify({
-            "error": "Error interno del servidor",
-            "status": "error"
-        }), 500
+        message, status_code, extra = document_error(e)
+        return error_response(message, status_code, **extra)
 
 @app.route('/ocr/batch', methods=['POST'])
 def process_batch():
     """
     Endpoint para procesar múltiples facturas
-    Recibe: lista de archivos
-    Retorna: lista de resultados
+    Recibe: lista de archivos y opcionalmente `concurrency` (archivos a la vez,
+            hasta OCR_BATCH_CONCURRENCY) y las opciones de /ocr (también `timings`), como
+            query string o campos antes de los archivos; el plazo de la cabecera se aplica a cada archivo
+    Retorna: lista de resultados en el orden de envío, con la duración de cada uno;
+             con `Accept: application/x-ndjson`, una línea por archivo al terminar y un resumen final
     """
+    trace = g.trace
     try:
-        files = request.files.getlist('files')
-        if not files:
-            return jsonify({
-                "error": "No se proporcionaron archivos",
-                "status": "error"
-            }), 400
+        # Un lote se admite o rechaza entero antes de leer la subida
+        admit_batch()
+        # El cuerpo se lee de forma incremental: cada archivo se despacha al OCR en
+        # cuanto llega completo, mientras el resto de la subida sigue en tránsito
+        body = MultipartStream(request.stream, request.content_type)
+        parts = timed_uploads(body.iter_files('files'), trace)
+        first = next(parts, None)
+        if first is None:
+            return error_response("No se proporcionaron archivos", 400)
+        
+        # Opciones: query string y campos de formulario enviados antes de los archivos
+        values = CombinedMultiDict([request.args, body.fields])
+        options = parse_options(values)
+        trace.include = wants_timings(values)
+        record_params(trace, values)
+        budget = request_deadline().budget
+        try:
+            concurrency = resolve_concurrency(values.get('concurrency'))
+        except ValueError:
+            raise OCRProcessingError("concurrency debe ser un entero positivo")
         
+        handle = batch_handler(options, budget, trace)
+        uploads = itertools.chain([first], parts)
+        del first
+        if wants_ndjson():
+            # X-Accel-Buffering evita que un proxy nginx acumule el stream
+            return Response(stream_with_context(stream_batch(uploads, handle, concurrency, trace=trace)),
+                            mimetype=NDJSON_MIMETYPE, headers={'X-Accel-Buffering': 'no'})
+        started = time.perf_counter()
         results = []
-        for file in files:
-            if file.filename:
-                try:
-                    # Procesar cada archivo individualmente
-                    image = Image.open(file.stream)
-                    if image.mode != 'RGB':
-                        image = image.convert('RGB')
-                    
-                    # Extraer datos
-                    extractor = InvoiceDataExtractor()
-                    if extractor.extract_text_from_image(image):
-                        extracted_data = {
-                            "proveedor": extractor.extract_provider(),
-                            "monto": extractor.extract_amount(),
-                            "fecha": extractor.extract_date(),
-                            "numero_factura": extractor.extract_invoice_number(),
-                            "ruc": extractor.extract_ruc(),
-                            "archivo_procesado": file.filename,
-                            "timestamp": datetime.now().isoformat(),
-                            "status": "success"
-                        }
-                    else:
-                        extracted_data = {
-                            "error": "No se pudo extraer texto",
-                            "archivo_procesado": file.filename,
-                            "status": "error"
-                        }
-                    
-                    results.append({
-                        "filename": file.filename,
-                        "result": extracted_data
-                    })
-                    
-                except Exception as e:
-                    logger.error(f"Error procesando {file.filename}: {str(e)}")
-                    results.append({
-                        "filename": file.filename,
-                        "result": {
-                            "error": f"Error procesando archivo: {str(e)}",
-                            "status": "error"
-                        }
-                    })
+        for item in iter_batch(uploads, handle, concurrency):
+            results.append((item.index, batch_entry(item)))
+        results = [entry for _, entry in sorted(results, key=lambda r: r[0])]
         
         return jsonify({
             "results": results,
             "total_processed": len(results),
+            "concurrencia": concurrency,
+            "tiempo_total_ms": round((time.perf_counter() - started) * 1000, 2),
+            **({"timings": timings(trace.spans, trace.elapsed())} if trace.include else {}),
             "status": "success"
         })
         
+    except (OCRProcessingError, AdmissionRejected) as e:
+        message, status_code, extra = document_error(e)
+        return error_response(message, status_code, **extra)
     except Exception as e:
         logger.error(f"Error en procesamiento por lotes: {str(e)}")
-        return jsonify({
-            "error": "Error en procesamiento por lotes",
-            "status": "error"
-        }), 500
+        return error_response("Error en procesamiento por lotes", 500)
+
+@app.route('/ocr/archive', methods=['POST'])
+def process_archive():
+    """
+    Endpoint para procesar un paquete ZIP o TAR (tar.gz, tar.bz2, tar.xz) de facturas
+    Recibe: el paquete como cuerpo de la petición (o en el campo multipart `file`)
+            y las opciones de /ocr/batch en la query string
+    Retorna: NDJSON con una línea por entrada soportada al terminar y un resumen final
+    """
+    trace = g.trace
+    try:
+        admit_batch()
+        values = request.args
+        options = parse_options(values)
+        trace.include = wants_timings(values)
+        record_params(trace, values)
+        budget = request_deadline().budget
+        try:
+            concurrency = resolve_concurrency(values.get('concurrency'))
+        except ValueError:
+            raise OCRProcessingError("concurrency debe ser un entero positivo")
+        
+        if (request.mimetype or '').startswith('multipart/'):
+            body = MultipartStream(request.stream, request.content_type)
+            part = next(body.iter_files('file'), None)
+            if part is None:
+                return error_response("No se proporcionó archivo", 400)
+            stream = io.BytesIO(part[1])
+        else:
+            stream = request.stream
+        # Las entradas se descomprimen de a una, al ritmo de la ventana de OCR
+        archive = ArchiveReader(stream)
+        logger.info(f"Procesando paquete {archive.format}")
+        return Response(stream_with_context(stream_batch(timed_uploads(iter(archive), trace),
+                                                         batch_handler(options, budget, trace),
+                                                         concurrency, summary=archive.stats, trace=trace)),
+                        mimetype=NDJSON_MIMETYPE, headers={'X-Accel-Buffering': 'no'})
+    
+    except (OCRProcessingError, AdmissionRejected) as e:
+        message, status_code, extra = document_error(e)
+        return error_response(message, status_code, **extra)
+    except Exception as e:
+        logger.error(f"Error procesando paquete: {str(e)}")
+        return error_response("Error procesando paquete", 500)
+
+@app.route('/ocr/jobs', methods=['POST'])
+def create_job():
+    """
+    Encola una factura para procesarla en segundo plano
+    Recibe: los mismos campos que /ocr
+    Retorna: 202 con el id del trabajo y la URL para consultarlo
+    """
+    try:
+        if 'file' not in request.files:
+            return error_response("No se proporcionó archivo", 400)
+        file = request.files['file']
+        if file.filename == '':
+            return error_response("No se seleccionó archivo", 400)
+        if not is_allowed_file(file.filename):
+            return error_response("Tipo de archivo no soportado", 400)
+        
+        options = parse_options(request.values)
+        # El plazo de la cabecera se aplica al procesamiento, no a la espera en cola
+        deadline = request_deadline()
+        job = get_job_manager(run_document).submit(file.read(), file.filename, options, deadline.budget)
+        status_url = f"/ocr/jobs/{job.id}"
+        response = jsonify({"job_id": job.id, "estado": job.state, "status_url": status_url, "status": "success"})
+        response.status_code = 202
+        response.headers['Location'] = status_url
+        return response
+    
+    except OCRProcessingError as e:
+        return error_response(e.message, e.status_code)
+    except JobQueueFullError:
+        logger.warning("Cola de trabajos OCR llena, petición rechazada")
+        return error_response("Cola de trabajos llena, reintente más tarde", 503)
+    except Exception as e:
+        logger.error(f"Error al encolar trabajo: {str(e)}")
+        return error_response("Error interno del servidor", 500)
+
+@app.route('/ocr/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Estado de un trabajo y, si terminó, su resultado o error"""
+    job = get_job_manager(run_document).get(job_id)
+    if job is None:
+        return error_response("Trabajo no encontrado", 404)
+    return jsonify({**job.to_dict(), "status": "success"})
+
+@app.route('/ocr/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancela un trabajo pendiente o elimina el resultado de uno terminado"""
+    job = get_job_manager(run_document).cancel(job_id)
+    if job is None:
+        return error_response("Trabajo no encontrado", 404)
+    return jsonify({"job_id": job.id, "estado": job.state, "status": "success"})
+
+@app.route('/stats', methods=['GET'])
+def service_stats():
+    """Estadísticas del ejecutor OCR (cola, utilización y espera), de la caché, de los trabajos, del reparto de núcleos, de la admisión, de la coalescencia y de la grabación de tráfico"""
+    cache = get_result_cache()
+    return jsonify({
+        "executor": get_executor().stats(),
+        "cache": cache.stats() if cache else None,
+        "jobs": get_job_manager(run_document).stats(),
+        "governor": get_governor().stats(),
+        "admission": get_admission_controller().stats() if get_admission_controller() else None,
+        "coalescing": get_single_flight().stats(),
+        "similar": get_similarity_index().stats() if get_similarity_index() is not None else None,
+        "templates": get_template_store().stats() if get_template_store() is not None else None,
+        "recorder": get_recorder().stats() if get_recorder() is not None else None
+    })
 
 if __name__ == '__main__':
     # Configurar puerto desde variable de entorno o usar 5000 por defecto
@@ -291,5 +567,11 @@ if __name__ == '__main__':
     logger.info("  GET  /health - Verificar estado del servicio")
     logger.info("  POST /ocr - Procesar factura individual")
     logger.info("  POST /ocr/batch - Procesar múltiples facturas")
+    logger.info("  POST /ocr/archive - Procesar paquete ZIP/TAR de facturas")
+    logger.info("  POST /ocr/jobs - Encolar factura (asíncrono)")
+    logger.info("  GET  /ocr/jobs/<id> - Estado y resultado de un trabajo")
+    logger.info("  DELETE /ocr/jobs/<id> - Cancelar un trabajo")
+    logger.info("  GET  /stats - Estadísticas del ejecutor OCR")
+    logger.info("  GET  /metrics - Métricas en formato Prometheus")
     
     app.run(host='0.0.0.0', port=port, debug=False) 
\ No newline at end of file
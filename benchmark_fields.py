@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark del motor de campos en una pasada frente a los métodos extract_*
+Usa salidas OCR grandes (p. ej. 50 páginas concatenadas) y verifica que ambos
+caminos devuelvan los mismos valores
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from ocr_fields import extract_fields, field_values
+from ocr_pipeline import InvoiceDataExtractor
+
+HEADER = [
+    "RAZÓN SOCIAL: COMERCIAL EJEMPLO S.A.",
+    "RUC: 1790012345001",
+    "FACTURA N°: 001-008-004080008",
+    "FECHA DE EMISIÓN: 15/06/2024",
+]
+FOOTER = ["SUBTOTAL 12% 120.00", "IVA 12% 14.40", "VALOR TOTAL USD 134.40"]
+
+
+def build_ocr_text(pages: int, lines_per_page: int = 60, fields: str = 'first') -> str:
+    """
+    Texto OCR sintético de varias páginas con renglones de detalle
+    fields: 'first' (campos en la primera página), 'last' (al final) o 'none'
+    """
+    rng = random.Random(7)
+    body = []
+    for page in range(pages):
+        for i in range(lines_per_page):
+            body.append(f"{rng.randint(1, 99):>3} Servicio {page}-{i} de mantenimiento preventivo "
+                        f"{rng.randint(1, 999)}.{rng.randint(0, 99):02d} {rng.randint(1, 9999)}.00")
+    if fields == 'first':
+        lines = HEADER + body[:lines_per_page] + FOOTER + body[lines_per_page:]
+    elif fields == 'last':
+        lines = body + HEADER + FOOTER
+    else:
+        lines = body
+    return "\n".join(lines)
+
+
+def legacy_extract(text: str) -> dict:
+    extractor = InvoiceDataExtractor()
+    extractor.extracted_text = text
+    return {
+        "proveedor": extractor.extract_provider(),
+        "monto": extractor.extract_amount(),
+        "fecha": extractor.extract_date(),
+        "numero_factura": extractor.extract_invoice_number(),
+        "ruc": extractor.extract_ruc(),
+    }
+
+
+def single_pass_extract(text: str) -> dict:
+    return field_values(extract_fields(text))
+
+
+def median_ms(func, text: str, iterations: int) -> float:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(text)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark de extracción de campos")
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    for fields in ('first', 'last', 'none'):
+        text = build_ocr_text(args.pages, fields=fields)
+        legacy, single = legacy_extract(text), single_pass_extract(text)
+        assert legacy == single, f"Resultados distintos ({fields}): {legacy} != {single}"
+        legacy_ms = median_ms(legacy_extract, text, args.iterations)
+        single_ms = median_ms(single_pass_extract, text, args.iterations)
+        print(f"📄 {args.pages} páginas ({len(text) / 1024:.0f} KB), campos {fields:<5}  "
+              f"extract_*: {legacy_ms:8.2f}ms  una pasada: {single_ms:8.2f}ms  "
+              f"⚡ {legacy_ms / single_ms:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
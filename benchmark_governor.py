@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark del reparto de núcleos entre procesos OCR e hilos OpenMP
+Recorre configuraciones procesos x hilos por llamada (fijos o 'auto' con el
+gobernador) y mide la latencia de una factura con el servicio en reposo y el
+throughput con la cola llena
+"""
+
+import io
+import argparse
+import statistics
+import time
+
+from PIL import Image
+
+from benchmark_ocr_engine import build_sample_invoice
+from ocr_executor import OCRExecutor
+from ocr_governor import OCR_CPU_CORES, get_governor
+
+
+def ocr_page(png: bytes) -> int:
+    """Trabajo del proceso OCR: decodifica la imagen y la reconoce con el pool de motores"""
+    from ocr_engine import get_engine_pool
+    return len(get_engine_pool().recognize(Image.open(io.BytesIO(png))))
+
+
+def parse_threads(value: str):
+    return value if value == 'auto' else int(value)
+
+
+def run_config(png: bytes, workers: int, threads, documents: int, idle_runs: int) -> dict:
+    """Mide una configuración con un ejecutor nuevo (sus procesos heredan el modo del gobernador)"""
+    governor = get_governor()
+    governor.fixed_threads = None if threads == 'auto' else threads
+    executor = OCRExecutor(max_workers=workers, queue_size=documents)
+    try:
+        # Calentamiento: cada proceso carga su motor antes de medir
+        for future in [executor.submit(ocr_page, png) for _ in range(workers)]:
+            executor.result(future)
+
+        idle = []
+        for _ in range(idle_runs):
+            start = time.perf_counter()
+            executor.result(executor.submit(ocr_page, png))
+            idle.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        for future in [executor.submit(ocr_page, png) for _ in range(documents)]:
+            executor.result(future)
+        elapsed = time.perf_counter() - start
+    finally:
+        executor.shutdown()
+    return {"idle_ms": statistics.median(idle), "throughput": documents / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark procesos OCR x hilos OpenMP")
+    parser.add_argument('--image', help="Imagen a procesar (por defecto una factura sintética)")
+    parser.add_argument('--workers', default=None,
+                        help="Procesos OCR separados por coma (por defecto 1, núcleos/2 y núcleos)")
+    parser.add_argument('--threads', default='1,2,4,auto', help="Hilos por llamada separados por coma ('auto' = gobernador)")
+    parser.add_argument('--documents', type=int, default=None, help="Facturas por medición de throughput (por defecto 4 x núcleos)")
+    parser.add_argument('--idle-runs', type=int, default=5, help="Facturas medidas de a una con el servicio en reposo")
+    args = parser.parse_args()
+
+    cores = OCR_CPU_CORES
+    workers = sorted({int(w) for w in args.workers.split(',')} if args.workers else {1, max(1, cores // 2), cores})
+    threads = [parse_threads(t) for t in args.threads.split(',')]
+    documents = args.documents or 4 * cores
+    image = Image.open(args.image).convert('RGB') if args.image else build_sample_invoice()
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    png = buffer.getvalue()
+
+    print(f"📊 {cores} núcleos, {documents} facturas por medición, imagen {image.size[0]}x{image.size[1]}")
+    print(f"{'procesos':>8} {'hilos':>6} {'reposo p50':>12} {'throughput':>14}")
+    results = []
+    for w in workers:
+        for t in threads:
+            result = run_config(png, w, t, documents, args.idle_runs)
+            results.append((w, t, result))
+            oversubscribed = " (sobresuscrito)" if t != 'auto' and w * t > cores else ""
+            print(f"{w:>8} {str(t):>6} {result['idle_ms']:>10.1f}ms {result['throughput']:>9.2f} fact/s{oversubscribed}")
+
+    best_latency = min(results, key=lambda r: r[2]['idle_ms'])
+    best_throughput = max(results, key=lambda r: r[2]['throughput'])
+    print(f"⚡ Menor latencia en reposo: {best_latency[0]} procesos x {best_latency[1]} hilos; "
+          f"mayor throughput: {best_throughput[0]} procesos x {best_throughput[1]} hilos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark del pool de motores Tesseract frente a pytesseract
+Compara la latencia por factura y el throughput de ambos caminos OCR
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytesseract
+from PIL import Image, ImageDraw
+
+from ocr_engine import OCR_CONFIG, OCR_LANG, TesseractEnginePool
+
+
+def build_sample_invoice() -> Image.Image:
+    """Genera una factura de prueba con los campos que busca el extractor"""
+    img = Image.new('RGB', (1240, 800), color='white')
+    draw = ImageDraw.Draw(img)
+    lines = [
+        "RAZÓN SOCIAL: COMERCIAL EJEMPLO S.A.",
+        "RUC: 1790012345001",
+        "FACTURA N°: 001-008-004080008",
+        "FECHA DE EMISIÓN: 15/06/2024",
+        "DESCRIPCIÓN               CANT    P.UNIT    TOTAL",
+        "Servicio de consultoría      1    120.00   120.00",
+        "SUBTOTAL 12%                                 120.00",
+        "IVA 12%                                       14.40",
+        "VALOR TOTAL USD 134.40",
+    ]
+    y = 40
+    for line in lines:
+        draw.text((40, y), line, fill='black')
+        y += 40
+    return img
+
+
+def run_pytesseract(image):
+    return pytesseract.image_to_string(image, config=OCR_CONFIG, lang=OCR_LANG)
+
+
+def measure(func, image, iterations: int, threads: int) -> dict:
+    """Ejecuta `func` sobre la imagen y devuelve estadísticas de latencia"""
+    latencies = []
+
+    def timed_call(_):
+        start = time.perf_counter()
+        func(image)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(timed_call, range(iterations)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        "throughput": iterations / elapsed,
+    }
+
+
+def print_result(name: str, result: dict):
+    print(f"{name:<14} media={result['mean_ms']:8.1f}ms  p50={result['p50_ms']:8.1f}ms  "
+          f"p95={result['p95_ms']:8.1f}ms  {result['throughput']:6.2f} facturas/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pool de motores vs pytesseract")
+    parser.add_argument('--image', help="Imagen a procesar (por defecto una factura sintética)")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=1, help="Peticiones concurrentes")
+    parser.add_argument('--pool-size', type=int, default=None, help="Motores en el pool (por defecto = threads)")
+    args = parser.parse_args()
+
+    image = Image.open(args.image).convert('RGB') if args.image else build_sample_invoice()
+
+    pool = TesseractEnginePool(size=args.pool_size or args.threads)
+    if pool.backend != 'tesserocr':
+        print("❌ tesserocr no está instalado: no hay pool persistente que comparar")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    pool.warm_up()
+    print(f"🔥 Inicialización de {pool.size} motor(es): {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    # Una llamada de calentamiento por camino para no medir cachés frías del SO
+    run_pytesseract(image)
+    pool.image_to_string(image)
+
+    print(f"📊 {args.iterations} iteraciones, {args.threads} hilo(s), imagen {image.size[0]}x{image.size[1]}")
+    baseline = measure(run_pytesseract, image, args.iterations, args.threads)
+    pooled = measure(pool.image_to_string, image, args.iterations, args.threads)
+    print_result("pytesseract", baseline)
+    print_result("pool motores", pooled)
+    print(f"⚡ Aceleración: {baseline['mean_ms'] / pooled['mean_ms']:.2f}x en latencia, "
+          f"{pooled['throughput'] / baseline['throughput']:.2f}x en throughput")
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark del preprocesamiento de imágenes previo al OCR
+Mide el costo de cada etapa NumPy y el tiempo de OCR ahorrado de punta a punta
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmark_ocr_engine import build_sample_invoice
+from ocr_engine import TesseractEnginePool
+from ocr_preprocess import PREPROCESS_STEPS, parse_steps, preprocess
+
+
+def build_phone_photo(megapixels: float = 12.0, angle: float = 2.0, noise: float = 12.0) -> Image.Image:
+    """Simula una foto de celular: factura ampliada, inclinada, con ruido y tinte de color"""
+    base = build_sample_invoice()
+    scale = (megapixels * 1e6 / (base.size[0] * base.size[1])) ** 0.5
+    photo = base.resize((int(base.size[0] * scale), int(base.size[1] * scale)), Image.BICUBIC)
+    photo = photo.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=(235, 230, 220))
+    pixels = np.asarray(photo).astype(np.int16)
+    rng = np.random.default_rng(42)
+    pixels = pixels + rng.normal(0, noise, pixels.shape).astype(np.int16) - np.array([0, 5, 15], dtype=np.int16)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del preprocesamiento previo al OCR")
+    parser.add_argument('--image', help="Imagen a procesar (por defecto una foto sintética)")
+    parser.add_argument('--megapixels', type=float, default=12.0)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--steps', default=",".join(PREPROCESS_STEPS), help="Etapas a medir")
+    parser.add_argument('--skip-ocr', action='store_true', help="Medir solo el preprocesamiento")
+    args = parser.parse_args()
+
+    image = Image.open(args.image).convert('RGB') if args.image else build_phone_photo(args.megapixels)
+    steps = parse_steps(args.steps)
+    print(f"📷 Imagen {image.size[0]}x{image.size[1]} ({image.size[0] * image.size[1] / 1e6:.1f} MP)")
+
+    # Costo por etapa (cada etapa recibe la salida de la anterior, como en el pipeline)
+    per_step = {step: [] for step in steps}
+    for _ in range(args.iterations):
+        pixels, report = preprocess(image, steps)
+        for step, ms in report["etapas_ms"].items():
+            per_step[step].append(ms)
+    print(f"\n⏱️  Costo por etapa (mediana de {args.iterations}):")
+    for step, values in per_step.items():
+        print(f"   {step:<10} {statistics.median(values):8.1f}ms")
+    print(f"   {'total':<10} {sum(statistics.median(v) for v in per_step.values()):8.1f}ms")
+    print(f"   salida {report['tamano_final'][0]}x{report['tamano_final'][1]}, "
+          f"DPI efectivo {report['dpi_efectivo']}, ángulo corregido {report.get('angulo_corregido', 0.0)}°")
+
+    if args.skip_ocr:
+        return
+
+    pool = TesseractEnginePool(size=1)
+
+    def ocr_time(prepare):
+        start = time.perf_counter()
+        pool.image_to_string(prepare())
+        return (time.perf_counter() - start) * 1000
+
+    pool.image_to_string(build_sample_invoice())  # Calentamiento del motor
+    raw = [ocr_time(lambda: image) for _ in range(args.iterations)]
+    prepared = [ocr_time(lambda: preprocess(image, steps)[0]) for _ in range(args.iterations)]
+    raw_ms, prepared_ms = statistics.median(raw), statistics.median(prepared)
+    print(f"\n🔍 OCR de punta a punta (mediana, backend {pool.backend}):")
+    print(f"   sin preprocesar   {raw_ms:8.1f}ms")
+    print(f"   con preprocesado  {prepared_ms:8.1f}ms (incluye preprocesamiento)")
+    print(f"   ⚡ Ahorro: {raw_ms - prepared_ms:.1f}ms ({(1 - prepared_ms / raw_ms) * 100:.1f}%)")
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks por etapa del pipeline OCR con facturas ecuatorianas sintéticas
+Genera facturas con PIL (razón social, RUC con dígito verificador, número de
+factura, FECHA DE EMISIÓN, detalle y VALOR TOTAL USD) a distintas resoluciones,
+con ruido de foto y como PDF de varias páginas, y mide en proceso cada etapa
+del camino de /ocr: clave de caché, admisión, similitud, decodificación, capa
+de texto, rasterizado, preprocesamiento, OCR, extracción y serialización.
+Los resultados se guardan como JSON; `compare` marca las etapas que se
+volvieron más lentas que la línea base con significancia estadística.
+
+    python benchmark_stages.py baseline                  # mide y guarda la línea base
+    python benchmark_stages.py compare                   # mide y compara con la línea base
+    python benchmark_stages.py run --output actual.json  # solo mide
+    python benchmark_stages.py compare actual.json       # compara un resultado guardado
+    python benchmark_stages.py generate --output-dir facturas --count 20
+"""
+
+import io
+import gc
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from ocr_cache import cache_key
+from ocr_admission import estimate_megapixels
+from ocr_similar import document_hashes
+from ocr_layout import build_text
+from ocr_pipeline import OCR_PDF_DPI, InvoiceDataExtractor, load_image
+from ocr_preprocess import parse_steps, preprocess
+
+DEFAULT_BASELINE = os.path.join('benchmarks', 'stages_baseline.json')
+STAGES = ('cache', 'admision', 'similitud', 'decodificacion', 'capa_texto', 'rasterizado',
+          'preprocesamiento', 'ocr', 'extraccion', 'serializacion')
+
+# Casos por defecto: (nombre, formato, dpi, páginas, ruido)
+CASES = (
+    ('png-150dpi', 'png', 150, 1, 0.0),
+    ('png-300dpi', 'png', 300, 1, 0.0),
+    ('jpg-foto-200dpi', 'jpg', 200, 1, 12.0),
+    ('pdf-3pag-200dpi', 'pdf', 200, 3, 4.0),
+)
+
+_A4_INCHES = (8.27, 11.69)
+_FONT_PATHS = ('DejaVuSans.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 'arial.ttf')
+_PROVIDERS = ("COMERCIAL ANDINA S.A.", "DISTRIBUIDORA DEL PACÍFICO CÍA. LTDA.", "FARMACIAS SAN JOSÉ S.A.",
+              "SERVICIOS TÉCNICOS QUITO S.A.S.", "IMPORTADORA GUAYAS S.A.", "PAPELERÍA LA ESQUINA CÍA. LTDA.")
+_ITEMS = ("Servicio de consultoría", "Resma papel bond A4", "Mantenimiento preventivo", "Licencia de software",
+          "Tóner impresora láser", "Transporte de mercadería", "Capacitación técnica", "Alquiler de equipo")
+_IVA = 0.15
+# Muestras de una etapa: cada una dura al menos esto (se repite la llamada si es más rápida)
+_MIN_SAMPLE_SECONDS = 0.005
+
+
+# --- Facturas sintéticas -------------------------------------------------------
+
+def ruc_sociedad(rng: random.Random) -> str:
+    """RUC de sociedad privada (tercer dígito 9) con dígito verificador módulo 11 y sufijo 001"""
+    coefficients = (4, 3, 2, 7, 6, 5, 4, 3, 2)
+    while True:
+        digits = [*divmod(rng.randint(1, 24), 10), 9] + [rng.randint(0, 9) for _ in range(6)]
+        check = 11 - sum(d * c for d, c in zip(digits, coefficients)) % 11
+        if check == 10:
+            continue
+        return ''.join(map(str, digits)) + str(check % 11) + '001'
+
+
+def invoice_content(rng: random.Random, item_count: int) -> Dict[str, Any]:
+    """Campos y detalle de una factura; `esperado` son los valores que debe extraer el pipeline"""
+    items = []
+    for _ in range(item_count):
+        quantity = rng.randint(1, 5)
+        price = round(rng.uniform(0.5, 150), 2)
+        items.append((rng.choice(_ITEMS), quantity, price, round(quantity * price, 2)))
+    subtotal = round(sum(i[3] for i in items), 2)
+    iva = round(subtotal * _IVA, 2)
+    issued = date(2024, 1, 1) + timedelta(days=rng.randint(0, 700))
+    return {
+        "proveedor": rng.choice(_PROVIDERS),
+        "ruc": ruc_sociedad(rng),
+        "numero_factura": f"{rng.randint(1, 9):03d}-{rng.randint(1, 20):03d}-{rng.randint(1, 999999999):09d}",
+        "fecha": issued.strftime("%d/%m/%Y"),
+        "subtotal": subtotal,
+        "iva": iva,
+        "monto": round(subtotal + iva, 2),
+        "items": items,
+    }
+
+
+def _font(size: int) -> ImageFont.ImageFont:
+    for path in _FONT_PATHS:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def _page_lines(content: Dict[str, Any], items: List[tuple], page: int, pages: int) -> List[str]:
+    """Líneas de una página: encabezado en todas, detalle repartido y totales en la última"""
+    lines = [
+        f"RAZÓN SOCIAL: {content['proveedor']}",
+        f"RUC: {content['ruc']}",
+        f"FACTURA N°: {content['numero_factura']}",
+        f"FECHA DE EMISIÓN: {content['fecha']}",
+        "DIRECCIÓN MATRIZ: Av. Amazonas N34-120 y Av. Colón, Quito",
+        "",
+        f"{'DESCRIPCIÓN':<30} {'CANT':>5} {'P.UNIT':>10} {'TOTAL':>10}",
+    ]
+    lines += [f"{name:<30} {qty:>5} {price:>10.2f} {total:>10.2f}" for name, qty, price, total in items]
+    if page == pages:
+        lines += [
+            "",
+            f"SUBTOTAL 15%: {content['subtotal']:.2f}",
+            f"IVA 15%: {content['iva']:.2f}",
+            f"VALOR TOTAL USD {content['monto']:.2f}",
+        ]
+    lines += ["", f"Página {page} de {pages}"]
+    return lines
+
+
+def render_page(lines: List[str], dpi: int, page: int) -> Tuple[Image.Image, List[Dict[str, Any]]]:
+    """
+    Dibuja una página A4 a `dpi` con letra de 10 pt y devuelve la imagen y las
+    cajas de palabra en el formato del motor OCR (las de la página sin ruido)
+    """
+    width, height = round(_A4_INCHES[0] * dpi), round(_A4_INCHES[1] * dpi)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    font = _font(max(8, round(10 / 72 * dpi)))
+    margin = round(0.8 * dpi)
+    line_height = round(16 / 72 * dpi)
+    space = draw.textlength(' ', font=font)
+    words = []
+    y = margin
+    for line_number, line in enumerate(lines):
+        x = margin
+        for chunk in line.split(' '):
+            if chunk:
+                draw.text((x, y), chunk, fill='black', font=font)
+                left, top, right, bottom = draw.textbbox((x, y), chunk, font=font)
+                words.append({"text": chunk, "conf": 95.0, "left": left, "top": top,
+                              "right": right, "bottom": bottom, "line": line_number, "page": page})
+            x += draw.textlength(chunk, font=font) + space
+        y += line_height
+    return image, words
+
+
+def add_noise(image: Image.Image, rng: random.Random, noise: float) -> Image.Image:
+    """Foto de una factura: leve giro, fondo gris desparejo y ruido gaussiano"""
+    if noise <= 0:
+        return image
+    image = image.rotate(rng.uniform(-2.0, 2.0), resample=Image.BILINEAR, fillcolor=(235, 235, 230))
+    pixels = np.asarray(image, dtype=np.float32)
+    gradient = np.linspace(0, 25, pixels.shape[1], dtype=np.float32)[None, :, None]
+    noisy = pixels - gradient + np.random.default_rng(rng.randint(0, 2 ** 32)).normal(0, noise, pixels.shape)
+    return Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+
+
+def build_invoice(rng: random.Random, fmt: str = 'png', dpi: int = 200, pages: int = 1,
+                  noise: float = 0.0) -> Dict[str, Any]:
+    """
+    Factura sintética lista para subir: bytes, nombre, imágenes y palabras de
+    cada página (como llegarían al preprocesamiento y a la extracción) y valores esperados
+    """
+    content = invoice_content(rng, item_count=rng.randint(6, 14) * pages)
+    per_page = math.ceil(len(content["items"]) / pages)
+    images, words = [], []
+    for page in range(1, pages + 1):
+        items = content["items"][(page - 1) * per_page:page * per_page]
+        image, page_words = render_page(_page_lines(content, items, page, pages), dpi, page)
+        images.append(add_noise(image, rng, noise))
+        words.extend(page_words)
+
+    buffer = io.BytesIO()
+    if fmt == 'pdf':
+        images[0].save(buffer, format='PDF', save_all=True, append_images=images[1:], resolution=dpi)
+    elif fmt == 'jpg':
+        images[0].save(buffer, format='JPEG', quality=80, dpi=(dpi, dpi))
+    else:
+        images[0].save(buffer, format='PNG', dpi=(dpi, dpi))
+    expected = {k: content[k] for k in ("proveedor", "ruc", "numero_factura", "monto")}
+    expected["fecha"] = content["fecha"]
+    return {
+        "data": buffer.getvalue(),
+        "filename": f"factura-{content['ruc']}.{fmt}",
+        "images": images,
+        "words": words,
+        "page_sizes": {page: images[page - 1].size for page in range(1, pages + 1)},
+        "esperado": expected,
+    }
+
+
+# --- Etapas ----------------------------------------------------------------------
+
+def _poppler_available() -> bool:
+    try:
+        subprocess.run(['pdfinfo', '-v'], capture_output=True, timeout=5)
+        return True
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+def _tesseract_available() -> bool:
+    from ocr_engine import tesseract_status
+    return tesseract_status()["available"]
+
+
+def stage_calls(invoice: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    """
+    Función sin argumentos por etapa para una factura, o el motivo por el que
+    la etapa no aplica o no se puede medir aquí
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path
+    from ocr_textlayer import extract_text_layer
+
+    data, filename = invoice["data"], invoice["filename"]
+    is_pdf = filename.endswith('.pdf')
+    pages = len(invoice["images"])
+    steps = parse_steps(None)
+    pixels, _ = preprocess(invoice["images"][0], steps)
+    pdf_path = os.path.join(workdir, filename)
+    if is_pdf:
+        with open(pdf_path, 'wb') as f:
+            f.write(data)
+    poppler = _poppler_available()
+
+    def extraction():
+        extractor = InvoiceDataExtractor()
+        extractor.words = [dict(w) for w in invoice["words"]]
+        extractor.extracted_text = build_text(extractor.words)
+        return extractor.locate_fields(invoice["page_sizes"])
+
+    result = {"campos": extraction(), "texto_completo": "x" * 500, "archivo_procesado": filename,
+              "paginas_procesadas": list(range(1, pages + 1)), "status": "success"}
+
+    def recognize():
+        from ocr_engine import get_engine_pool
+        return get_engine_pool().recognize(pixels)
+
+    def rasterize():
+        for path in convert_from_path(pdf_path, dpi=OCR_PDF_DPI, first_page=1, last_page=1, output_folder=workdir,
+                                      fmt='ppm', single_file=True, paths_only=True):
+            os.remove(path)
+
+    def decode_image():
+        load_image(data).load()
+
+    no_poppler = "requiere poppler (pdfinfo/pdftoppm)"
+    calls = {
+        "cache": lambda: cache_key(data, {}),
+        "admision": lambda: estimate_megapixels(data, filename),
+        "similitud": (lambda: document_hashes(data, filename)) if poppler or not is_pdf else no_poppler,
+        "decodificacion": (lambda: pdfinfo_from_path(pdf_path)) if is_pdf else decode_image,
+        "capa_texto": (lambda: extract_text_layer(pdf_path, range(1, pages + 1))) if is_pdf else "solo PDF",
+        "rasterizado": rasterize if is_pdf else "solo PDF",
+        "preprocesamiento": lambda: preprocess(invoice["images"][0], steps),
+        "ocr": recognize if _tesseract_available() else "requiere Tesseract con spa+eng",
+        "extraccion": extraction,
+        "serializacion": lambda: json.dumps(result, ensure_ascii=False),
+    }
+    if is_pdf and not poppler:
+        calls.update({stage: no_poppler for stage in ("decodificacion", "capa_texto", "rasterizado")})
+    return calls
+
+
+def measure(fn: Callable[[], Any], repeats: int, warmup: int = 1) -> Tuple[List[float], int]:
+    """
+    Muestras en ms por llamada; las llamadas muy rápidas se repiten dentro de
+    cada muestra (como timeit) para que la resolución del reloj no domine
+    """
+    for _ in range(warmup):
+        fn()
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - started >= _MIN_SAMPLE_SECONDS or loops >= 10000:
+            break
+        loops *= 10
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            for _ in range(loops):
+                fn()
+            samples.append((time.perf_counter() - started) * 1000 / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return samples, loops
+
+
+def summarize_samples(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "median_ms": round(statistics.median(ordered), 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+        "mean_ms": round(statistics.mean(ordered), 4),
+        "stdev_ms": round(statistics.stdev(ordered), 4) if len(ordered) > 1 else 0.0,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(case_names: Optional[List[str]], stage_names: Optional[List[str]], repeats: int,
+              seed: int) -> Dict[str, Any]:
+    """Mide cada etapa de cada caso y devuelve el documento JSON de resultados"""
+    cases = [c for c in CASES if not case_names or c[0] in case_names]
+    stages = [s for s in STAGES if not stage_names or s in stage_names]
+    results, skipped = {}, {}
+    print(f"📊 {len(cases)} casos x {len(stages)} etapas, {repeats} muestras por etapa")
+    with tempfile.TemporaryDirectory(prefix='ocr-bench-') as workdir:
+        for index, (name, fmt, dpi, pages, noise) in enumerate(cases):
+            invoice = build_invoice(random.Random(seed + index), fmt, dpi, pages, noise)
+            calls = stage_calls(invoice, workdir)
+            print(f"\n📄 {name}: {len(invoice['data']) / 1024:.0f} KB, {pages} página(s), "
+                  f"{invoice['images'][0].size[0]}x{invoice['images'][0].size[1]}")
+            for stage in stages:
+                call = calls[stage]
+                if isinstance(call, str):
+                    skipped[f"{name}/{stage}"] = call
+                    print(f"  {stage:<17} ⏭️  {call}")
+                    continue
+                samples, loops = measure(call, repeats)
+                summary = summarize_samples(samples)
+                results[f"{name}/{stage}"] = {**summary, "loops": loops, "samples_ms": [round(s, 4) for s in samples]}
+                print(f"  {stage:<17} p50={summary['median_ms']:>10.3f}ms  p95={summary['p95_ms']:>10.3f}ms")
+    return {
+        "metadata": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": seed,
+            "repeats": repeats,
+        },
+        "results": results,
+        "omitidas": skipped,
+    }
+
+
+# --- Comparación -------------------------------------------------------------------
+
+def mann_whitney_greater(current: List[float], baseline: List[float]) -> float:
+    """
+    p-valor unilateral de Mann-Whitney U (aproximación normal con corrección por
+    empates y continuidad) para la hipótesis de que `current` es más lento
+    """
+    n1, n2 = len(current), len(baseline)
+    combined = sorted([(v, 0) for v in current] + [(v, 1) for v in baseline])
+    ranks = [0.0] * len(combined)
+    tie_term = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        tie_term += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+    u = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 0) - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], alpha: float, min_change: float) -> List[Dict[str, Any]]:
+    """
+    Filas por etapa común a ambos resultados; una regresión exige p < alpha y
+    que la mediana crezca al menos `min_change` (fracción)
+    """
+    rows = []
+    for key, base in baseline["results"].items():
+        now = current["results"].get(key)
+        if now is None:
+            continue
+        ratio = now["median_ms"] / base["median_ms"] if base["median_ms"] else 1.0
+        p_slower = mann_whitney_greater(now["samples_ms"], base["samples_ms"])
+        p_faster = mann_whitney_greater(base["samples_ms"], now["samples_ms"])
+        if p_slower < alpha and ratio >= 1 + min_change:
+            verdict = "regresion"
+        elif p_faster < alpha and ratio <= 1 / (1 + min_change):
+            verdict = "mejora"
+        else:
+            verdict = "igual"
+        rows.append({"etapa": key, "base_ms": base["median_ms"], "actual_ms": now["median_ms"],
+                     "cambio": round(ratio - 1, 4), "p": round(min(p_slower, p_faster), 6), "veredicto": verdict})
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]], current: Dict[str, Any], baseline: Dict[str, Any]):
+    base_meta, now_meta = baseline["metadata"], current["metadata"]
+    print(f"\n📏 Línea base {base_meta.get('commit')} ({base_meta.get('timestamp')}) "
+          f"vs actual {now_meta.get('commit')} ({now_meta.get('timestamp')})")
+    for field in ("python", "platform", "cpus"):
+        if base_meta.get(field) != now_meta.get(field):
+            print(f"⚠️  {field} distinto: {base_meta.get(field)} vs {now_meta.get(field)}; la comparación es orientativa")
+    icons = {"regresion": "🔴", "mejora": "🟢", "igual": "  "}
+    print(f"{'etapa':<36} {'base':>11} {'actual':>11} {'cambio':>8} {'p':>9}")
+    for row in rows:
+        print(f"{row['etapa']:<36} {row['base_ms']:>9.3f}ms {row['actual_ms']:>9.3f}ms "
+              f"{row['cambio'] * 100:>+7.1f}% {row['p']:>9.4f} {icons[row['veredicto']]}")
+    regressions = [r for r in rows if r["veredicto"] == "regresion"]
+    if regressions:
+        print(f"\n❌ {len(regressions)} etapa(s) más lentas con significancia estadística")
+    else:
+        print("\n✅ Sin regresiones significativas")
+
+
+# --- CLI -------------------------------------------------------------------------
+
+def load_json(path: str) -> Dict[str, Any]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_json(document: Dict[str, Any], path: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False, indent=1)
+    print(f"\n💾 Resultados guardados en {path}")
+
+
+def split_list(value: Optional[str]) -> Optional[List[str]]:
+    return [v.strip() for v in value.split(',')] if value else None
+
+
+def generate(output_dir: str, count: int, seed: int):
+    """Escribe facturas sintéticas de todos los casos y sus valores esperados"""
+    os.makedirs(output_dir, exist_ok=True)
+    expected = {}
+    rng = random.Random(seed)
+    for index in range(count):
+        _, fmt, dpi, pages, noise = CASES[index % len(CASES)]
+        invoice = build_invoice(rng, fmt, dpi, pages, noise)
+        filename = f"{index:04d}-{invoice['filename']}"
+        with open(os.path.join(output_dir, filename), 'wb') as f:
+            f.write(invoice["data"])
+        expected[filename] = invoice["esperado"]
+    with open(os.path.join(output_dir, 'esperado.json'), 'w', encoding='utf-8') as f:
+        json.dump(expected, f, ensure_ascii=False, indent=1)
+    print(f"✅ {count} facturas y esperado.json en {output_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks por etapa del pipeline OCR")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_run_arguments(command):
+        command.add_argument('--cases', help=f"Casos separados por coma ({', '.join(c[0] for c in CASES)})")
+        command.add_argument('--stages', help=f"Etapas separadas por coma ({', '.join(STAGES)})")
+        command.add_argument('--repeats', type=int, default=20, help="Muestras por etapa")
+        command.add_argument('--seed', type=int, default=1234, help="Semilla de las facturas sintéticas")
+
+    run = commands.add_parser('run', help="Mide las etapas")
+    add_run_arguments(run)
+    run.add_argument('--output', help="Archivo JSON de resultados")
+
+    baseline = commands.add_parser('baseline', help="Mide y guarda la línea base")
+    add_run_arguments(baseline)
+    baseline.add_argument('--output', default=DEFAULT_BASELINE, help="Archivo de la línea base")
+
+    comparison = commands.add_parser('compare', help="Compara con la línea base (código 1 si hay regresiones)")
+    add_run_arguments(comparison)
+    comparison.add_argument('current', nargs='?', help="Resultados guardados (por defecto se mide ahora)")
+    comparison.add_argument('--baseline', default=DEFAULT_BASELINE, help="Archivo de la línea base")
+    comparison.add_argument('--alpha', type=float, default=0.01, help="Nivel de significancia")
+    comparison.add_argument('--min-change', type=float, default=0.05,
+                            help="Aumento mínimo de la mediana para marcar una regresión (fracción)")
+    comparison.add_argument('--output', help="Guardar también los resultados medidos")
+
+    generator = commands.add_parser('generate', help="Escribe facturas sintéticas en un directorio")
+    generator.add_argument('--output-dir', required=True)
+    generator.add_argument('--count', type=int, default=len(CASES))
+    generator.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        generate(args.output_dir, args.count, args.seed)
+        return
+    if args.command == 'compare':
+        if not os.path.exists(args.baseline):
+            print(f"❌ No existe la línea base {args.baseline}; créela con `benchmark_stages.py baseline`")
+            sys.exit(2)
+        base = load_json(args.baseline)
+        current = load_json(args.current) if args.current else \
+            run_suite(split_list(args.cases), split_list(args.stages), args.repeats, base["metadata"].get("seed", args.seed))
+        if args.output:
+            save_json(current, args.output)
+        rows = compare(current, base, args.alpha, args.min_change)
+        print_comparison(rows, current, base)
+        sys.exit(1 if any(r["veredicto"] == "regresion" for r in rows) else 0)
+
+    document = run_suite(split_list(args.cases), split_list(args.stages), args.repeats, args.seed)
+    if args.output:
+        save_json(document, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -87,8 +87,14 @@ class CamundaOCRIntegration:
             # 1. Procesar factura con OCR
             with open(invoice_file_path, 'rb') as file:
                 files = {'file': file}
-                ocr_response = requests.post(f"{self.ocr_url}/ocr", files=files, timeout=30)
+                # Plazo del servicio por debajo del timeout del cliente: responde 504 antes de que se abandone
+                ocr_response = requests.post(f"{self.ocr_url}/ocr", files=files, timeout=30,
+                                             headers={'X-OCR-Deadline-Seconds': '25'})
             
+            if ocr_response.status_code == 429:
+                # Servicio saturado: la tarea queda pendiente para el próximo ciclo, sin reintentar ahora
+                logger.warning(f"Servicio OCR saturado, reintentar en {ocr_response.headers.get('Retry-After', '?')}s")
+                return False
             if ocr_response.status_code != 200:
                 logger.error(f"Error en OCR: {ocr_response.status_code}")
                 return False
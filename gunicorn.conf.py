@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Configuración de producción de Gunicorn para el microservicio OCR
+El maestro importa la aplicación y carga un motor Tesseract antes de crear los
+workers (preload_app), así que los workers web y los procesos OCR que estos
+crean con fork comparten las páginas del traineddata copy-on-write en lugar de
+cargarlo cada uno. Por defecto hay un solo worker web, dueño de un ejecutor con
+un proceso OCR por núcleo: los trabajos de /ocr/jobs viven en su memoria, así
+que con varios workers una consulta podría llegar a otro que no los conoce.
+
+Uso:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+_cores = multiprocessing.cpu_count()
+
+# Workers web: uno. Atiende E/S y espera al ejecutor, el OCR corre en sus procesos hijos.
+# Más de uno solo si no se usa /ocr/jobs (su estado es de cada worker)
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+# Procesos OCR por worker web: los núcleos repartidos entre los workers (se fija antes de importar la app)
+os.environ.setdefault('OCR_WORKERS', str(max(1, _cores // workers)))
+_ocr_workers = int(os.environ['OCR_WORKERS'])
+_ocr_queue = int(os.environ.get('OCR_QUEUE_SIZE', 2 * _ocr_workers))
+
+# Métricas: cada worker publica las suyas en un directorio común y /metrics suma todas
+os.environ.setdefault('OCR_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'ocr-metrics'))
+
+# Hilos por worker: los suficientes para ocupar el ejecutor y su cola, más los streams de lotes
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 2 * (_ocr_workers + _ocr_queue)))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+preload_app = True
+
+# Reciclado: cada worker se reemplaza tras N peticiones (con jitter para no reciclar todos a la
+# vez), salvo mientras retiene trabajos de /ocr/jobs (ver pre_request)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max(1, max_requests // 10)))
+# Al reciclar o detener se espera a las peticiones en curso hasta su plazo máximo
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT',
+                                      float(os.environ.get('OCR_MAX_DEADLINE_SECONDS', 300)) + 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    """Antes de importar la aplicación: las métricas de una ejecución anterior no se suman"""
+    shutil.rmtree(os.environ['OCR_METRICS_DIR'], ignore_errors=True)
+
+
+def when_ready(server):
+    """En el maestro, ya importada la aplicación y antes del fork de los workers"""
+    from ocr_engine import get_engine_pool
+    try:
+        # Un motor alcanza: cada proceso OCR usa uno y lo hereda al crearse con fork
+        loaded = get_engine_pool().warm_up(1)
+        server.log.info(f"Motor OCR precargado en el maestro ({loaded} motor/es)")
+    except Exception as e:
+        server.log.warning(f"No se pudo precargar el motor OCR en el maestro: {str(e)}")
+    server.log.info(f"{workers} workers web x {threads} hilos, {_ocr_workers} procesos OCR por worker, "
+                    f"reciclado cada {max_requests} peticiones")
+
+
+def pre_request(worker, req):
+    """
+    Posterga el reciclado mientras el worker tenga trabajos en cola, en proceso o
+    con resultado sin vencer: se perderían con él y su consulta devolvería 404
+    """
+    if worker.nr + 1 < worker.max_requests:
+        return
+    from ocr_jobs import retained_jobs
+    pending = retained_jobs()
+    if pending:
+        worker.max_requests = worker.nr + 2
+        worker.log.debug(f"Reciclado postergado: {pending} trabajos retenidos")
+
+
+def worker_exit(server, worker):
+    """Al salir un worker (reciclado o apagado) se detienen sus procesos OCR y se archivan sus métricas"""
+    from ocr_executor import get_executor
+    from ocr_metrics import REGISTRY
+    get_executor().shutdown(wait=False)
+    REGISTRY.archive()
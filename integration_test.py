@@ -63,6 +63,12 @@ class IntegrationTestSuite:
         """Prueba 1: Verificar que el servicio OCR esté disponible"""
         try:
             response = requests.get(f"{self.ocr_service_url}/health", timeout=10)
+            if response.status_code == 503:
+                # El servicio responde 503 cuando falta Tesseract o alguno de sus idiomas
+                data = response.json()
+                self.log_test_result("OCR Service Health Check", False,
+                                   f"Tesseract no disponible (idiomas faltantes: {data.get('idiomas_faltantes')})")
+                return False
             if response.status_code == 200:
                 data = response.json()
                 expected_fields = ['status', 'service', 'version', 'tesseract_available']
@@ -464,6 +470,119 @@ class IntegrationTestSuite:
             self.log_test_result("Performance Test", False, str(e))
             return False
     
+    def _invoice_image(self, title: str) -> bytes:
+        """Factura de prueba en memoria como PNG"""
+        from PIL import Image, ImageDraw
+        import io
+        
+        img = Image.new('RGB', (400, 200), color='white')
+        draw = ImageDraw.Draw(img)
+        draw.text((20, 20), title, fill='black')
+        draw.text((20, 60), "TOTAL: $125.50", fill='black')
+        buffer = io.BytesIO()
+        img.save(buffer, 'PNG')
+        return buffer.getvalue()
+    
+    def test_async_jobs(self) -> bool:
+        """Prueba 9: Trabajos asíncronos (encolar, consultar varias veces y eliminar)"""
+        try:
+            response = requests.post(f"{self.ocr_service_url}/ocr/jobs",
+                                   files={'file': ('job.png', self._invoice_image("FACTURA JOB"), 'image/png')},
+                                   timeout=10)
+            if response.status_code != 202:
+                self.log_test_result("Async Jobs", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            job_id = response.json()['job_id']
+            status_url = f"{self.ocr_service_url}/ocr/jobs/{job_id}"
+            
+            # Cada consulta debe encontrar el trabajo (el worker que lo tiene no se recicla)
+            state = None
+            for _ in range(60):
+                poll = requests.get(status_url, timeout=10)
+                if poll.status_code != 200:
+                    self.log_test_result("Async Jobs", False, f"Consulta HTTP {poll.status_code}: {poll.text}")
+                    return False
+                state = poll.json()['estado']
+                if state in ('completado', 'fallido'):
+                    break
+                time.sleep(0.5)
+            if state not in ('completado', 'fallido'):
+                self.log_test_result("Async Jobs", False, f"El trabajo no terminó (estado {state})")
+                return False
+            
+            # Con el resultado aún retenido sigue consultable, y DELETE lo elimina
+            if requests.get(status_url, timeout=10).status_code != 200:
+                self.log_test_result("Async Jobs", False, "El resultado no se conservó")
+                return False
+            if requests.delete(status_url, timeout=10).status_code != 200 or \
+                    requests.get(status_url, timeout=10).status_code != 404:
+                self.log_test_result("Async Jobs", False, "DELETE no eliminó el trabajo")
+                return False
+            if state != 'completado':
+                self.log_test_result("Async Jobs", False, f"Trabajo {job_id} fallido: {poll.json().get('error')}")
+                return False
+            self.log_test_result("Async Jobs", True, f"Trabajo {job_id} completado")
+            return True
+            
+        except Exception as e:
+            self.log_test_result("Async Jobs", False, str(e))
+            return False
+    
+    def test_archive_processing(self) -> bool:
+        """Prueba 10: Paquete ZIP procesado como NDJSON"""
+        try:
+            import io
+            import zipfile
+            
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w') as archive:
+                for i in range(2):
+                    archive.writestr(f"factura_{i + 1}.png", self._invoice_image(f"FACTURA ZIP {i + 1}"))
+                archive.writestr("notas.txt", "no es una factura")
+            
+            response = requests.post(f"{self.ocr_service_url}/ocr/archive", data=buffer.getvalue(),
+                                   headers={'Content-Type': 'application/zip'}, timeout=60)
+            if response.status_code != 200:
+                self.log_test_result("Archive Processing", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            lines = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+            entries = [line for line in lines if 'filename' in line]
+            if sorted(entry['filename'] for entry in entries) != ['factura_1.png', 'factura_2.png']:
+                self.log_test_result("Archive Processing", False, f"Entradas inesperadas: {lines}")
+                return False
+            self.log_test_result("Archive Processing", True, f"{len(entries)} entradas y resumen final")
+            return True
+            
+        except Exception as e:
+            self.log_test_result("Archive Processing", False, str(e))
+            return False
+    
+    def test_metrics_endpoint(self) -> bool:
+        """Prueba 11: Métricas Prometheus con etiquetas acotadas"""
+        try:
+            # Un nombre de archivo arbitrario no debe crear una serie propia
+            requests.post(f"{self.ocr_service_url}/ocr",
+                        files={'file': ('sonda-metricas.exe', b'contenido', 'application/octet-stream')}, timeout=10)
+            response = requests.get(f"{self.ocr_service_url}/metrics", timeout=10)
+            if response.status_code != 200:
+                self.log_test_result("Metrics Endpoint", False, f"HTTP {response.status_code}")
+                return False
+            text = response.text
+            expected = ['ocr_http_requests_total', 'ocr_executor_queue_depth', 'ocr_tesseract_available']
+            missing = [name for name in expected if name not in text]
+            if missing:
+                self.log_test_result("Metrics Endpoint", False, f"Métricas faltantes: {missing}")
+                return False
+            if 'file_type="exe"' in text or 'sonda-metricas' in text:
+                self.log_test_result("Metrics Endpoint", False, "El nombre del archivo llegó a las etiquetas")
+                return False
+            self.log_test_result("Metrics Endpoint", True, f"{len(text.splitlines())} líneas")
+            return True
+            
+        except Exception as e:
+            self.log_test_result("Metrics Endpoint", False, str(e))
+            return False
+    
     def run_all_tests(self) -> Dict[str, Any]:
         """Ejecuta todas las pruebas de integración"""
         logger.info("🚀 Iniciando Pruebas de Integración Completa")
@@ -478,7 +597,10 @@ class IntegrationTestSuite:
             ("Database Integration", self.test_database_integration),
             ("Batch Processing", self.test_batch_processing),
             ("Error Handling", self.test_error_handling),
-            ("Performance Test", self.test_performance)
+            ("Performance Test", self.test_performance),
+            ("Async Jobs", self.test_async_jobs),
+            ("Archive Processing", self.test_archive_processing),
+            ("Metrics Endpoint", self.test_metrics_endpoint)
         ]
         
         # Ejecutar pruebas
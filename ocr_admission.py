@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Control de admisión del OCR síncrono
+Lleva la cuenta de los documentos en proceso y de su volumen estimado en
+megapíxeles (las páginas de PDF se cuentan a OCR_PDF_DPI). Un documento nuevo se
+rechaza con 429 y un Retry-After calculado cuando superaría los límites o
+cuando, al ritmo medido con los documentos rasterizados, no terminaría dentro de
+su plazo. Así una ráfaga se devuelve rápido al cliente en lugar de hacer crecer
+la latencia de todos.
+"""
+
+import io
+import os
+import re
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from PIL import Image
+
+from ocr_deadline import Deadline
+from ocr_executor import OCR_QUEUE_SIZE, OCR_WORKERS, ExecutorBusyError
+from ocr_pipeline import DEFAULT_PAGES, OCR_MAX_PDF_PAGES, OCR_PDF_DPI, resolve_pages
+
+logger = logging.getLogger(__name__)
+
+OCR_ADMISSION_ENABLED = os.environ.get('OCR_ADMISSION_ENABLED', '1').lower() not in ('0', 'false', 'no')
+# Documentos en proceso (por defecto la capacidad del ejecutor: procesos + cola)
+OCR_ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('OCR_ADMISSION_MAX_IN_FLIGHT', OCR_WORKERS + OCR_QUEUE_SIZE))
+# Volumen en proceso (por defecto dos páginas A4 por lugar del ejecutor)
+OCR_ADMISSION_MAX_MEGAPIXELS = float(os.environ.get('OCR_ADMISSION_MAX_MEGAPIXELS',
+                                                    8 * (OCR_WORKERS + OCR_QUEUE_SIZE)))
+# Costo inicial por megapíxel hasta tener mediciones, y tope del Retry-After
+OCR_ADMISSION_SECONDS_PER_MP = float(os.environ.get('OCR_ADMISSION_SECONDS_PER_MP', 0.15))
+OCR_ADMISSION_MAX_RETRY_AFTER = int(os.environ.get('OCR_ADMISSION_MAX_RETRY_AFTER', 60))
+
+# Página A4 rasterizada a OCR_PDF_DPI
+_A4_MEGAPIXELS = 8.27 * 11.69 * OCR_PDF_DPI ** 2 / 1e6
+_PDF_PAGE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+# Peso de cada medición nueva en el promedio móvil del costo por megapíxel
+_EWMA_WEIGHT = 0.2
+# Intervalo máximo entre reintentos de un archivo de lote que espera lugar
+_WAIT_SECONDS = 1.0
+
+
+class AdmissionRejected(ExecutorBusyError):
+    """El documento no se admite ahora; `retry_after` es la espera sugerida en segundos"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason, retry_after)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return f"{self.reason} (reintentar en {self.retry_after}s)"
+
+
+def estimate_megapixels(data: bytes, filename: str, options: Optional[Dict[str, Any]] = None) -> float:
+    """
+    Volumen estimado de un documento sin decodificarlo: cabecera de la imagen, o
+    páginas seleccionadas del PDF (contando los objetos /Page) por una página A4
+    """
+    if filename.lower().endswith('.pdf'):
+        # Con object streams comprimidos no se ven los /Page: se asume una página
+        page_count = max(1, len(_PDF_PAGE.findall(data)))
+        spec = (options or {}).get('pages', DEFAULT_PAGES)
+        pages = len(resolve_pages(spec, min(page_count, OCR_MAX_PDF_PAGES)))
+        return max(1, pages) * _A4_MEGAPIXELS
+    try:
+        width, height = Image.open(io.BytesIO(data)).size
+    except Exception:
+        return 1.0
+    return width * height / 1e6
+
+
+class Admitted:
+    """
+    Lugar reservado por admit() para un documento
+    El llamador pone measured=False si el documento no se rasterizó (capa de
+    texto): su duración no dice nada del costo por megapíxel
+    """
+
+    def __init__(self, megapixels: float):
+        self.megapixels = megapixels
+        self.measured = True
+
+
+class AdmissionController:
+    """Documentos y megapíxeles en proceso, límites y ritmo medido para estimar esperas"""
+
+    def __init__(self, max_in_flight: int = OCR_ADMISSION_MAX_IN_FLIGHT,
+                 max_megapixels: float = OCR_ADMISSION_MAX_MEGAPIXELS, workers: int = OCR_WORKERS,
+                 seconds_per_mp: float = OCR_ADMISSION_SECONDS_PER_MP):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_megapixels = max_megapixels
+        self.workers = max(1, workers)
+        self.seconds_per_mp = seconds_per_mp
+        self._lock = threading.Lock()
+        # Avisa a los archivos de lote que esperan lugar cada vez que termina un documento
+        self._released = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._megapixels = 0.0
+        self._counters = {"admitted": 0, "rejected": 0, "rejected_deadline": 0}
+
+    def _drain_seconds(self, extra_mp: float = 0.0) -> float:
+        """Tiempo estimado para terminar lo que está en proceso (con el lock tomado)"""
+        return (self._megapixels + extra_mp) * self.seconds_per_mp / self.workers
+
+    def _reject(self, reason: str, counter: str = "rejected") -> AdmissionRejected:
+        self._counters[counter] += 1
+        retry_after = min(OCR_ADMISSION_MAX_RETRY_AFTER, max(1, math.ceil(self._drain_seconds())))
+        logger.warning(f"Admisión rechazada: {reason}; Retry-After {retry_after}s")
+        return AdmissionRejected(reason, retry_after)
+
+    def check(self):
+        """Rechaza de entrada una petición (p. ej. un lote) si el servicio ya está en su límite"""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight or self._megapixels >= self.max_megapixels:
+                raise self._reject("Servicio OCR saturado")
+
+    def _refusal(self, megapixels: float, deadline: Optional[Deadline]) -> Optional[Tuple[str, str]]:
+        """Motivo y contador si el documento no cabe ahora, o None (con el lock tomado)"""
+        # Un documento grande se admite igual si el servicio está vacío
+        if self._in_flight >= self.max_in_flight or \
+                (self._in_flight and self._megapixels + megapixels > self.max_megapixels):
+            return "Servicio OCR saturado", "rejected"
+        if deadline is not None and self._in_flight >= self.workers and \
+                self._drain_seconds(megapixels) > deadline.remaining():
+            return "El documento no terminaría dentro de su plazo", "rejected_deadline"
+        return None
+
+    @contextmanager
+    def admit(self, megapixels: float, deadline: Optional[Deadline] = None, wait: bool = False) -> Iterator[Admitted]:
+        """
+        Reserva lugar para un documento mientras se procesa; lanza AdmissionRejected
+        si no cabe. Con wait=True (archivos de un lote ya admitido) espera a que se
+        libere lugar mientras quede plazo y solo entonces lo rechaza
+        """
+        with self._released:
+            while True:
+                refusal = self._refusal(megapixels, deadline)
+                if refusal is None:
+                    break
+                remaining = deadline.remaining() if deadline is not None else 0.0
+                if not wait or remaining <= 0:
+                    raise self._reject(*refusal)
+                self._released.wait(min(remaining, _WAIT_SECONDS))
+            queued = self._in_flight >= self.workers
+            self._in_flight += 1
+            self._megapixels += megapixels
+            self._counters["admitted"] += 1
+        admitted = Admitted(megapixels)
+        started = time.perf_counter()
+        completed = False
+        try:
+            yield admitted
+            completed = True
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._released:
+                self._in_flight -= 1
+                self._megapixels = max(0.0, self._megapixels - megapixels)
+                self._released.notify_all()
+                # Solo se mide el ritmo con documentos rasterizados que no esperaron en cola
+                if completed and admitted.measured and not queued and megapixels > 0:
+                    self.seconds_per_mp += _EWMA_WEIGHT * (elapsed / megapixels - self.seconds_per_mp)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "megapixels": round(self._megapixels, 2),
+                "max_megapixels": self.max_megapixels,
+                "seconds_per_megapixel": round(self.seconds_per_mp, 4),
+                "estimated_drain_seconds": round(self._drain_seconds(), 2),
+                **self._counters,
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """Devuelve el control de admisión del proceso (None si está desactivado)"""
+    global _controller
+    if not OCR_ADMISSION_ENABLED:
+        return None
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
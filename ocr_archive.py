@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Lectura diferida de paquetes ZIP/TAR de facturas
+Recorre las entradas del paquete una a una y entrega en memoria los bytes de
+las que tienen una extensión soportada, sin extraer nada a disco. Los TAR (con
+o sin gzip/bz2/xz) se leen en streaming desde la petición; los ZIP necesitan el
+directorio central del final del archivo, así que el paquete comprimido se
+guarda en un archivo temporal acotado y sus entradas se descomprimen bajo
+demanda. Límites de entradas y de tamaño descomprimido, medidos sobre los bytes
+realmente leídos y no sobre los declarados, protegen de zip bombs.
+"""
+
+import os
+import logging
+import tarfile
+import tempfile
+import zipfile
+from typing import IO, Iterator, Tuple
+
+from ocr_pipeline import OCRProcessingError, is_allowed_file
+from ocr_multipart import OCR_MAX_FILE_BYTES
+
+logger = logging.getLogger(__name__)
+
+OCR_ARCHIVE_MAX_ENTRIES = int(os.environ.get('OCR_ARCHIVE_MAX_ENTRIES', 10000))
+OCR_ARCHIVE_MAX_BYTES = int(os.environ.get('OCR_ARCHIVE_MAX_BYTES', 2 * 1024 ** 3))  # Descomprimido total
+# Paquetes ZIP más pequeños que esto no tocan el disco
+_ZIP_SPOOL_BYTES = 16 * 1024 * 1024
+_CHUNK_BYTES = 1024 * 1024
+
+
+class _PrefixedStream:
+    """Stream de solo lectura que antepone los bytes ya leídos para detectar el formato"""
+
+    def __init__(self, prefix: bytes, stream: IO[bytes]):
+        self._prefix = prefix
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if self._prefix:
+            if size is None or size < 0:
+                data, self._prefix = self._prefix + self._stream.read(), b''
+                return data
+            data, self._prefix = self._prefix[:size], self._prefix[size:]
+            if len(data) < size:
+                data += self._stream.read(size - len(data))
+            return data
+        return self._stream.read(size)
+
+
+class ArchiveReader:
+    """Entradas soportadas de un paquete ZIP o TAR, con límites y contadores"""
+
+    def __init__(self, stream: IO[bytes], max_entries: int = OCR_ARCHIVE_MAX_ENTRIES,
+                 max_total_bytes: int = OCR_ARCHIVE_MAX_BYTES, max_entry_bytes: int = OCR_MAX_FILE_BYTES):
+        self.max_entries = max_entries
+        self.max_total_bytes = max_total_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = 0
+        self.skipped = 0
+        self.total_bytes = 0
+        # 512 bytes alcanzan para la cabecera ZIP y para la firma 'ustar' del TAR
+        head = stream.read(512)
+        self._stream = _PrefixedStream(head, stream)
+        if head.startswith(b'PK\x03\x04') or head.startswith(b'PK\x05\x06'):
+            self.format = 'zip'
+        elif head[:2] == b'\x1f\x8b' or head[:3] == b'BZh' or head[:6] == b'\xfd7zXZ\x00' or head[257:262] == b'ustar':
+            self.format = 'tar'
+        else:
+            raise OCRProcessingError("Formato de paquete no soportado (se esperaba ZIP o TAR)")
+
+    def _admit(self, name: str, declared_size: int) -> bool:
+        """Aplica los límites a una entrada; False si se omite por su extensión"""
+        if name.startswith('__MACOSX/') or os.path.basename(name).startswith('.') or not is_allowed_file(name):
+            self.skipped += 1
+            return False
+        self.entries += 1
+        if self.entries > self.max_entries:
+            raise OCRProcessingError(f"Demasiadas entradas en el paquete (máximo {self.max_entries})", 413)
+        if declared_size > self.max_entry_bytes:
+            raise OCRProcessingError(
+                f"Entrada demasiado grande: {name} (máximo {self.max_entry_bytes} bytes)", 413)
+        return True
+
+    def _read_entry(self, name: str, source: IO[bytes]) -> bytes:
+        """Lee una entrada sin confiar en el tamaño declarado y suma al total descomprimido"""
+        data = source.read(self.max_entry_bytes + 1)
+        if len(data) > self.max_entry_bytes:
+            raise OCRProcessingError(
+                f"Entrada demasiado grande: {name} (máximo {self.max_entry_bytes} bytes)", 413)
+        self.total_bytes += len(data)
+        if self.total_bytes > self.max_total_bytes:
+            raise OCRProcessingError(
+                f"Contenido descomprimido demasiado grande (máximo {self.max_total_bytes} bytes)", 413)
+        return data
+
+    def __iter__(self) -> Iterator[Tuple[str, bytes]]:
+        if self.format == 'zip':
+            return self._iter_zip()
+        return self._iter_tar()
+
+    def _iter_tar(self) -> Iterator[Tuple[str, bytes]]:
+        try:
+            with tarfile.open(fileobj=self._stream, mode='r|*') as archive:
+                for member in archive:
+                    if not member.isfile() or not self._admit(member.name, member.size):
+                        continue
+                    yield member.name, self._read_entry(member.name, archive.extractfile(member))
+        except tarfile.TarError as e:
+            raise OCRProcessingError(f"Paquete TAR inválido: {str(e)}")
+
+    def _iter_zip(self) -> Iterator[Tuple[str, bytes]]:
+        # Solo se guarda el paquete comprimido, acotado por el límite total
+        with tempfile.SpooledTemporaryFile(max_size=_ZIP_SPOOL_BYTES, prefix='ocr-zip-') as spool:
+            copied = 0
+            while True:
+                chunk = self._stream.read(_CHUNK_BYTES)
+                if not chunk:
+                    break
+                copied += len(chunk)
+                if copied > self.max_total_bytes:
+                    raise OCRProcessingError(
+                        f"Paquete demasiado grande (máximo {self.max_total_bytes} bytes)", 413)
+                spool.write(chunk)
+            spool.seek(0)
+            try:
+                archive = zipfile.ZipFile(spool)
+            except zipfile.BadZipFile as e:
+                raise OCRProcessingError(f"Paquete ZIP inválido: {str(e)}")
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not self._admit(info.filename, info.file_size):
+                        continue
+                    try:
+                        with archive.open(info) as source:
+                            data = self._read_entry(info.filename, source)
+                    except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+                        # Entrada cifrada o dañada: se informa como error de esa entrada
+                        logger.warning(f"No se pudo leer {info.filename} del paquete: {str(e)}")
+                        data = b''
+                    yield info.filename, data
+
+    def stats(self) -> dict:
+        return {"formato": self.format, "entradas": self.entries, "omitidas": self.skipped,
+                "bytes_descomprimidos": self.total_bytes}
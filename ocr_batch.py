@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Procesamiento concurrente de lotes de facturas
+Reparte los archivos de un lote entre hilos que alimentan el ejecutor de
+procesos OCR con una ventana de concurrencia por lote, y entrega cada resultado
+con su posición en el lote y su duración a medida que termina.
+"""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+from ocr_executor import OCR_WORKERS
+
+# Archivos de un mismo lote en proceso a la vez (por defecto uno por proceso OCR)
+OCR_BATCH_CONCURRENCY = int(os.environ.get('OCR_BATCH_CONCURRENCY', OCR_WORKERS))
+
+
+class BatchItem(NamedTuple):
+    """Resultado de un archivo del lote: valor devuelto o excepción, y duración"""
+    index: int
+    filename: str
+    result: Optional[Any]
+    error: Optional[Exception]
+    elapsed_ms: float
+
+
+def resolve_concurrency(requested: Optional[str], limit: int = OCR_BATCH_CONCURRENCY) -> int:
+    """Concurrencia pedida por el cliente, acotada a [1, OCR_BATCH_CONCURRENCY]"""
+    if not requested:
+        return max(1, limit)
+    value = int(requested)
+    if value < 1:
+        raise ValueError("concurrency debe ser un entero positivo")
+    return min(value, max(1, limit))
+
+
+def iter_batch(files: Iterable[Tuple[str, bytes]], handler: Callable[[bytes, str], Any],
+               concurrency: int = OCR_BATCH_CONCURRENCY) -> Iterator[BatchItem]:
+    """
+    Ejecuta handler(datos, nombre) para cada archivo con a lo sumo `concurrency`
+    a la vez y entrega los BatchItem en orden de finalización
+    `files` se consume de forma diferida: solo se toma el siguiente archivo cuando
+    hay lugar en la ventana, así que un iterador que lee la subida empieza el OCR
+    del primer archivo mientras llegan los demás y retiene como mucho `concurrency`
+    """
+    def timed(index: int, filename: str, data: bytes) -> BatchItem:
+        start = time.perf_counter()
+        try:
+            result, error = handler(data, filename), None
+        except Exception as e:
+            result, error = None, e
+        return BatchItem(index, filename, result, error, round((time.perf_counter() - start) * 1000, 2))
+
+    window = max(1, concurrency)
+    pending = set()
+    input_error = None
+    with ThreadPoolExecutor(max_workers=window, thread_name_prefix='ocr-batch') as pool:
+        try:
+            for index, item in enumerate(_guarded(files)):
+                if isinstance(item, Exception):
+                    # Falló la lectura de la entrada: se entregan los ya despachados antes de relanzar
+                    input_error = item
+                    break
+                while len(pending) >= window:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                filename, data = item
+                pending.add(pool.submit(timed, index, filename, data))
+                del item, data  # Solo el trabajo retiene los bytes del archivo
+                # Entregar lo que ya terminó mientras se recibía este archivo
+                done = {future for future in pending if future.done()}
+                pending -= done
+                for future in done:
+                    yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            # Si el consumidor abandona (p. ej. el cliente cierra el stream) no se empiezan los pendientes
+            for future in pending:
+                future.cancel()
+    if input_error is not None:
+        raise input_error
+
+
+def _guarded(files: Iterable[Tuple[str, bytes]]) -> Iterator[Any]:
+    """Entrega los elementos de `files` y, si su lectura falla, la excepción como último elemento"""
+    try:
+        yield from files
+    except Exception as e:
+        yield e
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Caché de resultados OCR direccionada por contenido
+Clave: hash SHA-256 de los bytes subidos más la configuración OCR. Dos niveles:
+LRU en memoria (tamaño y TTL) y disco (sobrevive a reinicios). El disco se barre
+periódicamente: se borran las entradas vencidas y, si aun así supera
+OCR_CACHE_MAX_DISK_MB, las escritas hace más tiempo.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ocr_engine import OCR_CONFIG, OCR_LANG
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_ENABLED = os.environ.get('OCR_CACHE_ENABLED', '1') == '1'
+OCR_CACHE_SIZE = int(os.environ.get('OCR_CACHE_SIZE', 512))            # Entradas en memoria
+OCR_CACHE_TTL_SECONDS = float(os.environ.get('OCR_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+OCR_CACHE_DIR = os.environ.get('OCR_CACHE_DIR', os.path.join('cache', 'ocr'))  # Vacío desactiva el disco
+OCR_CACHE_MAX_DISK_MB = float(os.environ.get('OCR_CACHE_MAX_DISK_MB', 1024))  # 0 sin límite de tamaño
+OCR_CACHE_SWEEP_SECONDS = float(os.environ.get('OCR_CACHE_SWEEP_SECONDS', 600))
+
+# Versión del formato de resultado: al cambiarla se ignoran las entradas anteriores
+RESULT_FORMAT_VERSION = 2
+# Un .tmp más viejo que esto quedó de un proceso que murió escribiendo
+_STALE_TMP_SECONDS = 3600
+
+
+def cache_key(data: bytes, options: Optional[Dict[str, Any]] = None) -> str:
+    """Hash del contenido subido y de todo lo que influye en el resultado OCR"""
+    digest = hashlib.sha256()
+    digest.update(f"v{RESULT_FORMAT_VERSION}|{OCR_LANG}|{OCR_CONFIG}|".encode('utf-8'))
+    digest.update(json.dumps(options or {}, sort_keys=True, default=str).encode('utf-8'))
+    digest.update(b'|')
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Caché de dos niveles (memoria LRU + disco) con contadores de aciertos"""
+
+    def __init__(self, max_entries: int = OCR_CACHE_SIZE, ttl_seconds: float = OCR_CACHE_TTL_SECONDS,
+                 directory: Optional[str] = OCR_CACHE_DIR):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.directory = directory or None
+        self._entries = OrderedDict()  # clave -> (guardado_en, resultado)
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                          "disk_evictions": 0}
+        self._sweeping = threading.Lock()
+        # El primer resultado guardado ya barre lo acumulado mientras el servicio estaba detenido
+        self._last_sweep = float('-inf')
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - stored_at > self.ttl_seconds
+
+    def _remember(self, key: str, stored_at: float, result: Dict[str, Any]):
+        """Inserta en el nivel de memoria expulsando las entradas menos usadas"""
+        with self._lock:
+            self._entries[key] = (stored_at, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """Devuelve (resultado, nivel) o None si no hay entrada vigente"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._entries.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return dict(entry[1]), "memory"
+                del self._entries[key]
+                self._counters["evictions"] += 1
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._remember(key, *entry)
+            with self._lock:
+                self._counters["disk_hits"] += 1
+            return dict(entry[1]), "disk"
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def peek(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Resultado vigente sin contarlo como acierto o fallo ni moverlo en el LRU
+        Para consultas internas (casi duplicados) que no son pedidos de un cliente
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                return dict(entry[1])
+        entry = self._read_disk(key)
+        return dict(entry[1]) if entry is not None else None
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """Guarda un resultado en ambos niveles"""
+        stored_at = time.time()
+        self._remember(key, stored_at, dict(result))
+        with self._lock:
+            self._counters["stores"] += 1
+        self._write_disk(key, stored_at, result)
+        if self.directory and time.monotonic() - self._last_sweep >= OCR_CACHE_SWEEP_SECONDS and \
+                self._sweeping.acquire(blocking=False):
+            # Fuera del hilo de la petición; un solo barrido a la vez por proceso
+            self._last_sweep = time.monotonic()
+            threading.Thread(target=self._sweep_in_background, daemon=True, name='ocr-cache-sweep').start()
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Entrada de caché ilegible {path}: {str(e)}")
+            return None
+        if self._expired(entry["stored_at"]):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry["stored_at"], entry["result"]
+
+    def _write_disk(self, key: str, stored_at: float, result: Dict[str, Any]):
+        if not self.directory:
+            return
+        path = self._path(key)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Escritura atómica: otro proceso nunca ve un JSON a medias
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"stored_at": stored_at, "result": result}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"No se pudo escribir la caché en disco: {str(e)}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def _sweep_in_background(self):
+        try:
+            self.sweep()
+        except Exception as e:
+            logger.warning(f"No se pudo barrer la caché en disco: {str(e)}")
+        finally:
+            self._sweeping.release()
+
+    def sweep(self) -> int:
+        """
+        Barre el nivel en disco: borra las entradas vencidas (por la fecha del
+        archivo, que es la de escritura), los .tmp abandonados y, si el total supera
+        OCR_CACHE_MAX_DISK_MB, las entradas más viejas. Devuelve cuántas borró
+        """
+        if not self.directory:
+            return 0
+        now = time.time()
+        entries = []  # (mtime, tamaño, ruta) de las entradas vigentes
+        removed = 0
+        with os.scandir(self.directory) as shards:
+            for shard in shards:
+                # Solo los subdirectorios de dos caracteres son de la caché (el índice de similitud vive al lado)
+                if len(shard.name) != 2 or not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as files:
+                    for entry in files:
+                        try:
+                            info = entry.stat()
+                        except OSError:
+                            continue
+                        if entry.name.endswith('.tmp'):
+                            stale = now - info.st_mtime > _STALE_TMP_SECONDS
+                        elif entry.name.endswith('.json'):
+                            stale = self._expired(info.st_mtime)
+                            if not stale:
+                                entries.append((info.st_mtime, info.st_size, entry.path))
+                        else:
+                            continue
+                        if stale and self._remove(entry.path):
+                            removed += 1
+        limit = OCR_CACHE_MAX_DISK_MB * 1024 * 1024
+        total = sum(size for _, size, _ in entries)
+        if limit > 0 and total > limit:
+            for _, size, path in sorted(entries):
+                if total <= limit:
+                    break
+                if self._remove(path):
+                    removed += 1
+                total -= size
+        with self._lock:
+            self._counters["disk_evictions"] += removed
+        if removed:
+            logger.info(f"Caché en disco: {removed} entradas borradas, {total / 1024 / 1024:.1f} MB en uso")
+        return removed
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            counters["entries"] = len(self._entries)
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        counters["hit_ratio"] = round((lookups - counters["misses"]) / lookups, 3) if lookups else 0.0
+        counters["disk_enabled"] = self.directory is not None
+        return counters
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Devuelve la caché del proceso (None si está desactivada)"""
+    global _cache
+    if not OCR_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
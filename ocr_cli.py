@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Procesamiento masivo de facturas sin servidor HTTP
+Recorre directorios o listas de archivos y ejecuta el pipeline OCR directamente
+en el ejecutor de procesos, escribiendo un resultado por documento en JSONL o
+CSV. Un archivo de checkpoint registra cada documento terminado junto con el
+tamaño de la salida en ese punto, así que una ejecución interrumpida se retoma
+donde quedó (descartando una posible línea a medio escribir) en lugar de
+empezar de nuevo.
+
+Uso:
+    python ocr_cli.py facturas/ --output resultados.jsonl
+    python ocr_cli.py --files-from lista.txt --output resultados.csv --workers 8
+"""
+
+import io
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ocr_batch import BatchItem, iter_batch
+from ocr_deadline import OCR_DEADLINE_SECONDS, Deadline, DeadlineExceeded
+from ocr_executor import OCR_WORKERS, OCRExecutor
+from ocr_pipeline import OCRProcessingError, is_allowed_file, parse_options, process_document
+from ocr_templates import get_template_store
+
+logger = logging.getLogger('ocr_cli')
+
+# Columnas de la salida CSV (la salida JSONL conserva el resultado completo)
+CSV_COLUMNS = ['archivo', 'status', 'proveedor', 'monto', 'fecha', 'numero_factura', 'ruc',
+               'paginas_procesadas', 'metodo_extraccion', 'tiempo_ms', 'error']
+# Cada cuántos segundos se fuerza a disco la salida y el checkpoint
+_SYNC_SECONDS = 5.0
+
+
+def discover_files(paths: Iterable[str], files_from: Optional[str] = None) -> Tuple[List[str], int]:
+    """
+    Lista ordenada de documentos a procesar a partir de archivos y directorios
+    (recorridos recursivamente) y de una lista de rutas, una por línea ('-' lee
+    de la entrada estándar). Devuelve también cuántas rutas se omitieron
+    """
+    candidates = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                candidates.extend(os.path.join(root, name) for name in sorted(names) if not name.startswith('.'))
+        else:
+            candidates.append(path)
+    if files_from:
+        source = sys.stdin if files_from == '-' else open(files_from, encoding='utf-8')
+        with source:
+            candidates.extend(line.strip() for line in source if line.strip() and not line.startswith('#'))
+
+    files, seen, skipped = [], set(), 0
+    for path in candidates:
+        path = os.path.normpath(path)
+        if path in seen:
+            continue
+        seen.add(path)
+        if not is_allowed_file(path) or not os.path.isfile(path):
+            skipped += 1
+            logger.debug(f"Omitido (no existe o extensión no soportada): {path}")
+            continue
+        files.append(path)
+    return files, skipped
+
+
+class Checkpoint:
+    """
+    Registro de documentos terminados, en líneas JSON {archivo, status, offset}
+    `offset` es el tamaño de la salida tras escribir el resultado del documento:
+    al retomar, la salida se recorta al último offset registrado
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = {}  # archivo -> status
+        self.offset = 0
+        self._file = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Línea a medio escribir al interrumpirse
+                self.done[entry['archivo']] = entry['status']
+                self.offset = entry['offset']
+
+    def pending(self, files: List[str], retry_failed: bool = False) -> List[str]:
+        return [path for path in files
+                if path not in self.done or (retry_failed and self.done[path] != 'success')]
+
+    def _rewrite(self):
+        """Reescribe el checkpoint completo de forma atómica"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for path, status in self.done.items():
+                f.write(json.dumps({"archivo": path, "status": status, "offset": self.offset}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def forget(self, paths: Iterable[str], offset: int):
+        """Quita documentos que se van a reprocesar; `offset` es el tamaño de la salida sin sus líneas"""
+        for path in paths:
+            self.done.pop(path, None)
+        self.offset = offset
+        self._rewrite()
+
+    def open(self):
+        # Reescribe el checkpoint sin la posible línea truncada del final
+        self._rewrite()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def record(self, path: str, status: str, offset: int):
+        self.done[path] = status
+        self.offset = offset
+        self._file.write(json.dumps({"archivo": path, "status": status, "offset": offset}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class ResultWriter:
+    """Salida JSONL o CSV en modo binario para que su tamaño sea un offset exacto"""
+
+    def __init__(self, path: str, fmt: str, resume_offset: int):
+        self.format = fmt
+        exists = os.path.exists(path)
+        self._file = open(path, 'r+b' if exists else 'wb')
+        size = self._file.seek(0, os.SEEK_END)
+        if exists and resume_offset < size:
+            # Descarta resultados escritos después del último documento registrado
+            self._file.truncate(resume_offset)
+            self._file.seek(resume_offset)
+        elif exists and resume_offset > size:
+            logger.warning(f"La salida {path} es más corta que lo registrado en el checkpoint")
+        if fmt == 'csv' and self._file.tell() == 0:
+            self._write_csv(CSV_COLUMNS)
+
+    def _write_csv(self, row: List[Any]):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(row)
+        self._file.write(buffer.getvalue().encode('utf-8'))
+
+    def write(self, record: Dict[str, Any]) -> int:
+        """Escribe un resultado y devuelve el tamaño de la salida tras escribirlo"""
+        if self.format == 'csv':
+            values = []
+            for column in CSV_COLUMNS:
+                value = record.get(column)
+                if isinstance(value, list):
+                    value = ",".join(str(v) for v in value)
+                values.append('' if value is None else value)
+            self._write_csv(values)
+        else:
+            self._file.write((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+        self._file.flush()
+        return self._file.tell()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def drop_records(path: str, fmt: str, files: Iterable[str], offset: int) -> int:
+    """
+    Reescribe la salida sin las líneas de `files` (los fallidos que se reintentan)
+    y sin lo escrito después de `offset`; devuelve el nuevo tamaño
+    """
+    files = set(files)
+    if not os.path.exists(path):
+        return 0
+    tmp_path = path + '.tmp'
+    with open(path, 'rb') as source, open(tmp_path, 'wb') as target:
+        lines = io.TextIOWrapper(io.BytesIO(source.read(offset)), encoding='utf-8', newline='')
+        if fmt == 'csv':
+            writer = csv.writer(io.TextIOWrapper(target, encoding='utf-8', newline='', write_through=True))
+            for index, row in enumerate(csv.reader(lines)):
+                if index == 0 or not row or row[0] not in files:
+                    writer.writerow(row)
+        else:
+            for line in lines:
+                try:
+                    archivo = json.loads(line).get('archivo')
+                except ValueError:
+                    continue
+                if archivo not in files:
+                    target.write(line.encode('utf-8'))
+        target.flush()
+        os.fsync(target.fileno())
+        size = target.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+class Progress:
+    """Avance, rendimiento y tiempo restante estimado en stderr"""
+
+    def __init__(self, total: int, interval: float, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.done = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self._last = 0.0
+        self._tty = stream.isatty()
+
+    def update(self, failed: bool):
+        self.done += 1
+        self.failed += int(failed)
+        now = time.monotonic()
+        if self.interval > 0 and now - self._last >= self.interval:
+            self._last = now
+            self.report()
+
+    def rate(self) -> float:
+        return self.done / max(1e-9, time.monotonic() - self.started_at)
+
+    def report(self, final: bool = False):
+        rate = self.rate()
+        eta = (self.total - self.done) / rate if rate > 0 else float('inf')
+        line = (f"{self.done}/{self.total} documentos ({self.done / max(1, self.total):.1%}), "
+                f"{self.failed} con error, {rate:.2f} doc/s, "
+                f"{'transcurrido ' + _format_seconds(time.monotonic() - self.started_at) if final else 'ETA ' + _format_seconds(eta)}")
+        if self._tty and not final:
+            self.stream.write("\r" + line.ljust(100))
+        else:
+            self.stream.write(("\r" if self._tty else "") + line + "\n")
+        self.stream.flush()
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds == float('inf'):
+        return '--:--:--'
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def read_files(paths: List[str]) -> Iterator[Tuple[str, bytes]]:
+    """Lee cada documento solo cuando hay lugar en la ventana de procesamiento"""
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                yield path, f.read()
+        except OSError as e:
+            logger.warning(f"No se pudo leer {path}: {str(e)}")
+            yield path, b''
+
+
+def result_record(item: BatchItem) -> Dict[str, Any]:
+    """Línea de salida de un documento: resultado completo o error"""
+    record = {"archivo": item.filename}
+    error = item.error
+    if error is None:
+        result = dict(item.result)
+        result.pop("archivo_procesado", None)
+        record.update(result)
+    elif isinstance(error, DeadlineExceeded):
+        record.update({"status": "error", "error": "Tiempo de procesamiento excedido", "etapa": error.stage})
+    elif isinstance(error, OCRProcessingError):
+        record.update({"status": "error", "error": error.message})
+    else:
+        record.update({"status": "error", "error": str(error) or type(error).__name__})
+    record["tiempo_ms"] = item.elapsed_ms
+    return record
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Procesamiento OCR masivo de facturas con checkpoint")
+    parser.add_argument('paths', nargs='*', help="Archivos o directorios (se recorren recursivamente)")
+    parser.add_argument('--files-from', help="Archivo con una ruta por línea ('-' para stdin)")
+    parser.add_argument('--output', '-o', required=True, help="Archivo de resultados (.jsonl o .csv)")
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help="Formato de salida (por defecto según la extensión)")
+    parser.add_argument('--checkpoint', help="Archivo de checkpoint (por defecto <output>.checkpoint)")
+    parser.add_argument('--workers', type=int, default=OCR_WORKERS, help="Procesos OCR (por defecto OCR_WORKERS)")
+    parser.add_argument('--deadline', type=float, default=OCR_DEADLINE_SECONDS,
+                        help="Plazo por documento en segundos (por defecto OCR_DEADLINE_SECONDS)")
+    parser.add_argument('--pages', help="Páginas de PDF: first, all, N, N-M o N,M")
+    parser.add_argument('--text-layer', choices=('0', '1'), help="0 fuerza OCR aunque el PDF tenga capa de texto")
+    parser.add_argument('--preprocess', help="Etapas de preprocesamiento (none, default o lista)")
+    parser.add_argument('--templates', choices=('0', '1'), help="0 reconoce la página completa aunque el proveedor tenga plantilla")
+    parser.add_argument('--restart', action='store_true', help="Ignora el checkpoint y empieza de nuevo")
+    parser.add_argument('--retry-failed', action='store_true', help="Reprocesa los documentos que fallaron")
+    parser.add_argument('--progress-seconds', type=float, default=2.0, help="Intervalo del reporte de avance (0 lo desactiva)")
+    parser.add_argument('--verbose', '-v', action='store_true', help="Log detallado del pipeline")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if not args.paths and not args.files_from:
+        parser.error("indique archivos, directorios o --files-from")
+    fmt = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+    try:
+        options = parse_options({"pages": args.pages, "text_layer": args.text_layer,
+                                 "preprocess": args.preprocess, "templates": args.templates})
+    except OCRProcessingError as e:
+        parser.error(e.message)
+
+    files, skipped = discover_files(args.paths, args.files_from)
+    checkpoint = Checkpoint(args.checkpoint or args.output + '.checkpoint')
+    if args.restart:
+        for path in (args.output, checkpoint.path):
+            if os.path.exists(path):
+                os.remove(path)
+    else:
+        checkpoint.load()
+    pending = checkpoint.pending(files, args.retry_failed)
+    print(f"{len(files)} documentos encontrados ({skipped} omitidos), {len(files) - len(pending)} ya procesados, "
+          f"{len(pending)} pendientes con {args.workers} procesos", file=sys.stderr)
+    if not pending:
+        return 0
+    # Un documento reintentado reemplaza su resultado fallido en lugar de agregar otro
+    retried = [path for path in pending if path in checkpoint.done]
+    if retried:
+        checkpoint.forget(retried, drop_records(args.output, fmt, retried, checkpoint.offset))
+
+    writer = ResultWriter(args.output, fmt, checkpoint.offset)
+    checkpoint.open()
+    executor = OCRExecutor(max_workers=args.workers, queue_size=args.workers)
+
+    def handle(data: bytes, filename: str) -> Dict[str, Any]:
+        if not data:
+            raise OCRProcessingError("Archivo vacío o ilegible")
+        # El plazo de cada documento empieza al despacharlo, no al iniciar la ejecución
+        deadline = Deadline(args.deadline)
+        return executor.run(process_document, data, filename, options, deadline, deadline=deadline)
+
+    progress = Progress(len(pending), args.progress_seconds)
+    last_sync = time.monotonic()
+    try:
+        for item in iter_batch(read_files(pending), handle, executor.max_workers):
+            record = result_record(item)
+            checkpoint.record(item.filename, record["status"], writer.write(record))
+            progress.update(record["status"] != 'success')
+            if time.monotonic() - last_sync >= _SYNC_SECONDS:
+                writer.sync()
+                checkpoint.sync()
+                last_sync = time.monotonic()
+    except KeyboardInterrupt:
+        progress.report(final=True)
+        print(f"Interrumpido; vuelva a ejecutar el mismo comando para retomar desde {checkpoint.path}", file=sys.stderr)
+        return 130
+    finally:
+        writer.sync()
+        checkpoint.sync()
+        writer.close()
+        checkpoint.close()
+        # Esperar a los procesos OCR: al salir escriben las muestras de plantillas pendientes
+        executor.shutdown(wait=True)
+        store = get_template_store()
+        if store is not None:
+            store.flush()
+    progress.report(final=True)
+    return 1 if progress.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Presupuesto de tiempo de punta a punta por petición
+Cada petición lleva un plazo absoluto (reloj de pared, válido entre procesos)
+que las etapas consultan antes de empezar y convierten en el timeout de sus
+subprocesos (poppler, pdftotext, tesseract) para que estos mueran al vencer.
+"""
+
+import os
+import math
+import time
+from typing import Callable, Mapping, Optional
+
+# Plazo por defecto: processing_timeout_seconds de ocr_config (database_setup.sql)
+OCR_DEADLINE_SECONDS = float(os.environ.get('OCR_DEADLINE_SECONDS', os.environ.get('OCR_TIMEOUT_SECONDS', 30)))
+# Máximo que un cliente puede pedir con la cabecera
+OCR_MAX_DEADLINE_SECONDS = float(os.environ.get('OCR_MAX_DEADLINE_SECONDS', 300))
+# Margen para que el proceso OCR informe su propio vencimiento antes de matarlo
+OCR_DEADLINE_GRACE_SECONDS = float(os.environ.get('OCR_DEADLINE_GRACE_SECONDS', 2))
+DEADLINE_HEADER = 'X-OCR-Deadline-Seconds'
+
+# Etapas del pipeline, en el orden en que consumen el presupuesto
+STAGES = ('cola', 'decodificacion', 'capa_texto', 'rasterizado', 'preprocesamiento', 'ocr', 'extraccion')
+
+_stage_listener = None
+
+
+def set_stage_listener(listener: Optional[Callable[[str], None]]):
+    """Registra una función a la que se notifica cada cambio de etapa en este proceso"""
+    global _stage_listener
+    _stage_listener = listener
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el presupuesto de tiempo de la petición durante `stage`"""
+
+    def __init__(self, stage: str, budget: float):
+        # Ambos valores en args para que el error sobreviva al pickle entre procesos
+        super().__init__(stage, budget)
+        self.stage = stage
+        self.budget = budget
+
+    def __str__(self):
+        return f"Presupuesto de {self.budget:g}s agotado en la etapa '{self.stage}'"
+
+
+class Deadline:
+    """
+    Plazo absoluto de una petición; se serializa con el trabajo al proceso OCR
+    seconds=None crea un plazo ilimitado (uso fuera del servicio)
+    """
+
+    def __init__(self, seconds: Optional[float] = OCR_DEADLINE_SECONDS):
+        self.budget = math.inf if seconds is None else seconds
+        self.expires_at = time.time() + self.budget
+        self.stage = 'cola'
+        self.cancelled = False
+        self._on_cancel = []
+
+    def __getstate__(self):
+        # Las funciones de cancelación son del proceso que espera, no viajan con el trabajo
+        state = self.__dict__.copy()
+        state['_on_cancel'] = []
+        return state
+
+    def cancel(self):
+        """Vence el plazo ya y avisa a quien espera el trabajo (p. ej. para matar su proceso OCR)"""
+        self.expires_at = min(self.expires_at, time.time())
+        self.cancelled = True
+        for callback in list(self._on_cancel):
+            callback()
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Registra `callback` para cancel() (o lo llama si ya se canceló); devuelve cómo quitarlo"""
+        self._on_cancel.append(callback)
+        if self.cancelled:
+            callback()
+        return lambda: self._on_cancel.remove(callback) if callback in self._on_cancel else None
+
+    def remaining(self) -> float:
+        return self.expires_at - time.time()
+
+    def enter(self, stage: str):
+        """Marca el inicio de una etapa; falla si el presupuesto ya se agotó"""
+        self.stage = stage
+        if _stage_listener is not None:
+            _stage_listener(stage)
+        self.check()
+
+    def check(self):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(self.stage, self.budget)
+
+    def timeout(self, minimum: float = 0.05) -> Optional[float]:
+        """Tiempo restante como timeout de un subproceso de la etapa actual (None si es ilimitado)"""
+        self.check()
+        remaining = self.remaining()
+        return None if math.isinf(remaining) else max(minimum, remaining)
+
+
+def deadline_from_headers(headers: Mapping[str, str], default: float = OCR_DEADLINE_SECONDS) -> Deadline:
+    """
+    Plazo de la petición: cabecera X-OCR-Deadline-Seconds o el defecto, acotado a
+    OCR_MAX_DEADLINE_SECONDS. Lanza ValueError si la cabecera no es un número positivo
+    """
+    raw = headers.get(DEADLINE_HEADER)
+    try:
+        seconds = default if raw in (None, '') else float(raw)
+    except ValueError:
+        seconds = 0.0
+    if not seconds > 0:
+        raise ValueError(f"{DEADLINE_HEADER} debe ser un número positivo")
+    return Deadline(min(seconds, OCR_MAX_DEADLINE_SECONDS))
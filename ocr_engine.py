@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Pool de motores Tesseract persistentes para el microservicio OCR
+Mantiene instancias ya inicializadas de la API C de Tesseract (vía tesserocr)
+y las reutiliza entre peticiones, evitando el fork del binario y la recarga
+del traineddata en cada factura.
+"""
+
+import os
+import time
+import queue
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+import pytesseract
+
+from ocr_governor import get_governor
+
+try:
+    import tesserocr
+except ImportError:  # tesserocr es opcional: sin él se usa pytesseract
+    tesserocr = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Configuración OCR compartida por todos los backends
+OCR_LANG = 'spa+eng'
+OCR_CONFIG = r'--oem 3 --psm 6'
+
+# Tamaño del pool: por defecto un motor por núcleo disponible
+OCR_ENGINE_POOL_SIZE = int(os.environ.get('OCR_ENGINE_POOL_SIZE', os.cpu_count() or 1))
+# Backend: auto | tesserocr | pytesseract
+OCR_ENGINE_BACKEND = os.environ.get('OCR_ENGINE_BACKEND', 'auto').lower()
+TESSDATA_PREFIX = os.environ.get('TESSDATA_PREFIX')
+
+# Configuración de Tesseract (ajustar según el sistema)
+if os.name == 'nt':  # Windows
+    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+
+def to_pil_image(image):
+    """Acepta imágenes PIL o arreglos NumPy y devuelve una imagen PIL"""
+    if isinstance(image, Image.Image):
+        return image
+    if np is not None and isinstance(image, np.ndarray):
+        return Image.fromarray(image)
+    raise TypeError(f"Tipo de imagen no soportado: {type(image).__name__}")
+
+
+class TesseractEnginePool:
+    """Pool de instancias PyTessBaseAPI inicializadas una sola vez por proceso"""
+
+    def __init__(self, size: int = OCR_ENGINE_POOL_SIZE, lang: str = OCR_LANG,
+                 backend: str = OCR_ENGINE_BACKEND):
+        self.size = max(1, size)
+        self.lang = lang
+        self.backend = self._resolve_backend(backend)
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _resolve_backend(backend: str) -> str:
+        if backend == 'pytesseract':
+            return 'pytesseract'
+        if tesserocr is None:
+            if backend == 'tesserocr':
+                raise RuntimeError("Backend 'tesserocr' solicitado pero el paquete no está instalado")
+            logger.info("tesserocr no disponible, usando pytesseract (un proceso por petición)")
+            return 'pytesseract'
+        return 'tesserocr'
+
+    def _create_engine(self):
+        """Crea e inicializa un motor (carga el traineddata una sola vez)"""
+        kwargs = {'path': TESSDATA_PREFIX} if TESSDATA_PREFIX else {}
+        engine = tesserocr.PyTessBaseAPI(
+            lang=self.lang,
+            psm=tesserocr.PSM.SINGLE_BLOCK,  # --psm 6
+            oem=tesserocr.OEM.DEFAULT,       # --oem 3
+            **kwargs
+        )
+        logger.info(f"Motor Tesseract inicializado ({self.lang}) en proceso {os.getpid()}")
+        return engine
+
+    def _check_fork(self):
+        """Tras un fork el lock puede haber quedado tomado: se recrea conservando los motores libres"""
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            idle = []
+            while True:
+                try:
+                    idle.append(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+            self._idle = queue.LifoQueue()
+            for engine in idle:
+                self._idle.put(engine)
+            self._created = len(idle)
+            self._pid = os.getpid()
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None):
+        """Toma un motor libre del pool (o crea uno nuevo si no se alcanzó el tamaño máximo)"""
+        self._check_fork()
+        engine = None
+        try:
+            engine = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    engine = self._create_engine()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                engine = self._idle.get(timeout=timeout)
+        try:
+            yield engine
+        finally:
+            engine.Clear()
+            self._idle.put(engine)
+
+    def warm_up(self, count: Optional[int] = None) -> int:
+        """Inicializa por adelantado hasta `count` motores (por defecto todo el pool)"""
+        if self.backend != 'tesserocr':
+            return 0
+        self._check_fork()
+        target = min(self.size, count or self.size)
+        created = 0
+        while True:
+            with self._lock:
+                if self._created >= target:
+                    return created
+                self._created += 1
+            try:
+                engine = self._create_engine()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            self._idle.put(engine)
+            created += 1
+
+    def image_to_string(self, image, timeout: Optional[float] = None) -> str:
+        """Reconoce el texto de una imagen en memoria (PIL o NumPy)"""
+        image = to_pil_image(image)
+        if self.backend == 'pytesseract':
+            with get_governor().slot():
+                return pytesseract.image_to_string(image, config=OCR_CONFIG, lang=self.lang)
+        with self.acquire(timeout=timeout) as engine, get_governor().slot():
+            engine.SetImage(image)
+            return engine.GetUTF8Text()
+
+    def recognize(self, image, timeout: Optional[float] = None,
+                  ocr_timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Reconoce una imagen y devuelve sus palabras en orden de lectura, en la misma pasada
+        Cada palabra: {"text", "conf" (0-100), "left", "top", "right", "bottom", "line"};
+        las coordenadas están en píxeles de la imagen recibida y "line" numera las líneas
+        ocr_timeout (segundos) corta el reconocimiento y lanza TimeoutError
+        """
+        image = to_pil_image(image)
+        if self.backend == 'pytesseract':
+            with get_governor().slot():
+                return self._recognize_tsv(image, ocr_timeout)
+        words = []
+        # Hilos OpenMP según los núcleos y las llamadas OCR en curso en todos los procesos
+        with self.acquire(timeout=timeout) as engine, get_governor().slot():
+            engine.SetImage(image)
+            if ocr_timeout is None:
+                recognized = engine.Recognize()
+            else:
+                recognized = engine.Recognize(timeout=max(1, int(ocr_timeout * 1000)))
+            if not recognized:
+                if ocr_timeout is not None:
+                    raise TimeoutError("Tiempo de OCR agotado")
+                raise RuntimeError("Tesseract no pudo reconocer la imagen")
+            iterator = engine.GetIterator()
+            if iterator is None:
+                return words
+            level = tesserocr.RIL.WORD
+            line = -1
+            for result in tesserocr.iterate_level(iterator, level):
+                if result.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line += 1
+                text = (result.GetUTF8Text(level) or '').strip()
+                box = result.BoundingBox(level)
+                if not text or box is None:
+                    continue
+                left, top, right, bottom = box
+                words.append({"text": text, "conf": round(result.Confidence(level), 2),
+                              "left": left, "top": top, "right": right, "bottom": bottom, "line": max(line, 0)})
+        return words
+
+    def _recognize_tsv(self, image: Image.Image, ocr_timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Palabras a partir de la salida TSV de un único proceso tesseract (muerto al vencer ocr_timeout)"""
+        try:
+            data = pytesseract.image_to_data(image, config=OCR_CONFIG, lang=self.lang,
+                                             output_type=pytesseract.Output.DICT, timeout=ocr_timeout or 0)
+        except RuntimeError as e:
+            if 'timeout' in str(e):
+                raise TimeoutError("Tiempo de OCR agotado") from e
+            raise
+        words = []
+        lines = {}
+        for i, text in enumerate(data["text"]):
+            text = (text or '').strip()
+            conf = float(data["conf"][i])
+            if not text or conf < 0:
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            line = lines.setdefault(key, len(lines))
+            left, top = int(data["left"][i]), int(data["top"][i])
+            words.append({"text": text, "conf": round(conf, 2), "left": left, "top": top,
+                          "right": left + int(data["width"][i]), "bottom": top + int(data["height"][i]),
+                          "line": line})
+        return words
+
+    def close(self):
+        """Libera todos los motores inactivos"""
+        while True:
+            try:
+                engine = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            engine.End()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "size": self.size,
+            "created": self._created,
+            "idle": self._idle.qsize(),
+        }
+
+
+# Resultado de la última verificación de Tesseract: (instante, estado)
+_status = None
+_STATUS_TTL_SECONDS = 60
+
+
+def tesseract_status(backend: str = OCR_ENGINE_BACKEND) -> Dict[str, Any]:
+    """
+    Disponibilidad real de Tesseract para /health: versión y presencia de los
+    idiomas de OCR_LANG en tessdata. Se verifica como mucho una vez por minuto
+    """
+    global _status
+    now = time.monotonic()
+    if _status is not None and now - _status[0] < _STATUS_TTL_SECONDS:
+        return _status[1]
+    required = OCR_LANG.split('+')
+    status = {"available": False, "backend": None, "version": None, "missing_languages": required}
+    try:
+        status["backend"] = TesseractEnginePool._resolve_backend(backend)
+        if status["backend"] == 'tesserocr':
+            status["version"] = tesserocr.tesseract_version().split()[1]
+            _, languages = tesserocr.get_languages(TESSDATA_PREFIX) if TESSDATA_PREFIX else tesserocr.get_languages()
+        else:
+            status["version"] = str(pytesseract.get_tesseract_version())
+            languages = pytesseract.get_languages(config='')
+        status["missing_languages"] = [lang for lang in required if lang not in languages]
+        status["available"] = not status["missing_languages"]
+    except Exception as e:
+        status["error"] = str(e)
+    _status = (now, status)
+    return status
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_engine_pool() -> TesseractEnginePool:
+    """Devuelve el pool de motores del proceso, creándolo la primera vez"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = TesseractEnginePool()
+    return _pool
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Ejecutor OCR basado en un pool de procesos con cola de envío acotada
+Saca la decodificación, el rasterizado y el OCR del hilo de la petición Flask
+y reparte el trabajo entre todos los núcleos del contenedor. Cada proceso OCR
+tiene su propia tubería y un hilo que le entrega trabajos, así que matar uno
+(plazo vencido, cancelación) no afecta a los trabajos de los demás: el
+proceso se reemplaza con el siguiente trabajo.
+"""
+
+import os
+import time
+import queue
+import signal
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import CancelledError, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Optional
+
+from ocr_deadline import OCR_DEADLINE_GRACE_SECONDS, Deadline, DeadlineExceeded, set_stage_listener
+
+logger = logging.getLogger(__name__)
+
+# Procesos OCR (por defecto uno por núcleo) y trabajos en espera admitidos
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1))
+OCR_QUEUE_SIZE = int(os.environ.get('OCR_QUEUE_SIZE', 2 * OCR_WORKERS))
+# Tiempo máximo de espera de un resultado desde el handler
+OCR_TIMEOUT_SECONDS = float(os.environ.get('OCR_TIMEOUT_SECONDS', 30))
+
+# Espera a que un proceso OCR termine su trabajo al detener el ejecutor
+_STOP_SECONDS = 5.0
+
+
+class ExecutorBusyError(Exception):
+    """La cola de envío del ejecutor está llena"""
+
+
+class WorkerLostError(Exception):
+    """El proceso OCR que ejecutaba el trabajo terminó sin devolver su resultado"""
+
+
+def _init_worker():
+    """Inicializa cada proceso OCR cargando un motor antes del primer trabajo"""
+    logging.basicConfig(level=logging.INFO)
+    # Grupo de procesos propio: al matarlo también mueren sus hijos poppler/tesseract
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    try:
+        from ocr_engine import get_engine_pool
+        get_engine_pool().warm_up(1)
+    except Exception as e:
+        logger.warning(f"No se pudo precargar el motor OCR: {str(e)}")
+
+
+def _flush_worker():
+    """
+    Escribe lo que el proceso OCR tenga pendiente antes de salir: los procesos
+    de multiprocessing terminan con os._exit y no ejecutan los handlers de atexit
+    """
+    try:
+        from ocr_templates import get_template_store
+        store = get_template_store()
+        if store is not None:
+            store.flush()
+    except Exception as e:
+        logger.warning(f"No se pudieron guardar las plantillas pendientes: {str(e)}")
+
+
+def _timed_call(fn: Callable, args: tuple, notify: Optional[Callable[[str], None]] = None):
+    """
+    Ejecuta el trabajo en el proceso hijo registrando inicio, fin y cada etapa
+    Devuelve también la duración de cada etapa como [(etapa, segundos)]
+    """
+    started_at = time.time()
+    marks = []  # (etapa, instante de inicio)
+
+    def on_stage(stage):
+        marks.append((stage, time.perf_counter()))
+        if notify is not None:
+            notify(stage)
+
+    set_stage_listener(on_stage)
+    try:
+        result, error = fn(*args), None
+    except Exception as e:
+        result, error = None, e
+    finally:
+        set_stage_listener(None)
+    finished = time.perf_counter()
+    spans = [(stage, (marks[i + 1][1] if i + 1 < len(marks) else finished) - start)
+             for i, (stage, start) in enumerate(marks)]
+    return started_at, time.time(), result, error, spans
+
+
+def _worker_main(conn):
+    """
+    Bucle del proceso OCR: recibe (función, argumentos), avisa cada etapa con
+    ('etapa', nombre) y devuelve ('resultado', (inicio, fin, resultado, error, etapas))
+    """
+    _init_worker()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            task = None
+        if task is None:
+            _flush_worker()
+            return
+        fn, args = task
+        outcome = _timed_call(fn, args, lambda stage: conn.send(('etapa', stage)))
+        try:
+            conn.send(('resultado', outcome))
+        except Exception as e:
+            # Resultado o excepción que no se pueden serializar: se informa como error
+            started_at, finished_at, _, _, spans = outcome
+            conn.send(('resultado', (started_at, finished_at, None, RuntimeError(str(e)), spans)))
+
+
+class _Worker:
+    """Un proceso OCR con su tubería y el trabajo que está ejecutando"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.future = None
+        self.stage = 'cola'
+
+    def ensure_started(self):
+        if self.process is not None and self.process.is_alive():
+            return
+        self.close()
+        parent, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_main, args=(child,), daemon=True,
+                                               name=f"ocr-worker-{self.index}")
+        self.process.start()
+        child.close()
+        self.conn = parent
+
+    def close(self):
+        """Libera la tubería y recoge el proceso si ya terminó"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            self.process.join(timeout=0)
+            self.process = None
+
+    def stop(self, wait: bool):
+        """Pide al proceso que salga; con `wait` espera a que termine"""
+        if self.conn is not None:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        if wait and self.process is not None:
+            self.process.join(_STOP_SECONDS)
+        self.close()
+
+
+class OCRExecutor:
+    """Pool de procesos OCR con cola acotada y estadísticas de uso"""
+
+    def __init__(self, max_workers: int = OCR_WORKERS, queue_size: int = OCR_QUEUE_SIZE):
+        self.max_workers = max(1, max_workers)
+        self.queue_size = max(0, queue_size)
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.queue_size)
+        self._lock = threading.Lock()
+        self._tasks = None
+        self._workers = []
+        self._feeders = []
+        self._pid = None
+        self._job_ids = itertools.count(1)
+        self._created_at = time.time()
+        # Estadísticas
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._started = 0
+        self._rejected = 0
+        self._busy_seconds = 0.0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._killed = 0
+
+    def _ensure_started(self):
+        """Arranca los hilos de entrega de forma diferida (y de nuevo tras un fork)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._tasks = queue.Queue()
+            self._workers = [_Worker(i) for i in range(self.max_workers)]
+            self._feeders = [threading.Thread(target=self._feed, args=(worker,), daemon=True,
+                                              name=f"ocr-feeder-{worker.index}") for worker in self._workers]
+            for feeder in self._feeders:
+                feeder.start()
+            logger.info(f"Ejecutor OCR iniciado con {self.max_workers} procesos")
+
+    def _feed(self, worker: _Worker):
+        """Entrega los trabajos de la cola a un proceso OCR, de a uno, y publica su resultado"""
+        tasks = self._tasks
+        while True:
+            item = tasks.get()
+            if item is None:
+                worker.stop(wait=True)
+                return
+            future, fn, args = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                # Un proceso muerto (matado o caído) se reemplaza al tomar el trabajo siguiente
+                worker.ensure_started()
+                with self._lock:
+                    worker.future, worker.stage = future, 'cola'
+                worker.conn.send((fn, args))
+                while True:
+                    kind, payload = worker.conn.recv()
+                    if kind != 'etapa':
+                        break
+                    worker.stage = payload
+                self._release(worker)
+                future.set_result(payload)
+            except (EOFError, OSError):
+                self._release(worker)
+                worker.close()
+                future.set_exception(WorkerLostError(f"El proceso OCR terminó en la etapa '{worker.stage}'"))
+            except Exception as e:  # p. ej. argumentos que no se pueden serializar
+                self._release(worker)
+                future.set_exception(e)
+
+    def _release(self, worker: _Worker):
+        """
+        Desasocia el trabajo terminado de su proceso antes de publicar el resultado:
+        desde aquí _kill ya no puede alcanzar al proceso, que puede recibir otro trabajo
+        """
+        with self._lock:
+            worker.future = None
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Encola un trabajo; lanza ExecutorBusyError si la cola está llena"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise ExecutorBusyError("Cola del ejecutor OCR llena")
+
+        self._ensure_started()
+        submitted_at = time.time()
+        future = Future()
+        future.job_id = next(self._job_ids)
+        future.submitted_at = submitted_at
+        with self._lock:
+            self._in_flight += 1
+        future.add_done_callback(lambda f: self._on_done(f, submitted_at))
+        self._tasks.put((future, fn, args))
+        return future
+
+    def _on_done(self, future: Future, submitted_at: float):
+        """Contadores al terminar: completados sin error, fallidos y cancelados por separado"""
+        self._slots.release()
+        with self._lock:
+            self._in_flight -= 1
+            if future.cancelled():
+                self._cancelled += 1
+                return
+            if future.exception() is not None:
+                self._failed += 1
+                return
+            started_at, finished_at, _, error, _ = future.result()
+            if error is None:
+                self._completed += 1
+            else:
+                self._failed += 1
+            # La espera en cola cuenta para todo trabajo que llegó a un proceso, haya fallado o no
+            wait = max(0.0, started_at - submitted_at)
+            self._started += 1
+            self._busy_seconds += finished_at - started_at
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+
+    def result(self, future: Future, timeout: Optional[float] = None, spans: Optional[list] = None) -> Any:
+        """
+        Espera el resultado de un trabajo y relanza su excepción si falló
+        Con `spans` le agrega la espera en cola y la duración de cada etapa (también si falló)
+        """
+        try:
+            started_at, _, result, error, stages = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+        if spans is not None:
+            spans.append(('cola', max(0.0, started_at - future.submitted_at)))
+            spans.extend(stages)
+        if error is not None:
+            raise error
+        return result
+
+    def _kill(self, future: Future, reason: str = 'plazo vencido') -> str:
+        """
+        Detiene un trabajo: lo cancela si sigue en cola o mata el grupo de su
+        proceso OCR (con sus hijos poppler/tesseract); los demás procesos siguen con
+        sus trabajos. Devuelve la última etapa conocida
+        """
+        if future.cancel():
+            return 'cola'
+        # La comprobación y la señal van bajo el mismo lock con que _feed desasocia el
+        # trabajo: el proceso no puede haber recibido otro trabajo entre ambas
+        with self._lock:
+            worker = next((w for w in self._workers if w.future is future), None)
+            if worker is None or worker.process is None:
+                return 'cola' if worker is None else worker.stage
+            pid, stage = worker.process.pid, worker.stage
+            try:
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except (AttributeError, ProcessLookupError):
+                    # Sin killpg, o el proceso todavía no creó su grupo
+                    os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                self._killed += 1
+            except (ProcessLookupError, PermissionError):
+                return stage
+        logger.error(f"Proceso OCR {pid} terminado por {reason} en la etapa '{stage}'")
+        return stage
+
+    def run(self, fn: Callable, *args, timeout: Optional[float] = OCR_TIMEOUT_SECONDS,
+            deadline: Optional[Deadline] = None, spans: Optional[list] = None) -> Any:
+        """
+        Encola un trabajo y espera su resultado
+        Con `deadline` se espera lo que queda del plazo más un margen para que el
+        proceso informe su propio vencimiento; si no responde se mata y se lanza
+        DeadlineExceeded con la última etapa que notificó. Si el plazo se cancela
+        (Deadline.cancel) el trabajo sale de la cola o se mata su proceso en el
+        momento. `spans` recibe las etapas del trabajo como en result()
+        """
+        future = self.submit(fn, *args)
+        if deadline is None:
+            return self.result(future, timeout=timeout, spans=spans)
+        stop_watching = deadline.on_cancel(lambda: self._kill(future, 'cancelación'))
+        try:
+            return self.result(future, timeout=max(0.0, deadline.remaining()) + OCR_DEADLINE_GRACE_SECONDS,
+                               spans=spans)
+        except FutureTimeoutError:
+            raise DeadlineExceeded(self._kill(future), deadline.budget)
+        except (CancelledError, WorkerLostError):
+            if not deadline.cancelled:
+                raise
+            raise DeadlineExceeded(deadline.stage, deadline.budget)
+        finally:
+            stop_watching()
+
+    def stats(self) -> dict:
+        """Profundidad de cola, utilización de procesos y tiempos de espera"""
+        with self._lock:
+            in_flight = self._in_flight
+            active = min(in_flight, self.max_workers)
+            elapsed = max(1e-9, time.time() - self._created_at)
+            return {
+                "workers": self.max_workers,
+                "queue_capacity": self.queue_size,
+                "queue_depth": in_flight - active,
+                "active_workers": active,
+                "utilization": round(active / self.max_workers, 3),
+                "avg_utilization": round(min(1.0, self._busy_seconds / (elapsed * self.max_workers)), 3),
+                "completed": self._completed,
+                "failed": self._failed,
+                "cancelled": self._cancelled,
+                "rejected": self._rejected,
+                "killed": self._killed,
+                "avg_wait_ms": round(self._wait_total / self._started * 1000, 2) if self._started else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 2),
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Cancela los trabajos en cola y detiene los procesos al terminar su trabajo actual"""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._pid = None
+            tasks, feeders = self._tasks, self._feeders
+        while True:
+            try:
+                item = tasks.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[0].cancel()
+        for _ in feeders:
+            tasks.put(None)
+        if wait:
+            for feeder in feeders:
+                feeder.join()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> OCRExecutor:
+    """Devuelve el ejecutor OCR del proceso, creándolo la primera vez"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = OCRExecutor()
+    return _executor
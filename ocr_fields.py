@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Motor de extracción de campos en una sola pasada
+Las reglas de cada campo se declaran en FIELD_RULES y se compilan una sola vez
+al importar el módulo en un único barrido; el texto OCR se recorre una vez y se
+obtienen todos los campos con la posición de su coincidencia.
+"""
+
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+
+class FieldRule(NamedTuple):
+    """
+    Regla declarativa de un campo
+    pattern/flags: expresión exacta sobre el texto original, con un grupo de valor
+    scan: la misma expresión sobre el texto en minúsculas, para el barrido combinado
+    leads: caracteres con los que puede empezar `scan`
+    whole_line: el valor es la línea completa que contiene la coincidencia
+    """
+    name: str
+    pattern: str
+    flags: int
+    scan: str
+    leads: str
+    convert: Callable[[str], Any]
+    default: Callable[[], Any]
+    whole_line: bool = False
+
+
+def _provider_value(line: str) -> str:
+    return line.split(":", 1)[-1].strip()
+
+
+def _amount_value(raw: str) -> float:
+    try:
+        return float(raw.replace(',', ''))
+    except ValueError:
+        return 0.0
+
+
+# Mismas reglas que los métodos extract_* de InvoiceDataExtractor
+FIELD_RULES = (
+    # Primera línea que contiene "razón social" o "nombre comercial"
+    FieldRule("proveedor", r'(razón social|nombre comercial)', re.IGNORECASE,
+              r'razón social|nombre comercial', 'rn',
+              _provider_value, lambda: "Proveedor no identificado", whole_line=True),
+    FieldRule("monto", r'VALOR TOTAL USD\s*([\d,.]+)', re.IGNORECASE,
+              r'valor total usd\s*[\d,.]+', 'v',
+              _amount_value, lambda: 0.0),
+    FieldRule("fecha", r'FECHA DE EMISI[ÓO]N[:\s]*([\d/-]{8,10})', re.IGNORECASE,
+              r'fecha de emisi[óo]n[:\s]*[\d/-]{8,10}', 'f',
+              str, lambda: datetime.now().strftime("%Y-%m-%d")),
+    FieldRule("numero_factura", r'N[°º]?:?\s*([\d-]{8,})', 0,
+              r'n[°º]?:?\s*[\d-]{8,}', 'n',
+              str, lambda: "N/A"),
+    FieldRule("ruc", r'\b(\d{13})\b', 0,
+              r'\b\d{13}\b', '0123456789',
+              str, lambda: "N/A"),
+)
+
+
+def _compile_scanner(rules):
+    """
+    Une las reglas en una alternancia cuyas ramas empiezan por un literal
+    (`c(?<=(?=scan).)`), lo que permite a `re` saltar en C todas las posiciones
+    que no pueden iniciar ningún campo. Cada coincidencia consume un solo
+    carácter, así que no se pierden coincidencias solapadas.
+    """
+    branches = []
+    for rule in rules:
+        for lead in rule.leads:
+            branches.append(f"{re.escape(lead)}(?<=(?={rule.scan}).)")
+    return "|".join(branches)
+
+
+_SCANNER_PATTERN = _compile_scanner(FIELD_RULES)
+_SCANNER = re.compile(_SCANNER_PATTERN)
+# Para textos cuya versión en minúsculas cambia de longitud (p. ej. "İ") se barre el original
+_SCANNER_IGNORECASE = re.compile(_SCANNER_PATTERN, re.IGNORECASE)
+_RULES = tuple((rule, re.compile(rule.pattern, rule.flags)) for rule in FIELD_RULES)
+
+
+def _line_span(text: str, start: int, end: int):
+    """Límites de la línea que contiene la coincidencia"""
+    line_start = text.rfind('\n', 0, start) + 1
+    line_end = text.find('\n', end)
+    return line_start, len(text) if line_end == -1 else line_end
+
+
+def extract_fields(text: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Extrae todos los campos en una pasada sobre el texto
+    Devuelve {campo: {"valor", "inicio", "fin"}}; sin coincidencia, el valor es
+    el defecto de la regla y las posiciones son None
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        candidates = _SCANNER.finditer(lowered)
+    else:
+        candidates = _SCANNER_IGNORECASE.finditer(text)
+
+    found = {}
+    for candidate in candidates:
+        # Cada posición candidata se confirma con la expresión exacta de las reglas pendientes
+        position = candidate.start()
+        for rule, exact in _RULES:
+            if rule.name not in found:
+                match = exact.match(text, position)
+                if match:
+                    found[rule.name] = match.span(1)
+        if len(found) == len(_RULES):
+            break
+
+    fields = {}
+    for rule, _ in _RULES:
+        if rule.name in found:
+            start, end = found[rule.name]
+            if rule.whole_line:
+                start, end = _line_span(text, start, end)
+            fields[rule.name] = {"valor": rule.convert(text[start:end]), "inicio": start, "fin": end}
+        else:
+            fields[rule.name] = {"valor": rule.default(), "inicio": None, "fin": None}
+    return fields
+
+
+def field_values(fields: Dict[str, Dict[str, Any]]) -> Dict[str, Optional[Any]]:
+    """Solo los valores de cada campo, con las claves de la respuesta del servicio"""
+    return {name: field["valor"] for name, field in fields.items()}
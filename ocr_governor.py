@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Reparto de núcleos entre las llamadas OCR en curso
+Tesseract paraleliza cada reconocimiento con OpenMP y, sin límite, cada llamada
+intenta usar todos los núcleos: con varios procesos OCR (y varios workers web)
+la máquina se sobresuscribe. El gobernador lleva en memoria compartida qué
+procesos están dentro de una llamada OCR y asigna a cada llamada nueva
+núcleos / llamadas en curso hilos OpenMP. En reposo una factura usa todos los
+núcleos; bajo carga cada llamada usa uno y el paralelismo lo dan los procesos.
+"""
+
+import os
+import ctypes
+import ctypes.util
+import logging
+import multiprocessing
+from contextlib import contextmanager
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+
+def _available_cores() -> int:
+    """Núcleos asignados al proceso (respeta cpusets y taskset), no los de la máquina"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+OCR_CPU_CORES = int(os.environ.get('OCR_CPU_CORES', _available_cores()))
+# Hilos OpenMP por llamada: 'auto' reparte los núcleos entre las llamadas en curso, un número los fija
+OCR_OMP_THREADS = os.environ.get('OCR_OMP_THREADS', 'auto').strip().lower()
+# Tope de hilos de una llamada aunque haya núcleos libres (0: sin tope)
+OCR_MAX_THREADS_PER_CALL = int(os.environ.get('OCR_MAX_THREADS_PER_CALL', 0))
+
+_libgomp = None
+
+
+def _set_omp_threads(threads: int):
+    """
+    Ajusta los hilos OpenMP de las próximas regiones paralelas de este hilo
+    (tesserocr reconoce en el hilo que llama). OMP_THREAD_LIMIT cubre además los
+    procesos tesseract que se lancen después (backend pytesseract)
+    """
+    global _libgomp
+    if _libgomp is None:
+        name = ctypes.util.find_library('gomp')
+        try:
+            # Si Tesseract está enlazado con libgomp, dlopen devuelve la misma biblioteca ya cargada.
+            # Se carga antes de fijar OMP_THREAD_LIMIT: libgomp lo lee una sola vez al cargarse
+            _libgomp = ctypes.CDLL(name) if name else False
+        except OSError:
+            _libgomp = False
+    if _libgomp:
+        _libgomp.omp_set_num_threads(threads)
+    os.environ['OMP_THREAD_LIMIT'] = str(threads)
+
+
+class CoreGovernor:
+    """
+    Presupuesto de hilos por llamada OCR según los núcleos y las llamadas en curso
+    Las llamadas en curso se registran por pid en un arreglo compartido entre
+    procesos: una entrada de un proceso que ya no existe (p. ej. muerto por plazo
+    vencido) se descarta en vez de quedar contada para siempre
+    """
+
+    def __init__(self, cores: int = OCR_CPU_CORES, mode: str = OCR_OMP_THREADS,
+                 max_threads: int = OCR_MAX_THREADS_PER_CALL):
+        self.cores = max(1, cores)
+        self.max_threads = min(max_threads, self.cores) if max_threads > 0 else self.cores
+        self.fixed_threads = None if mode == 'auto' else max(1, int(mode))
+        self._slots = multiprocessing.Array('i', max(64, 4 * self.cores))
+
+    def threads_for(self, active: int) -> int:
+        """Hilos para una llamada cuando hay `active` en curso (ella incluida)"""
+        if self.fixed_threads is not None:
+            return self.fixed_threads
+        return max(1, min(self.max_threads, self.cores // max(1, active)))
+
+    def _purge(self):
+        """Libera las entradas de procesos que ya no existen (con el lock tomado)"""
+        if os.name != 'posix':  # En Windows os.kill(pid, 0) terminaría el proceso
+            return
+        for i, pid in enumerate(self._slots):
+            if pid and pid != os.getpid():
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    self._slots[i] = 0
+                except PermissionError:
+                    pass
+
+    @contextmanager
+    def slot(self) -> Iterator[int]:
+        """Registra una llamada OCR en curso, aplica su presupuesto y entrega los hilos asignados"""
+        pid = os.getpid()
+        index = None
+        with self._slots.get_lock():
+            self._purge()
+            active = sum(1 for entry in self._slots if entry) + 1
+            for i, entry in enumerate(self._slots):
+                if not entry:
+                    self._slots[i] = pid
+                    index = i
+                    break
+        threads = self.threads_for(active)
+        _set_omp_threads(threads)
+        try:
+            yield threads
+        finally:
+            if index is not None:
+                with self._slots.get_lock():
+                    self._slots[index] = 0
+
+    def active(self) -> int:
+        with self._slots.get_lock():
+            self._purge()
+            return sum(1 for entry in self._slots if entry)
+
+    def stats(self) -> dict:
+        active = self.active()
+        return {
+            "cores": self.cores,
+            "mode": 'auto' if self.fixed_threads is None else 'fixed',
+            "active_calls": active,
+            "threads_next_call": self.threads_for(active + 1),
+        }
+
+
+# Se crea al importar y no de forma diferida: el arreglo compartido debe existir
+# antes del fork del maestro de Gunicorn y del ejecutor para que todos vean el mismo
+_governor = CoreGovernor()
+
+
+def get_governor() -> CoreGovernor:
+    """Devuelve el gobernador compartido por todos los procesos del servicio"""
+    return _governor
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Trabajos OCR asíncronos
+POST /ocr/jobs encola el documento y responde de inmediato con un id; hilos de
+despacho toman los trabajos de una cola en memoria, los ejecutan con el mismo
+camino que /ocr (caché + ejecutor de procesos) y conservan el resultado hasta
+que vence su retención.
+"""
+
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from ocr_deadline import OCR_DEADLINE_SECONDS, Deadline, DeadlineExceeded
+from ocr_executor import OCR_WORKERS, ExecutorBusyError
+from ocr_pipeline import OCRProcessingError
+
+logger = logging.getLogger(__name__)
+
+# Hilos de despacho (cada uno espera un trabajo en el ejecutor de procesos)
+OCR_JOB_THREADS = int(os.environ.get('OCR_JOB_THREADS', OCR_WORKERS))
+OCR_JOB_QUEUE_SIZE = int(os.environ.get('OCR_JOB_QUEUE_SIZE', 100))          # Trabajos en espera
+OCR_JOB_RESULT_TTL_SECONDS = float(os.environ.get('OCR_JOB_RESULT_TTL_SECONDS', 3600))
+OCR_JOB_MAX_RETAINED = int(os.environ.get('OCR_JOB_MAX_RETAINED', 1000))      # Trabajos terminados retenidos
+# Espera antes de reintentar un trabajo cuando el ejecutor está saturado
+_BUSY_RETRY_SECONDS = 0.5
+
+QUEUED, PROCESSING, COMPLETED, FAILED, CANCELLED = 'en_cola', 'procesando', 'completado', 'fallido', 'cancelado'
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobQueueFullError(Exception):
+    """La cola de trabajos asíncronos está llena"""
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class Job:
+    """Trabajo OCR con su estado, tiempos y resultado"""
+
+    def __init__(self, data: bytes, filename: str, options: Dict[str, Any], deadline_seconds: float):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.options = options
+        self.deadline_seconds = deadline_seconds
+        self.data = data
+        self.state = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.deadline = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        job = {
+            "job_id": self.id,
+            "estado": self.state,
+            "archivo_procesado": self.filename,
+            "creado_en": _isoformat(self.created_at),
+            "iniciado_en": _isoformat(self.started_at),
+            "finalizado_en": _isoformat(self.finished_at),
+        }
+        if self.state == COMPLETED:
+            job["resultado"] = self.result
+        if self.error is not None:
+            job["error"] = self.error
+        return job
+
+
+class JobManager:
+    """Cola en memoria, hilos de despacho y retención de resultados con vencimiento"""
+
+    def __init__(self, handler: Callable[[bytes, str, Dict[str, Any], Deadline], Dict[str, Any]],
+                 threads: int = OCR_JOB_THREADS, queue_size: int = OCR_JOB_QUEUE_SIZE,
+                 ttl_seconds: float = OCR_JOB_RESULT_TTL_SECONDS, max_retained: int = OCR_JOB_MAX_RETAINED):
+        self.handler = handler
+        self.threads = max(1, threads)
+        self.ttl_seconds = ttl_seconds
+        self.max_retained = max_retained
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._jobs = OrderedDict()  # id -> Job, en orden de finalización para los terminados
+        self._lock = threading.Lock()
+        self._workers = []
+        self._pid = None
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "expired": 0, "rejected": 0}
+
+    def _ensure_workers(self):
+        """Arranca los hilos de despacho de forma diferida (y de nuevo tras un fork)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._workers = [threading.Thread(target=self._work, name=f"ocr-job-{i}", daemon=True)
+                             for i in range(self.threads)]
+            for worker in self._workers:
+                worker.start()
+            logger.info(f"Despachador de trabajos OCR iniciado con {self.threads} hilos")
+
+    def submit(self, data: bytes, filename: str, options: Dict[str, Any],
+               deadline_seconds: float = OCR_DEADLINE_SECONDS) -> Job:
+        """Encola un documento; lanza JobQueueFullError si la cola está llena"""
+        self._ensure_workers()
+        self._purge()
+        job = Job(data, filename, options, deadline_seconds)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+                self._counters["rejected"] += 1
+            raise JobQueueFullError("Cola de trabajos OCR llena")
+        with self._lock:
+            self._counters["submitted"] += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._purge()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancela un trabajo en cola o en proceso; en proceso se cancela su plazo, lo
+        que lo saca de la cola del ejecutor o mata su proceso OCR y libera capacidad
+        Un trabajo ya terminado se elimina y libera su resultado
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.state in FINISHED:
+                del self._jobs[job_id]
+                return job
+            job.state = CANCELLED
+            job.finished_at = time.time()
+            job.data = None
+            self._counters["cancelled"] += 1
+            self._retain(job)
+            deadline = job.deadline
+        if deadline is not None:
+            deadline.cancel()
+        return job
+
+    def _retain(self, job: Job):
+        """Mueve un trabajo terminado al final del orden de retención (con el lock tomado)"""
+        self._jobs.move_to_end(job.id)
+
+    def _purge(self):
+        """Elimina resultados vencidos y, si sobran, los terminados más antiguos"""
+        now = time.time()
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.state in FINISHED]
+            excess = len(finished) - self.max_retained
+            for job in finished:
+                if excess > 0 or (self.ttl_seconds > 0 and now - job.finished_at > self.ttl_seconds):
+                    del self._jobs[job.id]
+                    self._counters["expired"] += 1
+                    excess -= 1
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            except Exception as e:  # Un fallo inesperado no debe matar el hilo de despacho
+                logger.error(f"Error inesperado en el trabajo {job.id}: {str(e)}")
+                self._finish(job, FAILED, error={"mensaje": "Error interno del servidor"})
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: Job):
+        with self._lock:
+            if job.state != QUEUED:
+                return
+            job.state = PROCESSING
+            job.started_at = time.time()
+            # El plazo corre desde que el trabajo sale de la cola, no desde que se envió
+            deadline = job.deadline = Deadline(job.deadline_seconds)
+            data = job.data
+        try:
+            while True:
+                try:
+                    result = self.handler(data, job.filename, job.options, deadline)
+                    break
+                except ExecutorBusyError:
+                    # El ejecutor está lleno de peticiones síncronas: se reintenta mientras quede plazo
+                    if job.state == CANCELLED:
+                        return
+                    if deadline.remaining() <= _BUSY_RETRY_SECONDS:
+                        raise DeadlineExceeded('cola', deadline.budget)
+                    time.sleep(_BUSY_RETRY_SECONDS)
+        except DeadlineExceeded as e:
+            self._finish(job, FAILED, error={"mensaje": "Tiempo de procesamiento excedido",
+                                             "etapa": e.stage, "presupuesto_segundos": e.budget})
+            return
+        except OCRProcessingError as e:
+            self._finish(job, FAILED, error={"mensaje": e.message})
+            return
+        self._finish(job, COMPLETED, result=result)
+
+    def _finish(self, job: Job, state: str, result: Optional[Dict[str, Any]] = None,
+                error: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            if job.state == CANCELLED:
+                return
+            job.state = state
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+            job.data = None
+            self._counters["completed" if state == COMPLETED else "failed"] += 1
+            if job.id in self._jobs:
+                self._retain(job)
+
+    def retained(self) -> int:
+        """Trabajos en cola, en proceso o con resultado aún consultable"""
+        self._purge()
+        with self._lock:
+            return len(self._jobs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+            return {
+                "threads": self.threads,
+                "queue_capacity": self._queue.maxsize,
+                "queued": states.count(QUEUED),
+                "processing": states.count(PROCESSING),
+                "retained": len(states),
+                **self._counters,
+            }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def retained_jobs() -> int:
+    """Trabajos retenidos por el gestor del proceso (0 si la API asíncrona no se usó)"""
+    return _manager.retained() if _manager is not None else 0
+
+
+def get_job_manager(handler: Callable) -> JobManager:
+    """Devuelve el gestor de trabajos del proceso, creándolo la primera vez con `handler`"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager(handler)
+    return _manager
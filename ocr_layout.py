@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Disposición espacial de las palabras reconocidas
+Reconstruye el texto a partir de las cajas de palabra que entrega el motor OCR
+(o la capa de texto del PDF), indexa las cajas en una rejilla por página y
+resuelve campos por posición: "el valor a la derecha o debajo de esta etiqueta".
+Permite completar campos que las expresiones regulares no encontraron sin una
+segunda pasada de OCR, y devolver la confianza y la caja de cada campo.
+"""
+
+import re
+import bisect
+import statistics
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from ocr_fields import FIELD_RULES
+
+
+class SpatialRule(NamedTuple):
+    """
+    Búsqueda espacial de un campo
+    labels: variantes de la etiqueta como secuencias de tokens normalizados
+    value: expresión que debe cumplir cada palabra candidata; None toma la línea completa
+    """
+    name: str
+    labels: Tuple[Tuple[str, ...], ...]
+    value: Optional[str]
+
+
+# Respaldo de las reglas de ocr_fields cuando el texto plano no basta
+# (valor en otra columna, debajo de la etiqueta o etiqueta con tildes mal leídas)
+SPATIAL_RULES = (
+    SpatialRule("proveedor", (("razon", "social"), ("nombre", "comercial")), None),
+    SpatialRule("monto", (("valor", "total", "usd"), ("valor", "total"), ("importe", "total")),
+                r'\$?\d[\d,]*\.\d{2}'),
+    SpatialRule("fecha", (("fecha", "de", "emision"), ("fecha", "emision")),
+                r'\d{1,4}[/-]\d{1,2}[/-]\d{1,4}'),
+    SpatialRule("numero_factura", (("factura", "n"), ("factura", "no"), ("factura",)), r'[\d-]{8,}'),
+    SpatialRule("ruc", (("ruc",),), r'\d{13}'),
+)
+
+_CONVERTERS = {rule.name: rule.convert for rule in FIELD_RULES}
+_VALUE_PATTERNS = {rule.name: re.compile(rule.value) for rule in SPATIAL_RULES if rule.value}
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_token(text: str) -> str:
+    """Minúsculas, sin tildes ni signos: 'EMISIÓN:' -> 'emision', 'N°' -> 'n'"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return _NON_ALNUM.sub('', ''.join(c for c in text if not unicodedata.combining(c)))
+
+
+def build_text(words: List[Dict[str, Any]]) -> str:
+    """
+    Une las palabras (en orden de lectura) en líneas separadas por saltos
+    Anota en cada palabra su posición "start"/"end" dentro del texto resultante
+    """
+    parts = []
+    position = 0
+    current = None
+    for word in words:
+        line = (word.get("page", 1), word.get("line", 0))
+        if current is not None:
+            separator = ' ' if line == current else '\n'
+            parts.append(separator)
+            position += 1
+        current = line
+        word["start"] = position
+        parts.append(word["text"])
+        position += len(word["text"])
+        word["end"] = position
+    return ''.join(parts)
+
+
+def union_box(words: Sequence[Dict[str, Any]]) -> List[float]:
+    return [min(w["left"] for w in words), min(w["top"] for w in words),
+            max(w["right"] for w in words), max(w["bottom"] for w in words)]
+
+
+class SpatialIndex:
+    """Índice de cajas de palabra en una rejilla por página"""
+
+    def __init__(self, words: List[Dict[str, Any]], page_sizes: Optional[Dict[int, Tuple[float, float]]] = None):
+        self.words = words
+        self.page_sizes = dict(page_sizes or {})
+        self._starts = [w.get("start", 0) for w in words]
+        self._tokens = [normalize_token(w["text"].split(':', 1)[0]) for w in words]
+        heights = [w["bottom"] - w["top"] for w in words if w["bottom"] > w["top"]]
+        self.line_height = statistics.median(heights) if heights else 10.0
+        # Celdas de unas cuatro líneas de alto: una consulta toca pocas celdas
+        self.cell = max(8.0, self.line_height * 4)
+        self._grid = defaultdict(list)
+        for i, word in enumerate(words):
+            page = word.get("page", 1)
+            for cx in range(int(word["left"] // self.cell), int(word["right"] // self.cell) + 1):
+                for cy in range(int(word["top"] // self.cell), int(word["bottom"] // self.cell) + 1):
+                    self._grid[(page, cx, cy)].append(i)
+            width, height = self.page_sizes.get(page, (0, 0))
+            self.page_sizes[page] = (max(width, word["right"]), max(height, word["bottom"]))
+
+    def query(self, page: int, left: float, top: float, right: float, bottom: float) -> List[int]:
+        """Índices (en orden de lectura) de las palabras que se solapan con el rectángulo"""
+        found = set()
+        for cx in range(int(max(left, 0) // self.cell), int(max(right, 0) // self.cell) + 1):
+            for cy in range(int(max(top, 0) // self.cell), int(max(bottom, 0) // self.cell) + 1):
+                for i in self._grid.get((page, cx, cy), ()):
+                    w = self.words[i]
+                    if w["left"] <= right and w["right"] >= left and w["top"] <= bottom and w["bottom"] >= top:
+                        found.add(i)
+        return sorted(found)
+
+    def words_in_span(self, start: int, end: int) -> List[Dict[str, Any]]:
+        """Palabras cuyo texto se solapa con el rango [start, end) del texto reconstruido"""
+        i = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        selected = []
+        while i < len(self.words) and self.words[i].get("start", 0) < end:
+            if self.words[i].get("end", 0) > start:
+                selected.append(self.words[i])
+            i += 1
+        return selected
+
+    def find_labels(self, tokens: Tuple[str, ...]) -> List[Tuple[int, int]]:
+        """Apariciones de la etiqueta como (primera, última) palabra consecutivas de una línea"""
+        matches = []
+        n = len(tokens)
+        for i in range(len(self.words) - n + 1):
+            if self._tokens[i] != tokens[0]:
+                continue
+            line = (self.words[i].get("page", 1), self.words[i].get("line", 0))
+            if all(self._tokens[i + k] == tokens[k]
+                   and (self.words[i + k].get("page", 1), self.words[i + k].get("line", 0)) == line
+                   for k in range(1, n)):
+                matches.append((i, i + n - 1))
+        return matches
+
+    def right_of(self, first: int, last: int) -> List[Dict[str, Any]]:
+        """Palabras a la derecha de la etiqueta dentro de su franja vertical, de izquierda a derecha"""
+        label = self.words[first:last + 1]
+        page = label[0].get("page", 1)
+        left, top, right, bottom = union_box(label)
+        width = self.page_sizes[page][0]
+        candidates = [self.words[i] for i in self.query(page, right, top, width, bottom) if i > last
+                      or self.words[i]["left"] >= right]
+        band = [w for w in candidates if top <= (w["top"] + w["bottom"]) / 2 <= bottom]
+        return sorted(band, key=lambda w: w["left"])
+
+    def below(self, first: int, last: int) -> List[Dict[str, Any]]:
+        """Primera línea bajo la etiqueta que se solapa horizontalmente con ella"""
+        label = self.words[first:last + 1]
+        page = label[0].get("page", 1)
+        left, top, right, bottom = union_box(label)
+        margin = (right - left) / 2
+        candidates = [self.words[i] for i in self.query(page, left - margin, bottom + 1, right + margin,
+                                                       bottom + self.line_height * 3)
+                      if self.words[i]["top"] > bottom - self.line_height / 4]
+        if not candidates:
+            return []
+        nearest = min(candidates, key=lambda w: w["top"])
+        line = [w for w in candidates if w["top"] <= (nearest["top"] + nearest["bottom"]) / 2]
+        return sorted(line, key=lambda w: w["left"])
+
+    def inline_value(self, index: int) -> Optional[Dict[str, Any]]:
+        """Resto de una palabra 'ETIQUETA:valor' leída sin espacio tras los dos puntos"""
+        text = self.words[index]["text"]
+        if ':' not in text or not text.split(':', 1)[1]:
+            return None
+        return dict(self.words[index], text=text.split(':', 1)[1])
+
+    def lookup(self, rule: SpatialRule) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """Valor del campo a la derecha o debajo de alguna de sus etiquetas"""
+        for tokens in rule.labels:
+            for first, last in self.find_labels(tokens):
+                inline = self.inline_value(last)
+                for neighbours in (self.right_of(first, last), self.below(first, last)):
+                    if inline is not None:
+                        neighbours = [inline] + neighbours
+                        inline = None
+                    neighbours = [w for w in neighbours if normalize_token(w["text"])]
+                    if not neighbours:
+                        continue
+                    if rule.value is None:
+                        return " ".join(w["text"] for w in neighbours).lstrip(': '), neighbours
+                    pattern = _VALUE_PATTERNS[rule.name]
+                    for word in neighbours[:3]:
+                        if pattern.fullmatch(word["text"].strip(':')):
+                            return word["text"].strip(':').lstrip('$'), [word]
+        return None
+
+    def describe(self, value: Any, words: List[Dict[str, Any]], source: str) -> Dict[str, Any]:
+        """Valor con su confianza (mínima de sus palabras), caja, página y origen"""
+        if not words:
+            return {"valor": value, "confianza": None, "bbox": None, "bbox_relativo": None,
+                    "pagina": None, "fuente": source}
+        page = words[0].get("page", 1)
+        words = [w for w in words if w.get("page", 1) == page]
+        box = union_box(words)
+        width, height = self.page_sizes.get(page, (0, 0))
+        return {
+            "valor": value,
+            "confianza": round(min(w.get("conf", 100.0) for w in words), 2),
+            "bbox": [round(v) for v in box],
+            "bbox_relativo": [round(box[0] / width, 4), round(box[1] / height, 4),
+                              round(box[2] / width, 4), round(box[3] / height, 4)] if width and height else None,
+            "pagina": page,
+            "fuente": source,
+        }
+
+
+def locate_fields(fields: Dict[str, Dict[str, Any]], index: SpatialIndex) -> Dict[str, Dict[str, Any]]:
+    """
+    Ubica cada campo extraído del texto en sus palabras y completa por posición los que faltan
+    Devuelve {campo: {"valor", "confianza", "bbox", "bbox_relativo", "pagina", "fuente"}}
+    con fuente 'texto', 'espacial' o 'defecto'
+    """
+    rules = {rule.name: rule for rule in SPATIAL_RULES}
+    located = {}
+    for name, field in fields.items():
+        if field["inicio"] is not None:
+            located[name] = index.describe(field["valor"], index.words_in_span(field["inicio"], field["fin"]), 'texto')
+            continue
+        found = index.lookup(rules[name]) if name in rules else None
+        if found:
+            raw, words = found
+            located[name] = index.describe(_CONVERTERS[name](raw), words, 'espacial')
+        else:
+            located[name] = index.describe(field["valor"], [], 'defecto')
+    return located
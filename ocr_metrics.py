@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Métricas del servicio en formato de texto de Prometheus (/metrics)
+Contadores, gauges e histogramas con etiquetas. Cada hilo acumula en su propio
+diccionario, sin locks en el camino caliente; solo la exposición recorre y
+suma los de todos los hilos. Al terminar un hilo sus valores se suman a un
+fragmento base, así que los hilos de corta vida (un pool por lote) no se
+acumulan. Con Gunicorn cada worker publica cada pocos segundos una foto de sus
+métricas en OCR_METRICS_DIR y /metrics suma las de todos, de modo que no
+importa a qué worker llegue el scrape.
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from ocr_admission import AdmissionRejected
+from ocr_deadline import DeadlineExceeded
+from ocr_executor import ExecutorBusyError
+from ocr_pipeline import ALLOWED_EXTENSIONS, OCRProcessingError
+
+logger = logging.getLogger(__name__)
+
+OCR_METRICS_ENABLED = os.environ.get('OCR_METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+# Directorio compartido entre workers de Gunicorn (vacío: solo las métricas de este proceso)
+OCR_METRICS_DIR = os.environ.get('OCR_METRICS_DIR', '')
+OCR_METRICS_FLUSH_SECONDS = float(os.environ.get('OCR_METRICS_FLUSH_SECONDS', 5))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Segundos: desde una imagen en caché hasta un PDF largo
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Métricas acumuladas de los workers que ya terminaron
+_ARCHIVE_FILE = 'archivados.json'
+# Valores posibles de la etiqueta file_type (además de 'otro')
+_FILE_TYPES = frozenset('jpg' if ext == 'jpeg' else ext for ext in ALLOWED_EXTENSIONS)
+
+
+class Metric:
+    """Métrica con nombre y etiquetas; los valores viven en los fragmentos por hilo del registro"""
+
+    kind = 'untyped'
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str,
+                 labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, Tuple[str, ...]]:
+        return self.name, tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        if not self.registry.enabled:
+            return
+        values = self.registry.shard()
+        key = self._key(labels)
+        values[key] = values.get(key, 0.0) + amount
+
+
+class Gauge(Counter):
+    """Gauge de incrementos y decrementos: la suma de los fragmentos es el valor actual"""
+
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels) -> Iterator[None]:
+        """Cuenta en curso mientras dura el bloque"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not self.registry.enabled:
+            return
+        values = self.registry.shard()
+        key = self._key(labels)
+        counts = values.get(key)
+        if counts is None:
+            # Conteo por intervalo (el último es +Inf), suma y cantidad
+            counts = values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+
+class _Shard:
+    """Valores de un hilo; vive en su threading.local y se libera al terminar el hilo"""
+
+    __slots__ = ('values', '__weakref__')
+
+    def __init__(self):
+        self.values = {}
+
+
+class MetricsRegistry:
+    """Registro de métricas con un fragmento de valores por hilo y uno base con los de hilos terminados"""
+
+    def __init__(self, enabled: bool = OCR_METRICS_ENABLED, directory: str = OCR_METRICS_DIR):
+        self.enabled = enabled
+        self.directory = directory or None
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = {}  # id -> valores de cada hilo vivo
+        self._base = {}
+        self._generation = 0
+        self._flusher = None
+        self._archived = False
+        if hasattr(os, 'register_at_fork'):
+            # Un proceso hijo (worker de Gunicorn, proceso OCR) empieza sin los valores del padre
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Los fragmentos heredados del padre que se liberen ahora no se suman al hijo
+        self._generation += 1
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = {}
+        self._base = {}
+        self._flusher = None
+        self._archived = False
+
+    def shard(self) -> Dict[Any, Any]:
+        """Valores de este hilo; el primer uso en cada hilo lo registra"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            weakref.finalize(shard, self._retire, shard.values, self._generation)
+            with self._lock:
+                self._shards[id(shard.values)] = shard.values
+                if self.directory and self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+                    self._flusher.start()
+        return shard.values
+
+    def _retire(self, values: Dict[Any, Any], generation: int):
+        """Al terminar un hilo, suma sus valores al fragmento base y deja de recorrerlo"""
+        if generation != self._generation:
+            return
+        with self._lock:
+            if self._shards.pop(id(values), None) is None:
+                return
+            for key, value in values.items():
+                _merge(self._base, key, value)
+
+    def _register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], List[Tuple[str, str, str, Dict[str, str], float]]]):
+        """Función que al exponer devuelve gauges calculados en el momento: (nombre, tipo, ayuda, etiquetas, valor)"""
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict[Any, Any]:
+        """Suma de los fragmentos de todos los hilos de este proceso"""
+        merged = {}
+        # Con el lock un hilo que termina no puede pasar sus valores a la base a mitad de la suma
+        with self._lock:
+            for shard in [self._base, *self._shards.values()]:
+                # list() de los items es atómico bajo el GIL aunque el hilo dueño siga escribiendo
+                for key, value in list(shard.items()):
+                    _merge(merged, key, value)
+        return merged
+
+    # Publicación entre workers de Gunicorn
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"metricas-{pid}.json")
+
+    def _write(self, path: str, snapshot: Dict[Any, Any]):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump([[name, list(labels), value] for (name, labels), value in snapshot.items()], f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read(path: str) -> Dict[Any, Any]:
+        with open(path, 'r', encoding='utf-8') as f:
+            return {(name, tuple(labels)): value for name, labels, value in json.load(f)}
+
+    def flush(self):
+        """Publica la foto de este proceso para que los demás workers la sumen"""
+        # Tras archivar, una foto nueva contaría dos veces los mismos valores
+        if not self.directory or self._archived:
+            return
+        try:
+            self._write(self._path(os.getpid()), self.snapshot())
+        except OSError as e:
+            logger.warning(f"No se pudieron publicar las métricas: {str(e)}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(OCR_METRICS_FLUSH_SECONDS)
+            self.flush()
+
+    def archive(self):
+        """
+        Al terminar un worker, suma sus contadores e histogramas a los archivados
+        (sus gauges se descartan) y borra su foto
+        """
+        if not self.directory:
+            return
+        try:
+            import fcntl
+        except ImportError:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, 'archivados.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                archive_path = os.path.join(self.directory, _ARCHIVE_FILE)
+                archived = self._read(archive_path) if os.path.exists(archive_path) else {}
+                for key, value in self.snapshot().items():
+                    if self._metrics.get(key[0]) is not None and self._metrics[key[0]].kind != 'gauge':
+                        _merge(archived, key, value)
+                self._write(archive_path, archived)
+                self._archived = True
+                try:
+                    os.remove(self._path(os.getpid()))
+                except FileNotFoundError:
+                    pass
+        except OSError as e:
+            logger.warning(f"No se pudieron archivar las métricas: {str(e)}")
+
+    def _collect_all(self) -> Dict[Any, Any]:
+        """Este proceso en vivo más las fotos de los demás workers y los archivados"""
+        merged = self.snapshot()
+        if not self.directory or not os.path.isdir(self.directory):
+            return merged
+        own = os.path.basename(self._path(os.getpid()))
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json') or name == own:
+                continue
+            path = os.path.join(self.directory, name)
+            alive = name == _ARCHIVE_FILE or _pid_alive(name)
+            try:
+                values = self._read(path)
+            except (OSError, ValueError):
+                continue
+            for key, value in values.items():
+                metric = self._metrics.get(key[0])
+                # Los gauges de un worker muerto sin archivar (p. ej. por SIGKILL) ya no valen
+                if metric is not None and (alive or metric.kind != 'gauge'):
+                    _merge(merged, key, value)
+        return merged
+
+    def render(self) -> str:
+        """Texto de exposición de Prometheus (formato 0.0.4)"""
+        values = self._collect_all()
+        by_metric = {}
+        for (name, labels), value in values.items():
+            by_metric.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(by_metric.get(name, ())):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-2]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-2])}")
+                lines.append(f"{name}_count{_labels(pairs)} {value[-1]}")
+        declared = set()
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.warning(f"Colector de métricas con error: {str(e)}")
+                continue
+            for name, kind, documentation, labels, value in samples:
+                if name not in declared:
+                    declared.add(name)
+                    lines.append(f"# HELP {name} {documentation}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_labels(list(labels.items()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(merged: Dict[Any, Any], key: Any, value: Any):
+    current = merged.get(key)
+    if current is None:
+        merged[key] = list(value) if isinstance(value, list) else value
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            current[i] += v
+    else:
+        merged[key] = current + value
+
+
+def _pid_alive(name: str) -> bool:
+    try:
+        pid = int(name[len('metricas-'):-len('.json')])
+        os.kill(pid, 0)
+        return True
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + '}'
+
+
+def _number(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def file_type(filename: str) -> str:
+    """
+    Etiqueta de tipo de archivo: la extensión normalizada de un tipo soportado u
+    'otro', para que los nombres que envía el cliente no creen series nuevas
+    """
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    extension = {'jpeg': 'jpg', 'tif': 'tiff'}.get(extension, extension)
+    return extension if extension in _FILE_TYPES else 'otro'
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter('ocr_http_requests_total', "Peticiones HTTP por endpoint y código", ('endpoint', 'status'))
+HTTP_SECONDS = REGISTRY.histogram('ocr_http_request_duration_seconds', "Duración de las peticiones HTTP", ('endpoint',))
+HTTP_IN_FLIGHT = REGISTRY.gauge('ocr_http_requests_in_flight', "Peticiones HTTP en curso", ('endpoint',))
+DOCUMENTS = REGISTRY.counter('ocr_documents_total', "Documentos procesados por tipo y resultado", ('file_type', 'outcome'))
+DOCUMENT_SECONDS = REGISTRY.histogram('ocr_document_duration_seconds', "Duración de punta a punta por documento",
+                                      ('file_type', 'outcome'))
+DOCUMENTS_IN_FLIGHT = REGISTRY.gauge('ocr_documents_in_flight', "Documentos en proceso", ('file_type',))
+STAGE_SECONDS = REGISTRY.histogram('ocr_stage_duration_seconds', "Duración de cada etapa del pipeline",
+                                   ('stage', 'file_type', 'outcome'))
+DOCUMENT_BYTES = REGISTRY.counter('ocr_document_bytes_total', "Bytes de documentos recibidos", ('file_type',))
+PAGES = REGISTRY.counter('ocr_pages_total', "Páginas procesadas por método (ocr, text_layer, plantilla)",
+                         ('file_type', 'method'))
+
+
+def document_outcome(error: Optional[BaseException]) -> str:
+    """Etiqueta de resultado de un documento fallido según su excepción"""
+    if isinstance(error, OCRProcessingError):
+        return 'invalid'
+    if isinstance(error, (AdmissionRejected, ExecutorBusyError)):
+        return 'rejected'
+    if isinstance(error, DeadlineExceeded):
+        return 'deadline'
+    return 'error'
+
+
+class DocumentTracker:
+    """Duración, etapas, bytes y páginas de un documento; `outcome` se fija al terminar"""
+
+    def __init__(self, filename: str, size: int):
+        self.file_type = file_type(filename)
+        self.size = size
+        self.outcome = 'ok'
+        self.spans = []  # (etapa, segundos)
+        self.pages = {}  # método -> páginas
+
+    def add_result(self, result: Dict[str, Any]):
+        """Páginas del resultado según su método de extracción"""
+        method = result.get("metodo_extraccion", 'ocr')
+        self.pages[method] = self.pages.get(method, 0) + len(result.get("paginas_procesadas") or [1])
+
+
+@contextmanager
+def track_document(filename: str, size: int) -> Iterator[DocumentTracker]:
+    """Registra un documento en proceso y al salir sus métricas, con el resultado de la excepción si falló"""
+    tracker = DocumentTracker(filename, size)
+    DOCUMENTS_IN_FLIGHT.inc(file_type=tracker.file_type)
+    started = time.perf_counter()
+    try:
+        yield tracker
+    except BaseException as e:
+        tracker.outcome = document_outcome(e)
+        raise
+    finally:
+        DOCUMENTS_IN_FLIGHT.dec(file_type=tracker.file_type)
+        labels = {"file_type": tracker.file_type, "outcome": tracker.outcome}
+        DOCUMENTS.inc(**labels)
+        DOCUMENT_SECONDS.observe(time.perf_counter() - started, **labels)
+        DOCUMENT_BYTES.inc(tracker.size, file_type=tracker.file_type)
+        for stage, seconds in tracker.spans:
+            STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+        for method, count in tracker.pages.items():
+            PAGES.inc(count, file_type=tracker.file_type, method=method)
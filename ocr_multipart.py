@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Lectura incremental de cuerpos multipart/form-data
+Recorre el cuerpo de la petición a medida que llega con el decodificador sin
+E/S de Werkzeug y entrega cada archivo en cuanto su parte está completa, sin
+esperar al resto de la subida ni volcarla a disco. Quien consume los archivos
+marca el ritmo de lectura del socket, así que la memoria queda acotada.
+"""
+
+import io
+import os
+import logging
+from typing import IO, Iterator, Optional, Tuple
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from ocr_pipeline import OCRProcessingError
+
+logger = logging.getLogger(__name__)
+
+OCR_UPLOAD_CHUNK_BYTES = int(os.environ.get('OCR_UPLOAD_CHUNK_BYTES', 64 * 1024))
+OCR_MAX_FILE_BYTES = int(os.environ.get('OCR_MAX_FILE_BYTES', 50 * 1024 * 1024))   # Por archivo
+OCR_MAX_BATCH_FILES = int(os.environ.get('OCR_MAX_BATCH_FILES', 1000))             # Por petición
+# Campos de formulario (opciones) que se guardan en memoria
+_MAX_FIELD_BYTES = 64 * 1024
+
+
+class MultipartStream:
+    """Archivos y campos de un cuerpo multipart leídos bajo demanda"""
+
+    def __init__(self, stream: IO[bytes], content_type: Optional[str],
+                 max_file_bytes: int = OCR_MAX_FILE_BYTES, max_files: int = OCR_MAX_BATCH_FILES,
+                 chunk_size: int = OCR_UPLOAD_CHUNK_BYTES):
+        mimetype, params = parse_options_header(content_type or '')
+        if mimetype != 'multipart/form-data' or not params.get('boundary'):
+            raise OCRProcessingError("Se esperaba un cuerpo multipart/form-data")
+        self._stream = stream
+        # Sin max_form_memory_size: el decodificador lo aplica a todo su buffer, archivos
+        # incluidos; el tamaño de campos y archivos se controla en iter_files
+        self._decoder = MultipartDecoder(params['boundary'].encode('latin-1'))
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.chunk_size = chunk_size
+        self.fields = MultiDict()  # Campos de formulario recibidos hasta el momento
+        self.bytes_received = 0
+
+    def _events(self):
+        """Eventos del decodificador, leyendo del stream solo cuando hace falta"""
+        finished = False
+        while True:
+            try:
+                event = self._decoder.next_event()
+            except ValueError as e:
+                raise OCRProcessingError(f"Cuerpo multipart inválido: {str(e)}")
+            if isinstance(event, NeedData):
+                if finished:
+                    return
+                chunk = self._stream.read(self.chunk_size)
+                self.bytes_received += len(chunk)
+                finished = not chunk
+                self._decoder.receive_data(chunk or None)
+                continue
+            if isinstance(event, Epilogue):
+                return
+            yield event
+
+    def iter_files(self, field_name: str = 'files') -> Iterator[Tuple[str, bytes]]:
+        """
+        Entrega (nombre, bytes) de cada archivo del campo `field_name` en cuanto se
+        termina de recibir; los campos simples se acumulan en `fields`
+        """
+        current = None   # Field o File en curso
+        buffer = None
+        count = 0
+        for event in self._events():
+            if isinstance(event, (Field, File)):
+                current = event
+                buffer = io.BytesIO()
+                continue
+            if not isinstance(event, Data) or current is None:
+                continue
+            keep = isinstance(current, Field) or (current.name == field_name and current.filename)
+            if keep:
+                buffer.write(event.data)
+                if isinstance(current, File) and buffer.tell() > self.max_file_bytes:
+                    raise OCRProcessingError(
+                        f"Archivo demasiado grande: {current.filename} (máximo {self.max_file_bytes} bytes)", 413)
+                if isinstance(current, Field) and buffer.tell() > _MAX_FIELD_BYTES:
+                    raise OCRProcessingError("Campo de formulario demasiado grande", 413)
+            if event.more_data:
+                continue
+            if isinstance(current, Field):
+                self.fields.add(current.name, buffer.getvalue().decode('utf-8', 'replace'))
+            elif keep:
+                count += 1
+                if count > self.max_files:
+                    raise OCRProcessingError(f"Demasiados archivos en el lote (máximo {self.max_files})", 413)
+                yield current.filename, buffer.getvalue()
+            current = buffer = None
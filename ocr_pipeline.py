@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Pipeline OCR de facturas independiente de Flask
+Decodificación, rasterizado de PDF, OCR y extracción de campos; se ejecuta
+tanto en el proceso web como en los procesos del ejecutor OCR.
+"""
+
+import io
+import os
+import re
+import json
+import logging
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pdf2image.exceptions import PDFPopplerTimeoutError
+
+from ocr_engine import get_engine_pool
+from ocr_textlayer import extract_text_layer, is_usable
+from ocr_preprocess import parse_steps, preprocess
+from ocr_fields import extract_fields, field_values
+from ocr_layout import SpatialIndex, build_text, locate_fields
+from ocr_deadline import Deadline, DeadlineExceeded
+from ocr_templates import OCR_TEMPLATES_ENABLED, get_template_store, recognize_page
+
+logger = logging.getLogger(__name__)
+
+# Tipos de archivo aceptados por el servicio
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf', 'tiff', 'bmp'}
+
+# Rasterizado de PDF: resolución y máximo de páginas por documento
+OCR_PDF_DPI = int(os.environ.get('OCR_PDF_DPI', 200))
+OCR_MAX_PDF_PAGES = int(os.environ.get('OCR_MAX_PDF_PAGES', 50))
+
+# Selección de páginas por defecto: solo la primera, como hasta ahora
+DEFAULT_PAGES = 'first'
+_PAGES_PATTERN = re.compile(r'^\d+(-\d+)?(,\d+(-\d+)?)*$')
+
+
+class OCRProcessingError(Exception):
+    """Error de procesamiento de un documento que se devuelve al cliente"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        # Ambos valores en args para que el error sobreviva al pickle entre procesos
+        super().__init__(message, status_code)
+        self.message = message
+        self.status_code = status_code
+
+    def __str__(self):
+        return self.message
+
+
+class InvoiceDataExtractor:
+    """Clase para extraer datos específicos de facturas usando OCR"""
+
+    def __init__(self):
+        self.extracted_text = ""
+        self.words = []
+
+    def extract_text_from_image(self, image, timeout=None):
+        """
+        Extrae texto y cajas de palabra de la imagen (PIL o NumPy) usando el pool de
+        motores Tesseract; el texto se reconstruye a partir de las palabras
+        timeout (segundos) corta Tesseract y lanza TimeoutError
+        """
+        try:
+            # Motor persistente con --oem 3 --psm 6 y spa+eng ya cargados
+            self.words = get_engine_pool().recognize(image, ocr_timeout=timeout)
+            self.extracted_text = build_text(self.words)
+            logger.info("Texto extraído exitosamente")
+            logger.debug(f"Texto OCR extraído:\n{self.extracted_text}")  # Log detallado
+            if not self.extracted_text.strip():
+                logger.error("El OCR no extrajo ningún texto. Verifica la calidad de la imagen o la instalación de Tesseract.")
+                return False
+            return True
+        except TimeoutError:
+            raise
+        except Exception as e:
+            logger.error(f"Error al extraer texto: {str(e)}")
+            return False
+
+    def extract_fields(self):
+        """
+        Extrae todos los campos en una sola pasada con el motor compilado (ocr_fields)
+        Devuelve {campo: {"valor", "inicio", "fin"}}
+        """
+        return extract_fields(self.extracted_text)
+
+    def locate_fields(self, page_sizes=None):
+        """
+        Campos con confianza y caja de palabra; los que el texto no resuelve se
+        buscan por posición junto a su etiqueta, sin repetir el OCR
+        """
+        return locate_fields(self.extract_fields(), SpatialIndex(self.words, page_sizes))
+
+    def extract_provider(self):
+        """Extrae el nombre del proveedor"""
+        lines = self.extracted_text.split('\n')
+        for line in lines:
+            if "razón social" in line.lower():
+                return line.split(":", 1)[-1].strip()
+            if "nombre comercial" in line.lower():
+                return line.split(":", 1)[-1].strip()
+        return "Proveedor no identificado"
+
+    def extract_amount(self):
+        """Extrae el monto total de la factura"""
+        # Buscar línea con VALOR TOTAL USD
+        match = re.search(r'VALOR TOTAL USD\s*([\d,.]+)', self.extracted_text, re.IGNORECASE)
+        if match:
+            try:
+                return float(match.group(1).replace(',', ''))
+            except ValueError:
+                pass
+        # Fallback anterior
+        return 0.0
+
+    def extract_date(self):
+        """Extrae la fecha de la factura"""
+        # Buscar FECHA DE EMISIÓN
+        match = re.search(r'FECHA DE EMISI[ÓO]N[:\s]*([\d/-]{8,10})', self.extracted_text, re.IGNORECASE)
+        if match:
+            return match.group(1)
+        # Fallback anterior
+        return datetime.now().strftime("%Y-%m-%d")
+
+    def extract_invoice_number(self):
+        """Extrae el número de factura"""
+        # Buscar patrones como N°: 001-008-004080008
+        match = re.search(r'N[°º]?:?\s*([\d-]{8,})', self.extracted_text)
+        if match:
+            return match.group(1)
+        # Fallback anterior
+        return "N/A"
+
+    def extract_ruc(self):
+        """Extrae el RUC del proveedor"""
+        # Buscar exactamente 13 dígitos
+        ruc_candidates = re.findall(r'\b\d{13}\b', self.extracted_text)
+        if ruc_candidates:
+            return ruc_candidates[0]
+        # Fallback anterior
+        return "N/A"
+
+
+def is_allowed_file(filename: str) -> bool:
+    """Verifica la extensión del archivo contra ALLOWED_EXTENSIONS"""
+    return filename.lower().endswith(tuple('.' + ext for ext in ALLOWED_EXTENSIONS))
+
+
+def parse_options(values: Mapping[str, str]) -> Dict[str, Any]:
+    """
+    Construye las opciones de procesamiento a partir de los parámetros recibidos
+    Siempre contiene los valores efectivos (también los por defecto y los que
+    dependen del entorno, como OCR_PREPROCESS): forman parte de la clave de caché,
+    y un cambio de configuración entre despliegues no debe servir resultados viejos
+    """
+    pages = (values.get('pages') or DEFAULT_PAGES).strip().lower().replace(' ', '')
+    if pages not in ('first', 'all') and not _PAGES_PATTERN.match(pages):
+        raise OCRProcessingError("Selección de páginas inválida (use first, all, N, N-M o N,M)")
+    # preprocess: none, default o lista de etapas (grayscale,downscale,binarize,crop,deskew)
+    try:
+        steps = parse_steps(values.get('preprocess'))
+    except ValueError as e:
+        raise OCRProcessingError(str(e))
+    return {
+        'pages': pages,
+        # text_layer=0 fuerza rasterizado + OCR aunque el PDF tenga capa de texto
+        'text_layer': (values.get('text_layer') or '1').strip().lower() not in ('0', 'false', 'no'),
+        # templates=0 reconoce la página completa aunque el proveedor tenga plantilla
+        'templates': OCR_TEMPLATES_ENABLED and
+        (values.get('templates') or '1').strip().lower() not in ('0', 'false', 'no'),
+        'preprocess': ",".join(steps) or 'none',
+    }
+
+
+def resolve_pages(spec: str, page_count: int) -> List[int]:
+    """Convierte la selección ('first', 'all', '2-5', '1,3') en números de página válidos"""
+    if spec == 'first':
+        pages = [1]
+    elif spec == 'all':
+        pages = list(range(1, page_count + 1))
+    else:
+        pages = []
+        for part in spec.split(','):
+            start, _, end = part.partition('-')
+            first, last = int(start), int(end or start)
+            pages.extend(range(first, min(last, page_count) + 1))
+    selected = sorted({p for p in pages if 1 <= p <= page_count})
+    if len(selected) > OCR_MAX_PDF_PAGES:
+        logger.warning(f"Selección de {len(selected)} páginas limitada a {OCR_MAX_PDF_PAGES}")
+        selected = selected[:OCR_MAX_PDF_PAGES]
+    return selected
+
+
+def iter_pdf_pages(data: bytes, options: Dict[str, Any], deadline: Deadline) -> Iterator[Tuple[int, Optional[Image.Image], Optional[Dict[str, Any]]]]:
+    """
+    Recorre las páginas seleccionadas del PDF entregando (página, imagen, capa de texto)
+    Las páginas con capa de texto nativa usable se entregan con sus palabras en
+    píxeles a OCR_PDF_DPI, como si se hubieran rasterizado; el resto
+    se rasteriza de forma diferida, una a la vez en un directorio temporal, de
+    modo que la memoria no depende del número de páginas. Cada subproceso de
+    poppler recibe como timeout lo que queda del plazo y muere al vencer
+    """
+    with tempfile.TemporaryDirectory(prefix='ocr-pdf-') as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, 'documento.pdf')
+        with open(pdf_path, 'wb') as f:
+            f.write(data)
+        deadline.enter('decodificacion')
+        try:
+            page_count = int(pdfinfo_from_path(pdf_path, timeout=deadline.timeout())["Pages"])
+        except PDFPopplerTimeoutError:
+            raise DeadlineExceeded(deadline.stage, deadline.budget)
+        except Exception as e:
+            logger.error(f"Error al convertir PDF: {str(e)}")
+            raise OCRProcessingError("Error al convertir PDF a imagen")
+
+        selected = resolve_pages(options.get('pages', DEFAULT_PAGES), page_count)
+        if not selected:
+            logger.error("No se pudo convertir el PDF a imagen.")
+            raise OCRProcessingError("No se pudo convertir el PDF a imagen")
+
+        # Camino rápido: capa de texto de los PDF generados electrónicamente
+        text_layer = {}
+        if options.get('text_layer', True):
+            deadline.enter('capa_texto')
+            text_layer = extract_text_layer(pdf_path, selected, timeout=deadline.timeout())
+            deadline.check()  # pdftotext muerto por el plazo devuelve {}: se informa esta etapa
+
+        for page_number in selected:
+            page = text_layer.get(page_number)
+            if is_usable(page):
+                yield page_number, None, _scale_text_layer(page, OCR_PDF_DPI / 72.0)
+                continue
+            deadline.enter('rasterizado')
+            try:
+                paths = convert_from_path(
+                    pdf_path, dpi=OCR_PDF_DPI, first_page=page_number, last_page=page_number,
+                    output_folder=tmp_dir, output_file=f"pagina-{page_number}", fmt='ppm',
+                    single_file=True, paths_only=True, timeout=deadline.timeout()
+                )
+            except PDFPopplerTimeoutError:
+                raise DeadlineExceeded(deadline.stage, deadline.budget)
+            except Exception as e:
+                logger.error(f"Error al convertir PDF: {str(e)}")
+                raise OCRProcessingError("Error al convertir PDF a imagen")
+            if not paths:
+                raise OCRProcessingError("No se pudo convertir el PDF a imagen")
+            with Image.open(paths[0]) as image:
+                image.load()
+                yield page_number, image.convert('RGB') if image.mode != 'RGB' else image, None
+            os.remove(paths[0])
+        logger.info(f"PDF procesado: páginas {selected} de {page_count}")
+
+
+def _scale_text_layer(page: Dict[str, Any], scale: float) -> Dict[str, Any]:
+    """Convierte las coordenadas de la capa de texto de puntos PDF a píxeles"""
+    words = [dict(w, left=w["left"] * scale, top=w["top"] * scale,
+                  right=w["right"] * scale, bottom=w["bottom"] * scale) for w in page["words"]]
+    return dict(page, words=words, width=page["width"] * scale, height=page["height"] * scale)
+
+
+def load_image(data: bytes) -> Image.Image:
+    """Decodifica una imagen recibida en una imagen RGB"""
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Convertir a RGB si es necesario
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+    except Exception as e:
+        logger.error(f"Error al abrir imagen: {str(e)}")
+        raise OCRProcessingError("Error al procesar imagen")
+
+
+def iter_document_pages(data: bytes, filename: str, options: Dict[str, Any],
+                        deadline: Optional[Deadline] = None) -> Iterator[Tuple[int, Optional[Image.Image], Optional[Dict[str, Any]]]]:
+    """Páginas a procesar del documento: las seleccionadas del PDF o la imagen única"""
+    deadline = deadline or Deadline(None)
+    if filename.lower().endswith('.pdf'):
+        yield from iter_pdf_pages(data, options, deadline)
+    else:
+        deadline.enter('decodificacion')
+        yield 1, load_image(data), None
+
+
+def process_document(data: bytes, filename: str, options: Optional[Dict[str, Any]] = None,
+                     deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Procesa un documento completo y devuelve los datos extraídos
+    Lanza OCRProcessingError si el documento no se puede procesar y
+    DeadlineExceeded (con la etapa) si se agota el plazo de la petición
+    """
+    options = options or {}
+    deadline = deadline or Deadline(None)
+    # Un trabajo que salió de la cola con el plazo vencido no se empieza
+    deadline.check()
+    logger.info(f"Procesando archivo: {filename}")
+
+    # Palabras página a página (capa nativa u OCR); todo alimenta la extracción de campos
+    extractor = InvoiceDataExtractor()
+    steps = parse_steps(options.get('preprocess'))
+    # Plantillas por proveedor solo con la primera página (la que las enseña)
+    templates = get_template_store() if options.get('templates', True) and \
+        options.get('pages', DEFAULT_PAGES) == DEFAULT_PAGES else None
+    template_fields = None
+    preprocess_ms = {}
+    words = []
+    page_sizes = {}
+    processed_pages = []
+    methods = set()
+    for page_number, image, layer in iter_document_pages(data, filename, options, deadline):
+        if layer is not None:
+            methods.add('text_layer')
+            page_words = layer["words"]
+            page_sizes[page_number] = (layer["width"], layer["height"])
+        else:
+            # Preprocesamiento vectorizado entre la decodificación y Tesseract
+            deadline.enter('preprocesamiento')
+            pixels, report = preprocess(image, steps)
+            for step, ms in report["etapas_ms"].items():
+                preprocess_ms[step] = round(preprocess_ms.get(step, 0.0) + ms, 2)
+            deadline.enter('ocr')
+            try:
+                page_words = None
+                if templates is not None:
+                    # Zona del RUC y, si el RUC tiene plantilla, solo sus regiones
+                    try:
+                        recognized = recognize_page(pixels, steps, templates, deadline)
+                    except TimeoutError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Error al reconocer con plantilla: {str(e)}")
+                        recognized = None
+                    if recognized is not None:
+                        page_words, template_fields = recognized
+                if page_words is None:
+                    recognized = extractor.extract_text_from_image(pixels, timeout=deadline.timeout())
+                    page_words = extractor.words if recognized else []
+            except TimeoutError:
+                raise DeadlineExceeded(deadline.stage, deadline.budget)
+            methods.add('plantilla' if template_fields else 'ocr')
+            page_sizes[page_number] = tuple(report["tamano_final"])
+        for word in page_words:
+            word["page"] = page_number
+        words.extend(page_words)
+        processed_pages.append(page_number)
+    extractor.words = words
+    extractor.extracted_text = build_text(words)
+    if not extractor.extracted_text.strip():
+        logger.error("No se pudo extraer texto de la imagen. Revisa los logs para más detalles.")
+        raise OCRProcessingError("No se pudo extraer texto de la imagen")
+
+    # Extraer información específica (todos los campos en una pasada, con respaldo espacial)
+    deadline.enter('extraccion')
+    fields = template_fields or extractor.locate_fields(page_sizes)
+    if templates is not None and methods == {'ocr'} and processed_pages == [1]:
+        templates.learn(fields, steps)
+    extracted_data = {
+        **field_values(fields),
+        "campos": fields,
+        "texto_completo": extractor.extracted_text[:500] + "..." if len(extractor.extracted_text) > 500 else extractor.extracted_text,
+        "archivo_procesado": filename,
+        "paginas_procesadas": processed_pages,
+        "metodo_extraccion": methods.pop() if len(methods) == 1 else "mixed",
+        "preprocesamiento": {"etapas": steps, "etapas_ms": preprocess_ms} if preprocess_ms else None,
+        "timestamp": datetime.now().isoformat(),
+        "status": "success"
+    }
+
+    logger.info(f"Datos extraídos exitosamente: {extracted_data['proveedor']} - {extracted_data['monto']}")
+    logger.debug(f"Datos extraídos completos: {json.dumps(extracted_data, ensure_ascii=False, indent=2)}")
+    return extracted_data
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Preprocesamiento vectorizado de imágenes antes del OCR
+Escala de grises, reducción a una resolución efectiva objetivo, binarización
+adaptativa, recorte de márgenes y corrección de inclinación por perfil de
+proyección, todo como operaciones sobre arreglos NumPy.
+"""
+
+import os
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Orden fijo de las etapas; cada petición elige un subconjunto
+PREPROCESS_STEPS = ('grayscale', 'downscale', 'binarize', 'crop', 'deskew')
+# Por defecto solo escala de grises; el resto de etapas se activa de forma explícita
+OCR_PREPROCESS = os.environ.get('OCR_PREPROCESS', 'grayscale')
+OCR_TARGET_DPI = int(os.environ.get('OCR_TARGET_DPI', 300))
+
+# Lado largo de una página A4 en pulgadas, para estimar el DPI de fotos sin metadatos
+_A4_LONG_SIDE_INCHES = 11.69
+# Reducción mínima que justifica remuestrear (evita reescalar por un 1-2 %)
+_MIN_DOWNSCALE = 1.05
+
+
+def parse_steps(spec: Optional[str]) -> List[str]:
+    """Convierte 'none', 'default' o una lista separada por comas en etapas válidas"""
+    spec = (spec or 'default').strip().lower()
+    if spec == 'default':
+        spec = OCR_PREPROCESS
+    if spec in ('', 'none'):
+        return []
+    steps = [s.strip() for s in spec.split(',') if s.strip()]
+    unknown = [s for s in steps if s not in PREPROCESS_STEPS]
+    if unknown:
+        raise ValueError(f"Etapas de preprocesamiento desconocidas: {', '.join(unknown)}")
+    return [s for s in PREPROCESS_STEPS if s in steps]
+
+
+def estimate_dpi(image: Image.Image) -> float:
+    """DPI declarado en la imagen o estimado suponiendo una página A4"""
+    dpi = image.info.get('dpi')
+    if dpi and dpi[0] and dpi[0] > 1:
+        return float(dpi[0])
+    return max(image.size) / _A4_LONG_SIDE_INCHES
+
+
+def to_grayscale(pixels: np.ndarray) -> np.ndarray:
+    """RGB -> luminancia (BT.601) con aritmética entera"""
+    if pixels.ndim == 2:
+        return pixels
+    rgb = pixels[..., :3].astype(np.uint16)
+    return ((rgb[..., 0] * 77 + rgb[..., 1] * 150 + rgb[..., 2] * 29) >> 8).astype(np.uint8)
+
+
+def downscale(pixels: np.ndarray, source_dpi: float, target_dpi: int = OCR_TARGET_DPI) -> Tuple[np.ndarray, float]:
+    """
+    Reduce por promedio de área hasta el DPI objetivo con un factor fraccionario
+    (una foto de 345 dpi baja a 300); devuelve (imagen, dpi)
+    """
+    scale = target_dpi / source_dpi
+    if scale > 1 / _MIN_DOWNSCALE:
+        return pixels, source_dpi
+    h, w = pixels.shape[:2]
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return np.asarray(Image.fromarray(pixels).resize(size, Image.BOX)), source_dpi * size[0] / w
+
+
+def binarize(gray: np.ndarray, window: int = 31, threshold: float = 0.15) -> np.ndarray:
+    """
+    Binarización adaptativa de Bradley con imagen integral
+    Un píxel es tinta si es más oscuro que la media de su ventana en `threshold`
+    """
+    gray = to_grayscale(gray)
+    half = window // 2
+    padded = np.pad(gray, half + 1, mode='edge')
+    # uint32 con desbordamiento modular: las diferencias de la integral siguen siendo exactas
+    integral = padded.cumsum(axis=0, dtype=np.uint32).cumsum(axis=1, dtype=np.uint32)
+    h, w = gray.shape
+    sums = (integral[window:window + h, window:window + w] - integral[:h, window:window + w]
+            - integral[window:window + h, :w] + integral[:h, :w])
+    ink = gray.astype(np.float32) * (window * window) < sums.astype(np.float32) * (1.0 - threshold)
+    return np.where(ink, 0, 255).astype(np.uint8)
+
+
+def crop_margins(pixels: np.ndarray, padding: int = 10, ink_level: int = 128,
+                 min_ink_ratio: float = 0.002) -> np.ndarray:
+    """Recorta los márgenes sin tinta; ignora filas/columnas con ruido aislado"""
+    ink = to_grayscale(pixels) < ink_level
+    rows = np.flatnonzero(ink.mean(axis=1) > min_ink_ratio)
+    cols = np.flatnonzero(ink.mean(axis=0) > min_ink_ratio)
+    if rows.size == 0 or cols.size == 0:
+        return pixels
+    top = max(0, rows[0] - padding)
+    bottom = min(pixels.shape[0], rows[-1] + padding + 1)
+    left = max(0, cols[0] - padding)
+    right = min(pixels.shape[1], cols[-1] + padding + 1)
+    return pixels[top:bottom, left:right]
+
+
+def estimate_skew(pixels: np.ndarray, max_angle: float = 5.0, step: float = 0.25,
+                  ink_level: int = 128, max_points: int = 100000) -> float:
+    """
+    Ángulo de inclinación (grados) que maximiza la nitidez del perfil de proyección horizontal
+    Las líneas de texto alineadas producen un histograma de filas con picos marcados
+    """
+    ys, xs = np.nonzero(to_grayscale(pixels) < ink_level)
+    if ys.size < 100:
+        return 0.0
+    if ys.size > max_points:
+        idx = np.random.default_rng(0).choice(ys.size, max_points, replace=False)
+        ys, xs = ys[idx], xs[idx]
+    angles = np.arange(-max_angle, max_angle + step / 2, step)
+    scores = np.empty(len(angles))
+    for i, tangent in enumerate(np.tan(np.radians(angles))):
+        # Filas proyectadas de todos los puntos para este ángulo
+        rows = np.rint(ys + xs * tangent).astype(np.int64)
+        histogram = np.bincount(rows - rows.min()).astype(np.float64)
+        scores[i] = (np.diff(histogram) ** 2).sum()
+    return float(angles[int(np.argmax(scores))])
+
+
+def deskew(pixels: np.ndarray, max_angle: float = 5.0) -> Tuple[np.ndarray, float]:
+    """Corrige la inclinación estimada; devuelve (imagen, ángulo corregido)"""
+    angle = estimate_skew(pixels, max_angle=max_angle)
+    if abs(angle) < 0.25:
+        return pixels, 0.0
+    fill = 255 if pixels.ndim == 2 else (255,) * pixels.shape[2]
+    rotated = Image.fromarray(pixels).rotate(-angle, resample=Image.BILINEAR, expand=True, fillcolor=fill)
+    return np.asarray(rotated), angle
+
+
+def preprocess(image: Image.Image, steps: List[str], target_dpi: int = OCR_TARGET_DPI) -> Tuple[np.ndarray, Dict]:
+    """
+    Aplica las etapas indicadas y devuelve (arreglo listo para OCR, informe)
+    El informe incluye el tiempo por etapa en milisegundos y el tamaño final
+    """
+    report = {"etapas_ms": {}}
+    dpi = estimate_dpi(image)
+    pixels = np.asarray(image)
+    for step in steps:
+        start = time.perf_counter()
+        if step == 'grayscale':
+            pixels = to_grayscale(pixels)
+        elif step == 'downscale':
+            pixels, dpi = downscale(pixels, dpi, target_dpi)
+        elif step == 'binarize':
+            pixels = binarize(pixels)
+        elif step == 'crop':
+            pixels = crop_margins(pixels)
+        elif step == 'deskew':
+            pixels, report["angulo_corregido"] = deskew(pixels)
+        report["etapas_ms"][step] = round((time.perf_counter() - start) * 1000, 2)
+    report["tamano_final"] = [int(pixels.shape[1]), int(pixels.shape[0])]
+    report["dpi_efectivo"] = round(dpi)
+    return pixels, report
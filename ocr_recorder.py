@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Grabación muestreada del tráfico de /ocr, /ocr/batch y /ocr/archive
+Con OCR_RECORD_ENABLED=1, una fracción OCR_RECORD_SAMPLE_RATE de las peticiones
+se escribe como una línea JSON en OCR_RECORD_LOG: endpoint, parámetros,
+cabeceras relevantes, código, duración y, por documento, hash SHA-256 del
+contenido, tamaño, tipo, resultado y duración. Con OCR_RECORD_PAYLOADS=1 también
+se guardan los documentos (direccionados por su hash) y los valores extraídos;
+sin ellos solo queda un hash de los valores. replay_traffic.py reproduce el log
+contra una instancia y compara latencias y resultados.
+"""
+
+import os
+import json
+import random
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+from ocr_fields import FIELD_RULES
+from ocr_metrics import file_type
+from ocr_trace import TraceLog
+
+logger = logging.getLogger(__name__)
+
+OCR_RECORD_ENABLED = os.environ.get('OCR_RECORD_ENABLED', '0').lower() not in ('0', 'false', 'no')
+OCR_RECORD_SAMPLE_RATE = float(os.environ.get('OCR_RECORD_SAMPLE_RATE', 1.0))
+# No es el requests.jsonl de la raíz del repositorio: el log vive junto a los demás logs
+OCR_RECORD_LOG = os.environ.get('OCR_RECORD_LOG', 'logs/requests.jsonl')
+OCR_RECORD_MAX_BYTES = int(os.environ.get('OCR_RECORD_MAX_BYTES', 100 * 1024 * 1024))
+OCR_RECORD_PAYLOADS = os.environ.get('OCR_RECORD_PAYLOADS', '0').lower() not in ('0', 'false', 'no')
+OCR_RECORD_PAYLOAD_DIR = os.environ.get('OCR_RECORD_PAYLOAD_DIR', 'logs/payloads')
+
+# Campos de la respuesta que se comparan al reproducir
+RESULT_FIELDS = tuple(rule.name for rule in FIELD_RULES)
+# Cabeceras que cambian el procesamiento y se reenvían al reproducir
+RECORDED_HEADERS = ('X-OCR-Deadline-Seconds', 'Accept')
+# Prefijo del X-Request-ID de las peticiones reproducidas, que no se vuelven a grabar
+REPLAY_REQUEST_PREFIX = 'replay-'
+
+
+def result_values(result: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Valores extraídos de una respuesta (None si el documento falló)"""
+    if not result or result.get("status") == "error":
+        return None
+    return {name: result.get(name) for name in RESULT_FIELDS}
+
+
+def values_digest(values: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Hash estable de los valores extraídos, para comparar sin guardarlos"""
+    if values is None:
+        return None
+    return hashlib.sha256(json.dumps(values, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def payload_path(directory: str, digest: str) -> str:
+    return os.path.join(directory, digest[:2], digest)
+
+
+class Recording:
+    """Petición muestreada; sus documentos se agregan al terminar cada uno"""
+
+    def __init__(self, recorder: 'TrafficRecorder', request_id: str, endpoint: str, headers: Mapping[str, str]):
+        self.recorder = recorder
+        self.started_at = time.time()
+        self.record = {
+            "request_id": request_id,
+            "endpoint": endpoint,
+            "params": {},
+            "headers": {name: headers[name] for name in RECORDED_HEADERS if headers.get(name)},
+        }
+        self.documents: List[Dict[str, Any]] = []  # list.append es seguro entre los hilos de un lote
+
+    def set_params(self, values: Mapping[str, str]):
+        """Parámetros de la petición (query string y campos del formulario)"""
+        self.record["params"] = {key: values[key] for key in values}
+
+    def add_document(self, data: bytes, filename: str, outcome: str, seconds: float,
+                     result: Optional[Dict[str, Any]]):
+        digest = hashlib.sha256(data).hexdigest()
+        values = result_values(result)
+        document = {
+            "archivo": filename,
+            "sha256": digest,
+            "bytes": len(data),
+            "file_type": file_type(filename),
+            "outcome": outcome,
+            "total_ms": round(seconds * 1000, 2),
+            "resultado_sha": values_digest(values),
+        }
+        if self.recorder.payload_dir:
+            document["payload"] = self.recorder.save_payload(data, digest)
+            document["resultado"] = values
+        self.documents.append(document)
+
+    def finish(self, status: int, seconds: float):
+        self.recorder.write({**self.record, "ts": round(self.started_at, 3), "status": status,
+                             "total_ms": round(seconds * 1000, 2), "documentos": self.documents})
+
+
+class TrafficRecorder:
+    """Decide qué peticiones se graban y escribe el log y los documentos"""
+
+    def __init__(self, path: str = OCR_RECORD_LOG, sample_rate: float = OCR_RECORD_SAMPLE_RATE,
+                 payload_dir: Optional[str] = OCR_RECORD_PAYLOAD_DIR if OCR_RECORD_PAYLOADS else None,
+                 max_bytes: int = OCR_RECORD_MAX_BYTES):
+        self.sample_rate = sample_rate
+        self.payload_dir = payload_dir
+        self.log = TraceLog(path, max_bytes)
+        self._lock = threading.Lock()
+        self._counters = {"recorded": 0, "payloads_saved": 0, "payload_errors": 0}
+
+    def start(self, request_id: str, endpoint: str, headers: Mapping[str, str]) -> Optional[Recording]:
+        """Grabación de la petición, o None si no salió en la muestra o es una reproducción"""
+        if request_id.startswith(REPLAY_REQUEST_PREFIX) or random.random() >= self.sample_rate:
+            return None
+        return Recording(self, request_id, endpoint, headers)
+
+    def save_payload(self, data: bytes, digest: str) -> bool:
+        """Guarda el documento una sola vez por contenido (escritura atómica)"""
+        path = payload_path(self.payload_dir, digest)
+        if os.path.exists(path):
+            return True
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el documento grabado {digest[:12]}: {e}")
+            with self._lock:
+                self._counters["payload_errors"] += 1
+            return False
+        with self._lock:
+            self._counters["payloads_saved"] += 1
+        return True
+
+    def write(self, record: Dict[str, Any]):
+        self.log.write(record)
+        with self._lock:
+            self._counters["recorded"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"path": self.log.path, "sample_rate": self.sample_rate,
+                    "payloads": self.payload_dir is not None, **self._counters}
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder() -> Optional[TrafficRecorder]:
+    """Devuelve el grabador de tráfico del proceso (None si está desactivado)"""
+    global _recorder
+    if not OCR_RECORD_ENABLED:
+        return None
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = TrafficRecorder()
+    return _recorder
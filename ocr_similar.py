@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Detección de documentos casi duplicados por hash perceptual
+Un reescaneo, una foto distinta o un PDF re-exportado de una factura ya
+procesada no coinciden byte a byte con el original y no aciertan en la caché.
+El documento se procesa igual (dos facturas de la misma plantilla también se
+parecen) y la respuesta se marca como posible duplicado del original. Es una
+marca para revisar fraudes, no un ahorro: el hash suma trabajo a cada documento
+nuevo, así que se activa con OCR_SIMILAR_ENABLED=1.
+Cada documento procesado se resume en un pHash de 64 bits (DCT de una miniatura
+normalizada, calculado con NumPy) y un dHash de 256 bits que confirma el
+parecido. El índice busca por distancia de Hamming con multi-index hashing: el
+hash se parte en 4 bloques de 16 bits y, por el principio del palomar, un hash a
+distancia <= r comparte algún bloque a distancia <= r // 4; cada bloque tiene su
+tabla ordenada, así que una búsqueda revisa unos pocos candidatos aunque haya
+millones de hashes. El índice se guarda en un archivo de registros fijos que
+comparten todos los procesos del servicio.
+"""
+
+import io
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from ocr_cache import OCR_CACHE_DIR, OCR_CACHE_ENABLED
+from ocr_deadline import Deadline, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# Desactivado por defecto: solo marca respuestas y cuesta 20-70 ms por imagen más un rasterizado por PDF
+OCR_SIMILAR_ENABLED = os.environ.get('OCR_SIMILAR_ENABLED', '0').lower() not in ('0', 'false', 'no')
+# Distancia de Hamming máxima del pHash (64 bits) para considerar un candidato
+OCR_SIMILAR_MAX_DISTANCE = int(os.environ.get('OCR_SIMILAR_MAX_DISTANCE', 6))
+# Distancia máxima del dHash (256 bits) que confirma el candidato: dos facturas
+# distintas de la misma plantilla se parecen mucho en una miniatura de 32x32
+OCR_SIMILAR_MAX_FINE_DISTANCE = int(os.environ.get('OCR_SIMILAR_MAX_FINE_DISTANCE', 24))
+OCR_SIMILAR_INDEX_PATH = os.environ.get('OCR_SIMILAR_INDEX_PATH',
+                                        os.path.join(OCR_CACHE_DIR, 'similar-v1.bin') if OCR_CACHE_DIR else '')
+# Resolución con la que se rasteriza la primera página de un PDF para el hash
+OCR_SIMILAR_PDF_DPI = int(os.environ.get('OCR_SIMILAR_PDF_DPI', 40))
+
+# Registro del índice en disco: pHash, dHash fino, opciones de la petición y clave de caché del resultado
+RECORD_DTYPE = np.dtype([('phash', '<u8'), ('fine', '<u8', (4,)), ('options', '<u8'), ('key', 'V32')])
+
+_CHUNKS = 4
+_CHUNK_BITS = 64 // _CHUNKS
+# Entradas sin indexar que se revisan por fuerza bruta antes de reordenar las tablas
+_TAIL_LIMIT = 8192
+_MAX_PDF_SECONDS = 5.0
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Matriz de la DCT-II ortonormal de tamaño n"""
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def _pack_bits(bits: np.ndarray) -> np.ndarray:
+    """Bits (múltiplo de 64) a enteros uint64 big-endian"""
+    return np.packbits(bits.astype(np.uint8).ravel()).view('>u8').astype(np.uint64)
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """Bits en 1 de cada uint64 (a lo largo del último eje si hay varios por hash)"""
+    if hasattr(np, 'bitwise_count'):
+        counts = np.bitwise_count(values)
+    else:  # NumPy < 2.0
+        counts = np.unpackbits(values.view(np.uint8), axis=-1).reshape(values.shape + (64,)).sum(axis=-1)
+    return counts.astype(np.int32)
+
+
+def _normalize(image: Image.Image) -> np.ndarray:
+    """
+    Miniatura en escala de grises con orientación EXIF aplicada, contraste
+    estirado y recortada al contenido, para que márgenes, exposición y
+    resolución del escaneo no cambien el hash
+    """
+    image = ImageOps.exif_transpose(image)
+    # En JPEG draft decodifica directamente a 1/2, 1/4 u 1/8 de resolución
+    image.draft('L', (512, 512))
+    gray = image.convert('L')
+    gray.thumbnail((512, 512))
+    pixels = np.asarray(ImageOps.autocontrast(gray, cutoff=1), dtype=np.float32)
+    dark = pixels < 128
+    rows, cols = np.flatnonzero(dark.any(axis=1)), np.flatnonzero(dark.any(axis=0))
+    if rows.size and cols.size and (rows[-1] - rows[0]) > 16 and (cols[-1] - cols[0]) > 16:
+        pixels = pixels[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    return pixels
+
+
+def _resize(pixels: np.ndarray, width: int, height: int) -> np.ndarray:
+    return np.asarray(Image.fromarray(pixels).resize((width, height), Image.BILINEAR), dtype=np.float32)
+
+
+def image_hashes(image: Image.Image) -> Tuple[int, Tuple[int, int, int, int]]:
+    """(pHash de 64 bits, dHash de 256 bits en 4 enteros) de una imagen"""
+    pixels = _normalize(image)
+    # pHash: coeficientes 8x8 de baja frecuencia de la DCT, comparados con su mediana (sin la componente continua)
+    coefficients = (_DCT32 @ _resize(pixels, 32, 32) @ _DCT32.T)[:8, :8].ravel()
+    phash = _pack_bits(coefficients > np.median(coefficients[1:]))[0]
+    # dHash: gradiente horizontal de una miniatura de 17x16
+    fine = _resize(pixels, 17, 16)
+    dhash = _pack_bits(fine[:, 1:] > fine[:, :-1])
+    return int(phash), tuple(int(v) for v in dhash)
+
+
+def document_hashes(data: bytes, filename: str,
+                    deadline: Optional[Deadline] = None) -> Optional[Tuple[int, Tuple[int, int, int, int]]]:
+    """
+    Hashes de la primera página de un documento, o None si no se pueden calcular
+    Los PDF se rasterizan a OCR_SIMILAR_PDF_DPI con un límite de tiempo corto
+    """
+    try:
+        if filename.lower().endswith('.pdf'):
+            from pdf2image import convert_from_bytes
+            timeout = _MAX_PDF_SECONDS
+            if deadline is not None and deadline.timeout() is not None:
+                timeout = min(timeout, deadline.timeout())
+            pages = convert_from_bytes(data, dpi=OCR_SIMILAR_PDF_DPI, first_page=1, last_page=1,
+                                       grayscale=True, timeout=max(0.1, timeout))
+            if not pages:
+                return None
+            image = pages[0]
+        else:
+            image = Image.open(io.BytesIO(data))
+        return image_hashes(image)
+    except Exception as e:
+        logger.debug(f"Sin hash perceptual para {filename}: {str(e)}")
+        return None
+
+
+def process_with_hashes(process: Callable[..., Dict[str, Any]], data: bytes, filename: str,
+                        options: Optional[Dict[str, Any]] = None, deadline: Optional[Deadline] = None):
+    """
+    Trabajo del proceso OCR: procesa el documento y después calcula sus hashes,
+    fuera del hilo de la petición. Devuelve (resultado, hashes o None); sin
+    plazo para el hash el resultado se entrega igual
+    """
+    result = process(data, filename, options, deadline)
+    try:
+        if deadline is not None:
+            deadline.enter('similitud')
+    except DeadlineExceeded:
+        return result, None
+    return result, document_hashes(data, filename, deadline)
+
+
+def options_digest(options: Optional[Dict[str, Any]]) -> int:
+    """Resumen de las opciones: solo se comparan documentos pedidos con la misma configuración"""
+    encoded = json.dumps(options or {}, sort_keys=True, default=str).encode('utf-8')
+    return int.from_bytes(hashlib.sha256(encoded).digest()[:8], 'big')
+
+
+class SimilarityIndex:
+    """
+    Índice de hashes perceptuales con búsqueda por distancia de Hamming
+    Los registros viven en arreglos NumPy; cada bloque de 16 bits del pHash tiene
+    una tabla ordenada (valores + posiciones) que se consulta con searchsorted.
+    Los registros nuevos quedan en una cola que se revisa completa hasta que se
+    reordenan las tablas. Con `path` los registros se agregan a un archivo con
+    O_APPEND y cada proceso lee antes de buscar los que agregaron los demás.
+    """
+
+    def __init__(self, path: Optional[str] = OCR_SIMILAR_INDEX_PATH,
+                 max_distance: int = OCR_SIMILAR_MAX_DISTANCE,
+                 max_fine_distance: int = OCR_SIMILAR_MAX_FINE_DISTANCE):
+        self.path = path or None
+        self.max_distance = max_distance
+        self.max_fine_distance = max_fine_distance
+        self._lock = threading.Lock()
+        self._records = np.zeros(1024, dtype=RECORD_DTYPE)
+        self._size = 0
+        self._indexed = 0
+        self._tables = [(np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=np.int64)) for _ in range(_CHUNKS)]
+        self._offset = 0
+        self._counters = {"lookups": 0, "hits": 0, "rejected_fine": 0, "added": 0}
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with self._lock:
+                self._refresh()
+
+    @staticmethod
+    def _chunks(phash: np.ndarray, chunk: int) -> np.ndarray:
+        shift = np.uint64(_CHUNK_BITS * (_CHUNKS - 1 - chunk))
+        return ((phash >> shift) & np.uint64(0xFFFF)).astype(np.uint16)
+
+    def _append(self, records: np.ndarray):
+        """Agrega registros a los arreglos en memoria (con el lock tomado)"""
+        needed = self._size + len(records)
+        if needed > len(self._records):
+            grown = np.zeros(max(needed, 2 * len(self._records)), dtype=RECORD_DTYPE)
+            grown[:self._size] = self._records[:self._size]
+            self._records = grown
+        self._records[self._size:needed] = records
+        self._size = needed
+        if self._size - self._indexed > _TAIL_LIMIT:
+            self._reindex()
+
+    def _reindex(self):
+        """Reordena las tablas de bloques con todos los registros (con el lock tomado)"""
+        phashes = self._records['phash'][:self._size]
+        tables = []
+        for chunk in range(_CHUNKS):
+            values = self._chunks(phashes, chunk)
+            order = np.argsort(values, kind='stable')
+            tables.append((values[order], order))
+        self._tables = tables
+        self._indexed = self._size
+
+    def _refresh(self):
+        """Lee los registros que otros procesos agregaron al archivo (con el lock tomado)"""
+        if not self.path:
+            return
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        # Un registro a medio escribir se lee en la próxima vuelta
+        end = size - (size - self._offset) % RECORD_DTYPE.itemsize
+        if end <= self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            records = np.frombuffer(f.read(end - self._offset), dtype=RECORD_DTYPE)
+        self._offset = end
+        self._append(records)
+
+    def _candidates(self, phash: int) -> np.ndarray:
+        """Posiciones cuyo pHash comparte algún bloque a distancia <= max_distance // 4 (con el lock tomado)"""
+        radius = self.max_distance // _CHUNKS
+        masks = [0] + [1 << bit for bit in range(_CHUNK_BITS)] if radius >= 1 else [0]
+        if radius >= 2:
+            masks += [(1 << a) | (1 << b) for a in range(_CHUNK_BITS) for b in range(a)]
+        masks = np.array(masks, dtype=np.uint16)
+        query = np.array([phash], dtype=np.uint64)
+        found = [np.arange(self._indexed, self._size)]
+        for chunk, (values, order) in enumerate(self._tables):
+            probes = np.unique(self._chunks(query, chunk)[0] ^ masks)
+            starts = np.searchsorted(values, probes, side='left')
+            stops = np.searchsorted(values, probes, side='right')
+            found.extend(order[start:stop] for start, stop in zip(starts, stops) if stop > start)
+        return np.unique(np.concatenate(found))
+
+    def search(self, hashes: Tuple[int, Tuple[int, ...]], options: int) -> Optional[Tuple[str, int]]:
+        """Clave de caché y distancia del documento más parecido con las mismas opciones, o None"""
+        phash, fine = hashes
+        with self._lock:
+            self._refresh()
+            self._counters["lookups"] += 1
+            candidates = self._candidates(phash)
+            if not candidates.size:
+                return None
+            records = self._records[candidates]
+            records = records[records['options'] == np.uint64(options)]
+            distances = popcount(records['phash'] ^ np.uint64(phash))
+            records, distances = records[distances <= self.max_distance], distances[distances <= self.max_distance]
+            if not records.size:
+                return None
+            fine_distances = popcount(records['fine'] ^ np.array(fine, dtype=np.uint64)).sum(axis=1)
+            confirmed = fine_distances <= self.max_fine_distance
+            if not confirmed.any():
+                self._counters["rejected_fine"] += 1
+                return None
+            best = np.flatnonzero(confirmed)[np.argmin(distances[confirmed])]
+            self._counters["hits"] += 1
+            return bytes(records['key'][best]).hex(), int(distances[best])
+
+    def add(self, hashes: Tuple[int, Tuple[int, ...]], options: int, key: str):
+        """Registra un documento procesado y la clave de caché de su resultado"""
+        phash, fine = hashes
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record['phash'], record['fine'], record['options'] = phash, fine, options
+        record['key'] = np.void(bytes.fromhex(key))
+        with self._lock:
+            self._counters["added"] += 1
+            if not self.path:
+                self._append(record)
+                return
+            try:
+                # Un write de un registro con O_APPEND no se intercala con el de otro proceso
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, record.tobytes())
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logger.warning(f"No se pudo escribir el índice de similitud: {str(e)}")
+                return
+            self._refresh()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": self._size,
+                "unindexed": self._size - self._indexed,
+                "max_distance": self.max_distance,
+                **self._counters,
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index() -> Optional[SimilarityIndex]:
+    """
+    Devuelve el índice de casi duplicados del proceso (None si está desactivado)
+    Requiere la caché de resultados: el índice solo guarda la clave del resultado
+    """
+    global _index
+    if not (OCR_SIMILAR_ENABLED and OCR_CACHE_ENABLED):
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SimilarityIndex()
+    return _index
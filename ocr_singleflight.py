@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Coalescencia de peticiones OCR idénticas en curso (single-flight)
+Si llega un documento con la misma clave de caché (contenido + configuración)
+que otro que todavía se está procesando, la segunda petición espera el
+resultado de la primera en lugar de repetir el OCR. Cubre los reintentos de
+Camunda y los dobles clics, que llegan antes de que el resultado esté en caché.
+"""
+
+import copy
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from ocr_deadline import Deadline, DeadlineExceeded
+from ocr_executor import ExecutorBusyError
+
+logger = logging.getLogger(__name__)
+
+# Errores propios de la petición que hizo el cálculo (su plazo, la admisión):
+# quien esperaba no los hereda y vuelve a intentarlo por su cuenta
+_PER_REQUEST_ERRORS = (DeadlineExceeded, ExecutorBusyError)
+
+
+class _Call:
+    """Cálculo en curso de una clave y su desenlace"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Un solo cálculo en curso por clave; las peticiones repetidas esperan su resultado"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # clave -> _Call
+        self._counters = {"leaders": 0, "coalesced": 0, "retried": 0}
+
+    def do(self, key: str, fn: Callable[[], Dict[str, Any]],
+           deadline: Optional[Deadline] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Ejecuta fn() o se suma al cálculo en curso de la misma clave
+        Devuelve (resultado, compartido); cada petición que compartió el cálculo,
+        también la que lo hizo, recibe una copia propia
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self._counters["leaders"] += 1
+                else:
+                    call.waiters += 1
+                    self._counters["coalesced"] += 1
+            if leader:
+                try:
+                    call.result = fn()
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                        shared = call.waiters > 0
+                    call.done.set()
+                # Quienes esperaban copian el resultado publicado: nadie debe modificarlo,
+                # así que con esperas también el líder recibe su propia copia
+                return (copy.deepcopy(call.result) if shared else call.result), False
+
+            timeout = deadline.timeout() if deadline is not None else None
+            if not call.done.wait(timeout):
+                raise DeadlineExceeded(deadline.stage, deadline.budget)
+            if call.error is None:
+                return copy.deepcopy(call.result), True
+            if not isinstance(call.error, _PER_REQUEST_ERRORS):
+                raise call.error
+            with self._lock:
+                self._counters["retried"] += 1
+            logger.info(f"El cálculo compartido falló por su propio plazo o admisión, reintentando ({key[:12]})")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "waiting": sum(call.waiters for call in self._calls.values()),
+                **self._counters,
+            }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Devuelve el coalescedor de peticiones del proceso, creándolo la primera vez"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Plantillas de disposición por proveedor (RUC) para OCR solo de regiones
+La mayoría de las facturas llega de unos cientos de proveedores recurrentes con
+un formato fijo. Cada OCR de página completa enseña a la plantilla del RUC dónde
+están proveedor, monto, fecha y número de factura (cajas relativas a la página).
+Cuando la plantilla tiene suficientes muestras coincidentes, las facturas
+siguientes se reconocen con un OCR de la zona donde las plantillas listas tienen
+el RUC y, si ese RUC tiene plantilla, un OCR en paralelo de solo sus regiones.
+Si el RUC no tiene plantilla o algún valor no valida, se reconoce la página
+completa por el camino normal. Las plantillas se guardan como JSON en
+OCR_TEMPLATE_DIR y las comparten todos los procesos; las muestras se acumulan
+en memoria y se escriben por lotes bajo un lock de archivo, a más tardar
+OCR_TEMPLATE_FLUSH_SECONDS después de aprenderlas.
+"""
+
+import os
+import re
+import json
+import atexit
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ocr_engine import get_engine_pool
+from ocr_fields import FIELD_RULES, extract_fields
+from ocr_layout import SPATIAL_RULES, SpatialIndex, build_text
+from ocr_deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+OCR_TEMPLATES_ENABLED = os.environ.get('OCR_TEMPLATES_ENABLED', '1').lower() not in ('0', 'false', 'no')
+OCR_TEMPLATE_DIR = os.environ.get('OCR_TEMPLATE_DIR', os.path.join('cache', 'templates'))
+# Facturas con las cajas de todos los campos coincidentes antes de usar la plantilla
+OCR_TEMPLATE_MIN_SAMPLES = int(os.environ.get('OCR_TEMPLATE_MIN_SAMPLES', 3))
+# Desplazamiento tolerado de una caja entre facturas, relativo al tamaño de la página
+OCR_TEMPLATE_TOLERANCE = float(os.environ.get('OCR_TEMPLATE_TOLERANCE', 0.03))
+# Alto del encabezado donde debe estar el RUC para aprender la plantilla (fracción de la página)
+OCR_TEMPLATE_HEADER_FRACTION = float(os.environ.get('OCR_TEMPLATE_HEADER_FRACTION', 0.25))
+# Regiones reconocidas a la vez (cada una usa un motor del pool del proceso)
+OCR_TEMPLATE_REGION_THREADS = int(os.environ.get('OCR_TEMPLATE_REGION_THREADS', 2))
+# Fallos de validación seguidos tras los que la plantilla vuelve a aprenderse
+OCR_TEMPLATE_MAX_FAILURES = int(os.environ.get('OCR_TEMPLATE_MAX_FAILURES', 3))
+# Muestras acumuladas o segundos desde la primera pendiente antes de escribirlas
+OCR_TEMPLATE_FLUSH_SAMPLES = int(os.environ.get('OCR_TEMPLATE_FLUSH_SAMPLES', 8))
+OCR_TEMPLATE_FLUSH_SECONDS = float(os.environ.get('OCR_TEMPLATE_FLUSH_SECONDS', 10))
+
+# Campos que se reconocen por región; el RUC sale del encabezado
+TEMPLATE_FIELDS = ('proveedor', 'monto', 'fecha', 'numero_factura')
+# Margen alrededor de la caja aprendida: fijo más la mitad de su tamaño (valores de largo variable)
+_PADDING = 0.01
+# Lock de archivo que serializa la lectura-modificación-escritura entre procesos
+_LOCK_FILE = 'plantillas.lock'
+_RUC = re.compile(r'\d{13}')
+
+_CONVERTERS = {rule.name: rule.convert for rule in FIELD_RULES}
+_VALUE_PATTERNS = {rule.name: re.compile(rule.value) for rule in SPATIAL_RULES if rule.value}
+
+
+def steps_tag(steps: List[str]) -> str:
+    """Identificador corto del preprocesamiento: las cajas solo valen con las mismas etapas"""
+    return hashlib.sha1(",".join(steps).encode('utf-8')).hexdigest()[:8]
+
+
+def is_ready(template: Dict[str, Any]) -> bool:
+    """Todos los campos tienen suficientes muestras coincidentes"""
+    fields = template.get("campos", {})
+    return all(fields.get(name, {}).get("muestras", 0) >= OCR_TEMPLATE_MIN_SAMPLES
+               for name in TEMPLATE_FIELDS + ('ruc',))
+
+
+def _consistent(learned: List[float], box: List[float]) -> bool:
+    """Misma franja vertical y mismo borde izquierdo o derecho (valores alineados a un lado)"""
+    return abs(learned[1] - box[1]) <= OCR_TEMPLATE_TOLERANCE and \
+        abs(learned[3] - box[3]) <= OCR_TEMPLATE_TOLERANCE and \
+        (abs(learned[0] - box[0]) <= OCR_TEMPLATE_TOLERANCE or abs(learned[2] - box[2]) <= OCR_TEMPLATE_TOLERANCE)
+
+
+class TemplateStore:
+    """
+    Plantillas por RUC y preprocesamiento, un archivo JSON cada una
+    Cada proceso las mantiene en memoria y relee solo los archivos que cambiaron
+    (la escritura atómica con os.replace cambia la fecha del directorio). Las
+    muestras nuevas se acumulan y se mezclan por lotes con la versión en disco
+    bajo un lock de archivo, así que las de otros procesos no se pierden
+    """
+
+    def __init__(self, directory: str = OCR_TEMPLATE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._templates = {}  # nombre de archivo -> (mtime, plantilla)
+        self._dir_mtime = None
+        self._pending = {}  # ruta -> [cajas de una muestra]
+        self._pending_count = 0
+        self._timer = None
+
+    def _path(self, ruc: str, steps: List[str]) -> str:
+        return os.path.join(self.directory, f"{ruc}-{steps_tag(steps)}.json")
+
+    def _refresh(self):
+        """Relee los archivos nuevos o modificados (con el lock tomado)"""
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            self._templates, self._dir_mtime = {}, None
+            return
+        if mtime == self._dir_mtime:
+            return
+        self._dir_mtime = mtime
+        current = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    entry_mtime = entry.stat().st_mtime_ns
+                    cached = self._templates.get(entry.name)
+                    if cached is not None and cached[0] == entry_mtime:
+                        current[entry.name] = cached
+                        continue
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        current[entry.name] = (entry_mtime, json.load(f))
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Plantilla ilegible {entry.path}: {str(e)}")
+        self._templates = current
+
+    def ruc_region(self, steps: List[str]) -> Optional[List[float]]:
+        """
+        Caja que cubre el RUC de todas las plantillas listas para este
+        preprocesamiento, o None si no hay ninguna (entonces no se intenta)
+        """
+        tag = steps_tag(steps)
+        with self._lock:
+            self._refresh()
+            boxes = [template["campos"]["ruc"]["bbox_relativo"] for name, (_, template) in self._templates.items()
+                     if name.endswith(f"-{tag}.json") and is_ready(template)]
+        if not boxes:
+            return None
+        return [min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes)]
+
+    def get(self, ruc: str, steps: List[str]) -> Optional[Dict[str, Any]]:
+        """Plantilla lista del RUC, o None"""
+        with self._lock:
+            self._refresh()
+            cached = self._templates.get(os.path.basename(self._path(ruc, steps)))
+        template = cached[1] if cached else None
+        return template if template is not None and is_ready(template) else None
+
+    def _load(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Plantilla ilegible {path}: {str(e)}")
+            return None
+
+    def _save(self, path: str, template: Dict[str, Any]):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Escritura atómica: otro proceso nunca ve un JSON a medias
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(template, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la plantilla {path}: {str(e)}")
+
+    def _locked(self):
+        """Lock exclusivo entre procesos (no hace nada donde no hay fcntl)"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(os.path.join(self.directory, _LOCK_FILE), 'w')
+        try:
+            import fcntl
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        return lock
+
+    def learn(self, fields: Dict[str, Dict[str, Any]], steps: List[str]):
+        """
+        Acumula las cajas de un OCR de página completa para la plantilla de su RUC
+        Se escriben con flush() al juntar OCR_TEMPLATE_FLUSH_SAMPLES muestras o, desde
+        un temporizador, OCR_TEMPLATE_FLUSH_SECONDS después de la primera pendiente.
+        Solo se aprende si el RUC cae en el encabezado
+        """
+        ruc = fields.get("ruc", {})
+        if ruc.get("fuente") == 'defecto' or not _RUC.fullmatch(str(ruc.get("valor"))) or \
+                not ruc.get("bbox_relativo") or ruc["bbox_relativo"][3] > OCR_TEMPLATE_HEADER_FRACTION:
+            return
+        boxes = {name: fields[name]["bbox_relativo"] for name in TEMPLATE_FIELDS + ('ruc',)
+                 if fields.get(name, {}).get("fuente") != 'defecto' and fields.get(name, {}).get("bbox_relativo")
+                 and fields[name].get("pagina") == 1}
+        with self._lock:
+            self._pending.setdefault(self._path(ruc["valor"], steps), []).append((ruc["valor"], list(steps), boxes))
+            self._pending_count += 1
+            due = self._pending_count >= OCR_TEMPLATE_FLUSH_SAMPLES
+            # El temporizador no sobrevive a un fork: uno heredado figura como terminado
+            if not due and (self._timer is None or not self._timer.is_alive()):
+                self._timer = threading.Timer(OCR_TEMPLATE_FLUSH_SECONDS, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Mezcla las muestras pendientes con la versión en disco de cada plantilla
+        Una caja que coincide amplía la aprendida y cuenta una muestra; una que se
+        movió reinicia ese campo
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_count = 0
+            timer, self._timer = self._timer, None
+        if timer is not None and timer is not threading.current_thread():
+            timer.cancel()
+        if not pending:
+            return
+        try:
+            with self._locked():
+                for path, samples in pending.items():
+                    ruc, steps, _ = samples[0]
+                    template = self._load(path) or {"ruc": ruc, "etapas": steps, "campos": {}}
+                    for _, _, boxes in samples:
+                        self._apply(template, boxes)
+                    template["actualizada"] = datetime.now().isoformat()
+                    self._save(path, template)
+        except OSError as e:
+            logger.warning(f"No se pudieron guardar las plantillas: {str(e)}")
+
+    @staticmethod
+    def _apply(template: Dict[str, Any], boxes: Dict[str, List[float]]):
+        """Suma una muestra a la plantilla"""
+        moved = False
+        for name, box in boxes.items():
+            learned = template["campos"].get(name)
+            if learned and _consistent(learned["bbox_relativo"], box):
+                learned["bbox_relativo"] = [min(learned["bbox_relativo"][0], box[0]), min(learned["bbox_relativo"][1], box[1]),
+                                            max(learned["bbox_relativo"][2], box[2]), max(learned["bbox_relativo"][3], box[3])]
+                learned["muestras"] += 1
+            else:
+                template["campos"][name] = {"bbox_relativo": box, "muestras": 1}
+                moved = True
+        # Si la disposición cambió, los fallos anteriores ya no cuentan; si no, siguen sumando
+        if moved:
+            template["fallos_seguidos"] = 0
+
+    def record_failure(self, ruc: str, steps: List[str]):
+        """Un fallo de validación más; tras OCR_TEMPLATE_MAX_FAILURES seguidos la plantilla se reaprende"""
+        path = self._path(ruc, steps)
+        try:
+            with self._locked():
+                template = self._load(path)
+                if template is None:
+                    return
+                template["fallos_seguidos"] = template.get("fallos_seguidos", 0) + 1
+                if template["fallos_seguidos"] >= OCR_TEMPLATE_MAX_FAILURES:
+                    logger.warning(f"Plantilla de {ruc} descartada tras {template['fallos_seguidos']} fallos seguidos")
+                    template["campos"] = {}
+                    template["fallos_seguidos"] = 0
+                self._save(path, template)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la plantilla {path}: {str(e)}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            templates = [template for _, template in self._templates.values()]
+        return {"templates": len(templates), "ready": sum(1 for t in templates if is_ready(t))}
+
+
+def _recognize(pixels: np.ndarray, left: int, top: int, line_base: int,
+               deadline: Deadline) -> List[Dict[str, Any]]:
+    """Palabras de un recorte con coordenadas y números de línea de la página"""
+    words = get_engine_pool().recognize(np.ascontiguousarray(pixels), ocr_timeout=deadline.timeout())
+    for word in words:
+        word.update(left=word["left"] + left, right=word["right"] + left, top=word["top"] + top,
+                    bottom=word["bottom"] + top, line=word["line"] + line_base)
+    return words
+
+
+def _region(box: List[float], width: int, height: int) -> Tuple[int, int, int, int]:
+    """Caja aprendida con margen, en píxeles"""
+    pad_x = _PADDING + (box[2] - box[0]) / 2
+    pad_y = _PADDING + (box[3] - box[1]) / 2
+    return (max(0, int((box[0] - pad_x) * width)), max(0, int((box[1] - pad_y) * height)),
+            min(width, int((box[2] + pad_x) * width) + 1), min(height, int((box[3] + pad_y) * height) + 1))
+
+
+def _region_value(name: str, words: List[Dict[str, Any]]) -> Optional[Tuple[Any, List[Dict[str, Any]]]]:
+    """
+    Valor validado de un campo en las palabras de su región: la regla completa de
+    ocr_fields si la región incluye la etiqueta, o la forma del valor por palabra
+    """
+    if not words:
+        return None
+    words = sorted(words, key=lambda w: (w["line"], w["left"]))
+    text = build_text(words)
+    field = extract_fields(text)[name]
+    if field["inicio"] is not None:
+        value = field["valor"]
+        matched = SpatialIndex(words).words_in_span(field["inicio"], field["fin"])
+    elif name in _VALUE_PATTERNS:
+        candidates = [w for w in words if _VALUE_PATTERNS[name].fullmatch(w["text"].strip(':'))]
+        if not candidates:
+            return None
+        matched = candidates[:1]
+        value = _CONVERTERS[name](matched[0]["text"].strip(':').lstrip('$'))
+    else:
+        return None
+    if name == 'monto' and not value > 0:
+        return None
+    if name == 'proveedor' and not str(value).strip():
+        return None
+    return value, matched
+
+
+def recognize_page(pixels: np.ndarray, steps: List[str], store: TemplateStore,
+                   deadline: Deadline) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]]:
+    """
+    OCR de la página preprocesada con la plantilla de su proveedor
+    1. Reconoce solo la zona donde las plantillas listas tienen el RUC
+    2. Si ese RUC tiene plantilla, reconoce en paralelo solo sus regiones; si
+       todos los valores validan devuelve (palabras, campos con fuente 'plantilla')
+    3. Si no hay plantilla para el RUC o algún valor no valida devuelve None y la
+       página se reconoce completa por el camino normal
+    TimeoutError si se agota el plazo, como el OCR de página completa
+    """
+    probe = store.ruc_region(steps)
+    if probe is None:
+        return None
+    height, width = pixels.shape[:2]
+    left, top, right, bottom = _region(probe, width, height)
+    ruc_words = _recognize(pixels[top:bottom, left:right], left, top, 0, deadline)
+    ruc = extract_fields(build_text(ruc_words))["ruc"]
+    template = store.get(ruc["valor"], steps) if ruc["inicio"] is not None else None
+    if template is None:
+        return None
+    ruc_words_matched = SpatialIndex(ruc_words).words_in_span(ruc["inicio"], ruc["fin"])
+
+    boxes = {name: _region(template["campos"][name]["bbox_relativo"], width, height) for name in TEMPLATE_FIELDS}
+    region_words = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(len(boxes), OCR_TEMPLATE_REGION_THREADS))) as pool:
+        futures = {}
+        for i, (name, (left, top, right, bottom)) in enumerate(boxes.items()):
+            # Cada región numera sus líneas aparte para no mezclarse con las demás
+            base = (i + 1) * 10000
+            futures[name] = pool.submit(_recognize, pixels[top:bottom, left:right], left, top, base, deadline)
+        for name, future in futures.items():
+            region_words[name] = future.result()
+
+    values = {name: _region_value(name, region_words[name]) for name in TEMPLATE_FIELDS}
+    if all(values.values()):
+        words = ruc_words + [w for name in TEMPLATE_FIELDS for w in region_words[name]]
+        index = SpatialIndex(words, {1: (width, height)})
+        fields = {name: index.describe(value, matched, 'plantilla') for name, (value, matched) in values.items()}
+        fields["ruc"] = index.describe(ruc["valor"], ruc_words_matched, 'texto')
+        logger.info(f"Factura de {ruc['valor']} reconocida con plantilla ({len(boxes)} regiones)")
+        return words, fields
+    failed = [name for name, value in values.items() if not value]
+    logger.info(f"Plantilla de {ruc['valor']} no validó {failed}, se reconoce la página completa")
+    store.record_failure(ruc["valor"], steps)
+    return None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_template_store() -> Optional[TemplateStore]:
+    """Devuelve las plantillas del proceso (None si están desactivadas)"""
+    global _store
+    if not OCR_TEMPLATES_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TemplateStore()
+                # Las muestras pendientes se escriben al salir del proceso; los procesos
+                # OCR salen con os._exit y llaman a flush() ellos mismos (_worker_main)
+                atexit.register(_store.flush)
+    return _store
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Extracción de la capa de texto nativa de PDFs digitales
+Usa `pdftotext -bbox` de poppler (ya requerido por pdf2image) para obtener las
+palabras con su posición y reconstruye las líneas en orden de lectura, sin
+rasterizar ni ejecutar Tesseract.
+"""
+
+import os
+import re
+import time
+import logging
+import subprocess
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Mínimo de caracteres alfanuméricos para considerar usable la capa de texto de una página
+OCR_TEXT_LAYER_MIN_CHARS = int(os.environ.get('OCR_TEXT_LAYER_MIN_CHARS', 20))
+PDFTOTEXT_CMD = os.environ.get('PDFTOTEXT_CMD', 'pdftotext')
+
+_ALNUM = re.compile(r'\w', re.UNICODE)
+
+
+def _strip_namespace(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _group_lines(words: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Agrupa palabras en líneas según el solapamiento vertical de sus cajas"""
+    lines = []
+    top = bottom = None
+    for word in sorted(words, key=lambda w: (w["top"], w["left"])):
+        center = (word["top"] + word["bottom"]) / 2
+        if lines and top <= center <= bottom:
+            lines[-1].append(word)
+            bottom = max(bottom, word["bottom"])
+            continue
+        lines.append([word])
+        top, bottom = word["top"], word["bottom"]
+    return [sorted(line, key=lambda w: w["left"]) for line in lines]
+
+
+def _page_runs(pages: Iterable[int]) -> List[Tuple[int, int]]:
+    """Agrupa páginas en tramos consecutivos [(primera, última)]: pdftotext solo lee esas"""
+    runs = []
+    for page in sorted(set(pages)):
+        if runs and page == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], page)
+        else:
+            runs.append((page, page))
+    return runs
+
+
+def _read_pages(pdf_path: str, first_page: int, last_page: int,
+                timeout: Optional[float]) -> Dict[int, Dict[str, Any]]:
+    """Capa de texto de un tramo de páginas consecutivas con una sola llamada a pdftotext"""
+    cmd = [PDFTOTEXT_CMD, '-bbox', '-enc', 'UTF-8', '-f', str(first_page), '-l', str(last_page), pdf_path, '-']
+    completed = subprocess.run(cmd, capture_output=True, timeout=timeout, check=True)
+    root = ET.fromstring(completed.stdout)
+
+    pages = {}
+    page_number = first_page
+    for page in root.iter():
+        if _strip_namespace(page.tag) != 'page':
+            continue
+        words = []
+        for word in page:
+            if _strip_namespace(word.tag) != 'word' or not (word.text or '').strip():
+                continue
+            words.append({
+                "text": word.text.strip(),
+                "left": float(word.get('xMin')),
+                "top": float(word.get('yMin')),
+                "right": float(word.get('xMax')),
+                "bottom": float(word.get('yMax')),
+            })
+        lines = _group_lines(words)
+        # Palabras en orden de lectura, con el mismo formato que entrega el motor OCR
+        ordered = [dict(w, conf=100.0, line=n) for n, line in enumerate(lines) for w in line]
+        pages[page_number] = {
+            "text": "\n".join(" ".join(w["text"] for w in line) for line in lines),
+            "words": ordered,
+            "width": float(page.get('width', 0)),
+            "height": float(page.get('height', 0)),
+        }
+        page_number += 1
+    return pages
+
+
+def extract_text_layer(pdf_path: str, pages: Iterable[int],
+                       timeout: Optional[float] = None) -> Dict[int, Dict[str, Any]]:
+    """
+    Devuelve {página: {"text", "words", "width", "height"}} solo para las páginas dadas
+    (pages=1,5000 lee dos páginas, no el rango entre ellas; las consecutivas se leen
+    juntas). Las palabras van en orden de lectura con "conf" y "line" como las del
+    motor OCR y sus coordenadas están en puntos PDF; una página sin capa de texto
+    devuelve texto vacío. `timeout` vale para todas las llamadas; si pdftotext
+    falla se devuelve lo leído hasta entonces.
+    """
+    expires_at = None if timeout is None else time.monotonic() + timeout
+    result = {}
+    for first_page, last_page in _page_runs(pages):
+        remaining = None if expires_at is None else expires_at - time.monotonic()
+        try:
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired(PDFTOTEXT_CMD, timeout)
+            result.update(_read_pages(pdf_path, first_page, last_page, remaining))
+        except (OSError, subprocess.SubprocessError, ET.ParseError) as e:
+            logger.warning(f"No se pudo leer la capa de texto del PDF: {str(e)}")
+            break
+    return result
+
+
+def is_usable(page: Optional[Dict[str, Any]]) -> bool:
+    """Una página es usable si su capa de texto tiene suficiente contenido alfanumérico"""
+    return page is not None and len(_ALNUM.findall(page["text"])) >= OCR_TEXT_LAYER_MIN_CHARS
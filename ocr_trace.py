@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Traza por petición de las etapas del procesamiento
+Cada petición de /ocr, /ocr/batch y /ocr/archive acumula sus etapas (lectura de
+la subida, similitud, cola del ejecutor, etapas del pipeline y serialización)
+como pares (etapa, segundos). Se devuelven en la cabecera estándar
+Server-Timing, en un objeto `timings` del JSON si el cliente lo pide, y como
+una línea JSON por documento y por petición en el log de trazas, que
+trace_report.py agrega en percentiles por etapa.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Log de trazas (JSON por línea); vacío lo desactiva
+OCR_TRACE_LOG = os.environ.get('OCR_TRACE_LOG', 'logs/ocr-trace.jsonl')
+# Tamaño a partir del cual el log se rota a <ruta>.1 (0: sin rotación)
+OCR_TRACE_MAX_BYTES = int(os.environ.get('OCR_TRACE_MAX_BYTES', 100 * 1024 * 1024))
+
+# Identificador de petición aceptado del cliente (p. ej. la instancia de Camunda)
+REQUEST_ID_HEADER = 'X-Request-ID'
+_MAX_REQUEST_ID = 64
+# Cada cuánto se comprueba si otro proceso rotó el log
+_REOPEN_CHECK_SECONDS = 1.0
+
+Span = Tuple[str, float]
+
+
+def stage_totals(spans: Iterable[Span]) -> Dict[str, float]:
+    """Milisegundos por etapa, sumando las repeticiones (una por página), en orden de aparición"""
+    totals = {}
+    for stage, seconds in spans:
+        totals[stage] = totals.get(stage, 0.0) + seconds * 1000
+    return {stage: round(ms, 2) for stage, ms in totals.items()}
+
+
+def timings(spans: Iterable[Span], total: float) -> Dict[str, Any]:
+    """Objeto `timings` de la respuesta: etapas y total en milisegundos"""
+    return {"etapas_ms": stage_totals(spans), "total_ms": round(total * 1000, 2)}
+
+
+def server_timing(spans: Iterable[Span], total: Optional[float] = None) -> str:
+    """Valor de la cabecera Server-Timing (duraciones en milisegundos)"""
+    metrics = [f"{stage};dur={ms:g}" for stage, ms in stage_totals(spans).items()]
+    if total is not None:
+        metrics.append(f"total;dur={round(total * 1000, 2):g}")
+    return ", ".join(metrics)
+
+
+def request_id_from_headers(headers) -> str:
+    """Id de la cabecera X-Request-ID si es un valor razonable, o uno nuevo"""
+    value = (headers.get(REQUEST_ID_HEADER) or '').strip()
+    if value and len(value) <= _MAX_REQUEST_ID and value.isprintable():
+        return value
+    return uuid.uuid4().hex[:16]
+
+
+class RequestTrace:
+    """Etapas de una petición y de cada uno de sus documentos"""
+
+    def __init__(self, request_id: str, endpoint: str, include: bool = False,
+                 log: Optional['TraceLog'] = None):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.include = include  # el cliente pidió `timings` en el JSON
+        self.log = log
+        self.started = time.perf_counter()
+        self.spans: List[Span] = []  # list.append es seguro entre los hilos de un lote
+        self.documents = 0
+        self.recording = None  # grabación de la petición (ocr_recorder), si salió en la muestra
+
+    def add(self, stage: str, seconds: float):
+        self.spans.append((stage, seconds))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def add_document(self, filename: str, file_type: str, outcome: str, spans: List[Span], seconds: float):
+        """Suma las etapas de un documento a la petición y lo escribe en el log de trazas"""
+        self.spans.extend(spans)
+        self.documents += 1
+        if self.log is not None:
+            self.log.write({
+                "tipo": "documento",
+                "request_id": self.request_id,
+                "endpoint": self.endpoint,
+                "archivo": filename,
+                "file_type": file_type,
+                "outcome": outcome,
+                "total_ms": round(seconds * 1000, 2),
+                "etapas_ms": stage_totals(spans),
+            })
+
+    def finish(self, status: int):
+        """Escribe la línea de la petición completa en el log de trazas"""
+        if self.log is not None:
+            self.log.write({
+                "tipo": "peticion",
+                "request_id": self.request_id,
+                "endpoint": self.endpoint,
+                "status": status,
+                "documentos": self.documents,
+                "total_ms": round(self.elapsed() * 1000, 2),
+                "etapas_ms": stage_totals(self.spans),
+            })
+
+
+class TraceLog:
+    """
+    Log de trazas en JSON por línea, compartido por los workers de Gunicorn
+    Cada registro es una sola escritura en modo O_APPEND, así que las líneas de
+    procesos distintos no se mezclan. Al superar OCR_TRACE_MAX_BYTES se rota a
+    <ruta>.1; los demás procesos notan la rotación y reabren el archivo
+    """
+
+    def __init__(self, path: str = OCR_TRACE_LOG, max_bytes: int = OCR_TRACE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._fd = None
+        self._checked = 0.0
+        self._counters = {"written": 0, "errors": 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._checked = time.monotonic()
+
+    def _ensure_open(self):
+        """Abre el log, o lo reabre si otro proceso lo rotó o lo borró (con el lock tomado)"""
+        if self._fd is None:
+            self._open()
+            return
+        now = time.monotonic()
+        if now - self._checked < _REOPEN_CHECK_SECONDS:
+            return
+        self._checked = now
+        try:
+            current = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(self._fd).st_ino:
+            self._open()
+
+    def _rotate(self):
+        try:
+            os.replace(self.path, self.path + '.1')
+        except FileNotFoundError:
+            pass  # otro proceso acaba de rotarlo
+        self._open()
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps({"ts": round(time.time(), 3), **record}, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                self._ensure_open()
+                os.write(self._fd, line.encode('utf-8'))
+                self._counters["written"] += 1
+                if self.max_bytes and os.fstat(self._fd).st_size > self.max_bytes:
+                    self._rotate()
+            except OSError as e:
+                # La traza no debe hacer fallar la petición
+                self._counters["errors"] += 1
+                logger.warning(f"No se pudo escribir el log de trazas {self.path}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"path": self.path, **self._counters}
+
+
+_trace_log = None
+_trace_log_lock = threading.Lock()
+
+
+def get_trace_log() -> Optional[TraceLog]:
+    """Devuelve el log de trazas del proceso (None si OCR_TRACE_LOG está vacío)"""
+    global _trace_log
+    if not OCR_TRACE_LOG:
+        return None
+    if _trace_log is None:
+        with _trace_log_lock:
+            if _trace_log is None:
+                _trace_log = TraceLog()
+    return _trace_log
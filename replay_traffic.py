@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Reproduce tráfico grabado (OCR_RECORD_LOG) contra una instancia del servicio
+Reenvía cada petición con sus documentos, parámetros y cabeceras respetando los
+intervalos entre llegadas a 1x, 10x (o cualquier factor) o a máxima velocidad,
+también las que se grabaron sin documentos (rechazos 400 y 429), y reporta la distribución de latencias frente a la grabada, los códigos de
+respuesta y las diferencias en los valores extraídos.
+
+    python replay_traffic.py --speed 1
+    python replay_traffic.py logs/requests.jsonl --speed 10 --output replay.json
+    python replay_traffic.py --speed max --concurrency 16 --synthetic
+"""
+
+import os
+import sys
+import json
+import random
+import time
+import argparse
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from ocr_recorder import (OCR_RECORD_LOG, OCR_RECORD_PAYLOAD_DIR, REPLAY_REQUEST_PREFIX, RESULT_FIELDS,
+                          payload_path, result_values, values_digest)
+
+PERCENTILES = (50, 90, 95, 99)
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Retraso de despacho a partir del cual el ritmo reproducido deja de ser el pedido
+_HIGH_LAG_MS = 100
+_local = threading.local()
+
+
+def load_records(paths: List[str], endpoint: Optional[str], limit: Optional[int]) -> List[Dict[str, Any]]:
+    """Peticiones grabadas en orden de llegada, también las rechazadas sin documentos"""
+    records = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not endpoint or record["endpoint"] == endpoint:
+                    records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    return records[:limit] if limit else records
+
+
+def load_document(document: Dict[str, Any], payload_dir: str, synthetic: bool) -> Optional[bytes]:
+    """
+    Contenido grabado del documento; con `synthetic`, si no se grabó, una factura
+    sintética del mismo tipo (determinista por el hash del original)
+    """
+    path = payload_path(payload_dir, document["sha256"])
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    if not synthetic:
+        return None
+    from benchmark_stages import build_invoice
+    fmt = document["file_type"] if document["file_type"] in ('png', 'jpg', 'pdf') else 'png'
+    return build_invoice(random.Random(document["sha256"]), fmt, dpi=200)["data"]
+
+
+def replayable(record: Dict[str, Any], payload_dir: str, synthetic: bool) -> bool:
+    """Todos los documentos de la petición están grabados (o se sustituyen por sintéticos)"""
+    return synthetic or all(os.path.exists(payload_path(payload_dir, d["sha256"])) for d in record["documentos"])
+
+
+def _session() -> requests.Session:
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def send(base_url: str, record: Dict[str, Any], files: List[Tuple[str, bytes]],
+         timeout: float) -> Tuple[int, List[Optional[Dict[str, Any]]]]:
+    """
+    Reenvía la petición y devuelve (código, valores extraídos por documento en orden)
+    /ocr/archive se reproduce como /ocr/batch en NDJSON con sus entradas, porque
+    se graban los documentos y no el paquete. Una petición grabada sin documentos
+    (400, 429) se reenvía sin ellos al mismo endpoint, que vuelve a pasar por la
+    validación y la admisión
+    """
+    headers = {**record.get("headers", {}), 'X-Request-ID': f"{REPLAY_REQUEST_PREFIX}{record['request_id']}"[:64]}
+    params = record.get("params", {})
+    if not files:
+        if record["endpoint"] == '/ocr':
+            response = _session().post(base_url + '/ocr', data=params, headers=headers, timeout=timeout)
+        else:
+            response = _session().post(base_url + record["endpoint"], params=params, data=b'',
+                                       headers=headers, timeout=timeout)
+        return response.status_code, []
+    if record["endpoint"] == '/ocr':
+        filename, data = files[0]
+        response = _session().post(base_url + '/ocr', data=params, files={'file': (filename, data)},
+                                   headers=headers, timeout=timeout)
+        return response.status_code, [result_values(_json(response))]
+
+    if record["endpoint"] == '/ocr/archive':
+        headers['Accept'] = NDJSON_MIMETYPE
+    response = _session().post(base_url + '/ocr/batch', params=params, headers=headers, timeout=timeout,
+                               files=[('files', (filename, data)) for filename, data in files])
+    results = [None] * len(files)
+    if response.headers.get('Content-Type', '').startswith(NDJSON_MIMETYPE):
+        for line in response.text.splitlines():
+            entry = json.loads(line) if line.strip() else {}
+            if entry.get("tipo") == "resultado" and entry["index"] < len(results):
+                results[entry["index"]] = result_values(entry["result"])
+    else:
+        for index, entry in enumerate((_json(response) or {}).get("results", [])[:len(results)]):
+            results[index] = result_values(entry["result"])
+    return response.status_code, results
+
+
+def _json(response: requests.Response) -> Optional[Dict[str, Any]]:
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+def diff_documents(record: Dict[str, Any], replayed: List[Optional[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Documentos cuyo resultado cambió; con valores grabados se indican los campos"""
+    diffs = []
+    for document, values in zip(record["documentos"], replayed):
+        if values_digest(values) == document.get("resultado_sha"):
+            continue
+        diff = {"archivo": document["archivo"], "sha256": document["sha256"][:12]}
+        recorded = document.get("resultado")
+        if recorded is not None and values is not None:
+            diff["campos"] = {name: [recorded.get(name), values.get(name)]
+                              for name in RESULT_FIELDS if recorded.get(name) != values.get(name)}
+        else:
+            diff["antes"] = "ok" if document.get("resultado_sha") else document.get("outcome")
+            diff["ahora"] = "ok" if values is not None else "error"
+        diffs.append(diff)
+    return diffs
+
+
+def replay(records: List[Dict[str, Any]], base_url: str, speed: Optional[float], concurrency: int,
+           payload_dir: str, synthetic: bool, timeout: float) -> Tuple[List[Dict[str, Any]], float, int]:
+    """
+    Reenvía las peticiones en su orden; con `speed` cada una sale a (ts - ts0) / speed
+    del inicio, sin él (máxima velocidad) en cuanto hay un hilo libre.
+    Devuelve (resultados, segundos totales, peticiones omitidas porque faltan sus documentos).
+    Los documentos se leen al enviar cada petición, no todos en memoria
+    """
+    prepared = [record for record in records if replayable(record, payload_dir, synthetic)]
+    missing = len(records) - len(prepared)
+    if not prepared:
+        return [], 0.0, missing
+
+    def run(record, due):
+        lag = max(0.0, (time.perf_counter() - started - due) * 1000) if due is not None else 0.0
+        files = [(d["archivo"], load_document(d, payload_dir, synthetic)) for d in record["documentos"]]
+        sent = time.perf_counter()
+        try:
+            status, values = send(base_url, record, files, timeout)
+            error = None
+        except requests.RequestException as e:
+            status, values, error = 0, [None] * len(files), str(e)
+        return {
+            "request_id": record["request_id"],
+            "endpoint": record["endpoint"],
+            "documentos": len(files),
+            "status": status,
+            "status_grabado": record["status"],
+            "latencia_ms": (time.perf_counter() - sent) * 1000,
+            "latencia_grabada_ms": record["total_ms"],
+            "retraso_ms": lag,
+            "error": error,
+            "diferencias": diff_documents(record, values) if not error else [],
+        }
+
+    first_ts = prepared[0]["ts"]
+    futures = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='replay') as pool:
+        for record in prepared:
+            due = None
+            if speed is not None:
+                due = (record["ts"] - first_ts) / speed
+                wait = due - (time.perf_counter() - started)
+                if wait > 0:
+                    time.sleep(wait)
+            futures.append(pool.submit(run, record, due))
+        results = [future.result() for future in futures]
+    return results, time.perf_counter() - started, missing
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def build_report(results: List[Dict[str, Any]], elapsed: float, missing: int, speed: Optional[float]) -> Dict[str, Any]:
+    # Las peticiones sin documentos (rechazos) se reenvían pero no se mezclan en las latencias
+    by_endpoint = defaultdict(list)
+    rejected = [result for result in results if not result["documentos"]]
+    for result in results:
+        if result["documentos"]:
+            by_endpoint[result["endpoint"]].append(result)
+    latencies = {}
+    for endpoint, group in sorted(by_endpoint.items()):
+        latencies[endpoint] = {
+            "n": len(group),
+            **{f"p{q}_ms": round(percentile([r["latencia_ms"] for r in group], q), 1) for q in PERCENTILES},
+            "max_ms": round(max(r["latencia_ms"] for r in group), 1),
+            **{f"grabada_p{q}_ms": round(percentile([r["latencia_grabada_ms"] for r in group], q), 1)
+               for q in (50, 95)},
+        }
+    documents = sum(r["documentos"] for r in results)
+    return {
+        "velocidad": speed or "max",
+        "peticiones": len(results),
+        "omitidas": missing,
+        "sin_documentos": {
+            "n": len(rejected),
+            "codigos": dict(Counter(str(r["status"]) for r in rejected)),
+            "codigos_grabados": dict(Counter(str(r["status_grabado"]) for r in rejected)),
+            "p50_ms": round(percentile([r["latencia_ms"] for r in rejected], 50), 1) if rejected else None,
+        },
+        "documentos": documents,
+        "segundos": round(elapsed, 2),
+        "peticiones_por_segundo": round(len(results) / elapsed, 2) if elapsed else None,
+        "documentos_por_segundo": round(documents / elapsed, 2) if elapsed else None,
+        "latencias": latencies,
+        "retraso_p95_ms": round(percentile([r["retraso_ms"] for r in results], 95), 1),
+        "codigos": dict(Counter(str(r["status"]) for r in results)),
+        "codigos_distintos": sum(r["status"] != r["status_grabado"] for r in results),
+        "errores_conexion": sum(r["error"] is not None for r in results),
+        "documentos_con_diferencias": sum(len(r["diferencias"]) for r in results),
+        "diferencias": [{"request_id": r["request_id"], **d} for r in results for d in r["diferencias"]],
+    }
+
+
+def print_report(report: Dict[str, Any], show_diffs: int):
+    print(f"\n📊 {report['peticiones']} peticiones ({report['documentos']} documentos) a velocidad "
+          f"{report['velocidad']} en {report['segundos']}s: {report['peticiones_por_segundo']} pet/s, "
+          f"{report['documentos_por_segundo']} doc/s")
+    if report["omitidas"]:
+        print(f"⏭️  {report['omitidas']} peticiones omitidas sin documentos grabados (use OCR_RECORD_PAYLOADS=1 o --synthetic)")
+    rejected = report["sin_documentos"]
+    if rejected["n"]:
+        print(f"🚫 {rejected['n']} peticiones sin documentos (rechazos) reenviadas: códigos {rejected['codigos']}, "
+              f"grabados {rejected['codigos_grabados']}, p50 {rejected['p50_ms']}ms")
+    print(f"{'endpoint':<14} {'n':>6} " + " ".join(f"{'p' + str(q):>9}" for q in PERCENTILES)
+          + f" {'max':>9} {'grab. p50':>10} {'grab. p95':>10}")
+    for endpoint, row in report["latencias"].items():
+        print(f"{endpoint:<14} {row['n']:>6} " + " ".join(f"{row[f'p{q}_ms']:>7.0f}ms" for q in PERCENTILES)
+              + f" {row['max_ms']:>7.0f}ms {row['grabada_p50_ms']:>8.0f}ms {row['grabada_p95_ms']:>8.0f}ms")
+    print(f"⏱️  Retraso de despacho p95: {report['retraso_p95_ms']}ms")
+    if report["retraso_p95_ms"] > _HIGH_LAG_MS:
+        print("⚠️  El cliente no sostiene la velocidad pedida: suba --concurrency o baje --speed")
+    print(f"🔢 Códigos: {report['codigos']}; distintos a los grabados: {report['codigos_distintos']}; "
+          f"errores de conexión: {report['errores_conexion']}")
+    if report["documentos_con_diferencias"]:
+        print(f"⚠️  {report['documentos_con_diferencias']} documentos con resultado distinto al grabado:")
+        for diff in report["diferencias"][:show_diffs]:
+            detail = diff.get("campos") or f"{diff.get('antes')} -> {diff.get('ahora')}"
+            print(f"  {diff['archivo']} ({diff['sha256']}): {detail}")
+    else:
+        print("✅ Mismos resultados que los grabados")
+
+
+def parse_speed(value: str) -> Optional[float]:
+    if value.lower() == 'max':
+        return None
+    speed = float(value.lower().rstrip('x'))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("la velocidad debe ser positiva o 'max'")
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce tráfico grabado contra el servicio OCR")
+    parser.add_argument('paths', nargs='*', help="Logs grabados (por defecto OCR_RECORD_LOG y su archivo rotado .1)")
+    parser.add_argument('--url', default='http://localhost:5000', help="Instancia destino")
+    parser.add_argument('--speed', type=parse_speed, default=1.0, help="Factor sobre el ritmo grabado (1, 10, ...) o 'max'")
+    parser.add_argument('--concurrency', type=int, default=32, help="Peticiones simultáneas máximas")
+    parser.add_argument('--payload-dir', default=OCR_RECORD_PAYLOAD_DIR, help="Documentos grabados")
+    parser.add_argument('--synthetic', action='store_true',
+                        help="Sustituir documentos no grabados por facturas sintéticas del mismo tipo")
+    parser.add_argument('--endpoint', help="Solo este endpoint (p. ej. /ocr)")
+    parser.add_argument('--limit', type=int, help="Primeras N peticiones")
+    parser.add_argument('--timeout', type=float, default=330, help="Timeout por petición en segundos")
+    parser.add_argument('--show-diffs', type=int, default=20, help="Diferencias a listar")
+    parser.add_argument('--output', help="Guardar el reporte en JSON")
+    args = parser.parse_args()
+
+    paths = args.paths or [p for p in (OCR_RECORD_LOG + '.1', OCR_RECORD_LOG) if os.path.exists(p)]
+    if not paths:
+        print("❌ No hay tráfico grabado (active OCR_RECORD_ENABLED=1 en el servicio)")
+        sys.exit(1)
+    records = load_records(paths, args.endpoint, args.limit)
+    if not records:
+        print(f"❌ Sin peticiones grabadas en {', '.join(paths)}")
+        sys.exit(1)
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"📄 {len(records)} peticiones grabadas en {span:.0f}s; destino {args.url}")
+
+    results, elapsed, missing = replay(records, args.url.rstrip('/'), args.speed, args.concurrency,
+                                       args.payload_dir, args.synthetic, args.timeout)
+    if not results:
+        print("❌ Ninguna petición tiene sus documentos grabados (use OCR_RECORD_PAYLOADS=1 o --synthetic)")
+        sys.exit(1)
+    report = build_report(results, elapsed, missing, args.speed)
+    print_report(report, args.show_diffs)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({**report, "resultados": results}, f, ensure_ascii=False, indent=1)
+        print(f"💾 Reporte guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Pruebas del control de admisión (ocr_admission)
+
+Uso:
+    python -m pytest test_ocr_admission.py
+"""
+
+import threading
+import time
+
+import pytest
+
+from ocr_admission import AdmissionController, AdmissionRejected
+from ocr_deadline import Deadline
+
+
+def controller():
+    return AdmissionController(max_in_flight=10, max_megapixels=20, workers=2, seconds_per_mp=0.0)
+
+
+def test_document_over_budget_is_rejected():
+    admission = controller()
+    with admission.admit(12):
+        with pytest.raises(AdmissionRejected) as error:
+            with admission.admit(12, Deadline(5)):
+                pass
+    assert error.value.retry_after >= 1
+    assert admission.stats()["rejected"] == 1
+
+
+def test_batch_files_wait_without_exceeding_budget():
+    admission = controller()
+    peak, outcomes = [], []
+
+    def batch_file():
+        try:
+            with admission.admit(12, Deadline(5), wait=True):
+                peak.append(admission.stats()["megapixels"])
+                time.sleep(0.1)
+            outcomes.append('ok')
+        except AdmissionRejected:
+            outcomes.append('rechazado')
+
+    threads = [threading.Thread(target=batch_file) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert outcomes == ['ok'] * 4
+    assert max(peak) <= 20
+
+
+def test_waiting_batch_file_fails_when_its_deadline_ends():
+    admission = controller()
+    with admission.admit(12):
+        started = time.time()
+        with pytest.raises(AdmissionRejected):
+            with admission.admit(12, Deadline(0.3), wait=True):
+                pass
+    assert time.time() - started < 2
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_text_layer_documents_do_not_change_the_rate():
+    admission = controller()
+    admission.seconds_per_mp = 0.15
+    with admission.admit(12) as admitted:
+        admitted.measured = False
+    assert admission.stats()["seconds_per_megapixel"] == 0.15
+    with admission.admit(12):
+        pass
+    # Un documento rasterizado casi instantáneo sí mueve el promedio
+    assert admission.stats()["seconds_per_megapixel"] < 0.15
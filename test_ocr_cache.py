@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la caché de resultados (ocr_cache)
+El nivel en disco no crece sin límite y una escritura fallida no deja archivos.
+
+Uso:
+    python -m pytest test_ocr_cache.py
+"""
+
+import os
+import time
+
+import ocr_cache
+from ocr_cache import ResultCache, cache_key
+
+
+def quiet_cache(directory, **kwargs):
+    """Caché sin barrido automático: las pruebas lo llaman cuando corresponde"""
+    cache = ResultCache(directory=str(directory), **kwargs)
+    cache._last_sweep = time.monotonic()
+    return cache
+
+
+def disk_files(directory, suffix):
+    return [name for _, _, names in os.walk(directory) for name in names if name.endswith(suffix)]
+
+
+def test_round_trip_through_disk(tmp_path):
+    key = cache_key(b'factura', {"pages": 'first'})
+    ResultCache(directory=str(tmp_path)).put(key, {"monto": 10.0})
+    # Otro proceso (otra instancia) la encuentra en disco
+    result, tier = ResultCache(directory=str(tmp_path)).get(key)
+    assert result == {"monto": 10.0} and tier == 'disk'
+
+
+def test_sweep_removes_expired_entries_and_abandoned_tmp(tmp_path):
+    cache = quiet_cache(tmp_path, ttl_seconds=60)
+    old, fresh = cache_key(b'vieja'), cache_key(b'nueva')
+    cache.put(old, {"monto": 1.0})
+    cache.put(fresh, {"monto": 2.0})
+    tmp = os.path.join(tmp_path, fresh[:2], 'abandonado.tmp')
+    open(tmp, 'w').close()
+    past = time.time() - 2 * 3600
+    os.utime(cache._path(old), (past, past))
+    os.utime(tmp, (past, past))
+
+    assert cache.sweep() == 2
+    assert not os.path.exists(cache._path(old)) and not os.path.exists(tmp)
+    assert os.path.exists(cache._path(fresh))
+    assert cache.stats()["disk_evictions"] == 2
+
+
+def test_sweep_keeps_the_disk_under_its_limit(tmp_path, monkeypatch):
+    cache = quiet_cache(tmp_path)
+    keys = [cache_key(str(i).encode()) for i in range(10)]
+    for age, key in enumerate(keys):
+        cache.put(key, {"texto_completo": 'x' * 1000})
+        stamp = time.time() - age
+        os.utime(cache._path(key), (stamp, stamp))
+    size = os.path.getsize(cache._path(keys[0]))
+    monkeypatch.setattr(ocr_cache, 'OCR_CACHE_MAX_DISK_MB', 4.5 * size / 1024 / 1024)
+
+    cache.sweep()
+    # Quedan las cuatro escritas más recientemente
+    assert [os.path.exists(cache._path(key)) for key in keys] == [True] * 4 + [False] * 6
+
+
+def test_failed_write_leaves_no_tmp(tmp_path):
+    cache = quiet_cache(tmp_path)
+    cache.put(cache_key(b'factura'), {"monto": object()})  # no serializable
+    assert disk_files(tmp_path, '.tmp') == [] and disk_files(tmp_path, '.json') == []
+    assert cache.stats()["stores"] == 1
+
+
+def test_first_store_sweeps_in_background(tmp_path):
+    stale = tmp_path / 'ab' / 'abandonado.tmp'
+    stale.parent.mkdir()
+    stale.touch()
+    past = time.time() - 2 * 3600
+    os.utime(stale, (past, past))
+
+    cache = ResultCache(directory=str(tmp_path))
+    cache.put(cache_key(b'factura'), {"monto": 1.0})
+    limit = time.time() + 5
+    while stale.exists():
+        assert time.time() < limit
+        time.sleep(0.01)
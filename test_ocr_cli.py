@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Pruebas del checkpoint y de los reintentos del procesamiento masivo (ocr_cli)
+
+Uso:
+    python -m pytest test_ocr_cli.py
+"""
+
+import csv
+import json
+
+from ocr_cli import CSV_COLUMNS, Checkpoint, ResultWriter, drop_records
+
+
+def write_results(path, fmt, records):
+    writer = ResultWriter(str(path), fmt, 0)
+    offset = 0
+    for record in records:
+        offset = writer.write(record)
+    writer.close()
+    return offset
+
+
+RECORDS = [
+    {"archivo": "a.png", "status": "success", "monto": 10.0},
+    {"archivo": "b.png", "status": "error", "error": "Tiempo de procesamiento excedido"},
+    {"archivo": "c.png", "status": "error", "error": "línea 1\nlínea 2"},
+]
+
+
+def test_retried_records_are_dropped_from_jsonl(tmp_path):
+    output = tmp_path / 'resultados.jsonl'
+    offset = write_results(output, 'jsonl', RECORDS)
+
+    size = drop_records(str(output), 'jsonl', ['b.png', 'c.png'], offset)
+
+    lines = [json.loads(line) for line in output.read_text(encoding='utf-8').splitlines()]
+    assert [line["archivo"] for line in lines] == ['a.png']
+    assert size == output.stat().st_size
+
+
+def test_retried_records_are_dropped_from_csv(tmp_path):
+    output = tmp_path / 'resultados.csv'
+    offset = write_results(output, 'csv', RECORDS)
+
+    drop_records(str(output), 'csv', ['c.png'], offset)
+
+    with open(output, encoding='utf-8', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == CSV_COLUMNS
+    assert [row[0] for row in rows[1:]] == ['a.png', 'b.png']
+
+
+def test_writes_after_checkpoint_offset_are_discarded(tmp_path):
+    output = tmp_path / 'resultados.jsonl'
+    offset = write_results(output, 'jsonl', RECORDS[:1])
+    writer = ResultWriter(str(output), 'jsonl', offset)
+    writer.write(RECORDS[1])  # escrito pero nunca registrado en el checkpoint
+    writer.close()
+
+    drop_records(str(output), 'jsonl', [], offset)
+    assert [json.loads(line)["archivo"] for line in output.read_text(encoding='utf-8').splitlines()] == ['a.png']
+
+
+def test_forget_rewrites_checkpoint(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'resultados.jsonl.checkpoint'))
+    checkpoint.done = {"a.png": "success", "b.png": "error"}
+    checkpoint.offset = 200
+    checkpoint.forget(['b.png'], 120)
+
+    reloaded = Checkpoint(checkpoint.path)
+    reloaded.load()
+    assert reloaded.done == {"a.png": "success"} and reloaded.offset == 120
+    assert reloaded.pending(['a.png', 'b.png'], retry_failed=True) == ['b.png']
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Pruebas del pool de motores Tesseract (ocr_engine)
+tesserocr se reemplaza por un motor falso que cuenta cuántas veces se inicializa.
+
+Uso:
+    python -m pytest test_ocr_engine.py
+"""
+
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import ocr_engine
+from ocr_engine import TesseractEnginePool
+
+
+class FakeEngine:
+    """PyTessBaseAPI falso: registra las inicializaciones y lo que reconoce"""
+    created = 0
+
+    def __init__(self, **kwargs):
+        FakeEngine.created += 1
+        self.image = None
+        self.cleared = 0
+
+    def SetImage(self, image):
+        self.image = image
+
+    def GetUTF8Text(self):
+        return f"{self.image.size[0]}x{self.image.size[1]}"
+
+    def Clear(self):
+        self.image = None
+        self.cleared += 1
+
+    def End(self):
+        pass
+
+
+@pytest.fixture
+def fake_tesserocr(monkeypatch):
+    FakeEngine.created = 0
+    fake = SimpleNamespace(PyTessBaseAPI=FakeEngine, PSM=SimpleNamespace(SINGLE_BLOCK=6),
+                           OEM=SimpleNamespace(DEFAULT=3))
+    monkeypatch.setattr(ocr_engine, 'tesserocr', fake)
+    return fake
+
+
+def test_engines_are_reused_across_calls(fake_tesserocr):
+    pool = TesseractEnginePool(size=2, backend='tesserocr')
+    image = np.full((20, 30), 255, dtype=np.uint8)
+    assert [pool.image_to_string(image) for _ in range(5)] == ['30x20'] * 5
+    # Una sola inicialización (carga del traineddata) para cinco facturas
+    assert FakeEngine.created == 1
+    assert pool.stats() == {"backend": 'tesserocr', "size": 2, "created": 1, "idle": 1}
+
+
+def test_pool_never_exceeds_its_size(fake_tesserocr):
+    pool = TesseractEnginePool(size=2, backend='tesserocr')
+    with pool.acquire() as first, pool.acquire() as second:
+        assert first is not second
+        waited = []
+
+        def third():
+            with pool.acquire(timeout=5) as engine:
+                waited.append(engine)
+
+        waiter = threading.Thread(target=third)
+        waiter.start()
+        waiter.join(0.2)
+        # El tercero espera un motor libre en lugar de crear otro
+        assert waiter.is_alive() and FakeEngine.created == 2
+    waiter.join(5)
+    # Recibe un motor ya usado y limpio
+    assert waited and waited[0] in (first, second) and waited[0].image is None
+
+
+def test_warm_up_and_failed_creation(fake_tesserocr, monkeypatch):
+    pool = TesseractEnginePool(size=3, backend='tesserocr')
+    assert pool.warm_up(2) == 2 and pool.warm_up(2) == 0
+
+    def broken(**kwargs):
+        raise RuntimeError("traineddata faltante")
+
+    monkeypatch.setattr(fake_tesserocr, 'PyTessBaseAPI', broken)
+    with pytest.raises(RuntimeError):
+        pool.warm_up()
+    # El motor que no se pudo crear no ocupa lugar en el pool
+    assert pool.stats()["created"] == 2
+
+
+def test_backend_falls_back_to_pytesseract(monkeypatch):
+    monkeypatch.setattr(ocr_engine, 'tesserocr', None)
+    assert TesseractEnginePool(backend='auto').backend == 'pytesseract'
+    with pytest.raises(RuntimeError):
+        TesseractEnginePool(backend='tesserocr')
+
+
+def test_tsv_words_keep_reading_order(monkeypatch):
+    data = {"text": ['', 'FACTURA', '001-001', 'TOTAL', '  '], "conf": ['-1', '96.5', '91', '88', '-1'],
+            "block_num": [1, 1, 1, 1, 1], "par_num": [1, 1, 1, 1, 1], "line_num": [0, 1, 1, 2, 2],
+            "left": [0, 10, 80, 10, 0], "top": [0, 5, 5, 40, 0], "width": [0, 60, 50, 40, 0],
+            "height": [0, 12, 12, 12, 0]}
+    monkeypatch.setattr(ocr_engine.pytesseract, 'image_to_data', lambda *args, **kwargs: data)
+    pool = TesseractEnginePool(backend='pytesseract')
+
+    words = pool.recognize(np.full((60, 200), 255, dtype=np.uint8))
+    assert [(word["text"], word["line"]) for word in words] == [('FACTURA', 0), ('001-001', 0), ('TOTAL', 1)]
+    assert words[1]["right"] == 130 and words[1]["conf"] == 91.0
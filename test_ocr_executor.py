@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Pruebas del ejecutor de procesos OCR (ocr_executor)
+Un trabajo vencido o cancelado mata solo su proceso; los demás terminan.
+
+Uso:
+    python -m pytest test_ocr_executor.py
+"""
+
+import os
+import time
+import threading
+
+import pytest
+
+from ocr_deadline import Deadline, DeadlineExceeded
+from ocr_executor import ExecutorBusyError, OCRExecutor
+
+
+def sleep_job(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def failing_job():
+    raise ValueError("documento ilegible")
+
+
+@pytest.fixture
+def executor():
+    executor = OCRExecutor(max_workers=2, queue_size=2)
+    yield executor
+    executor.shutdown(wait=False)
+
+
+def test_killing_an_overdue_job_keeps_the_others(executor):
+    outcome = {}
+    other = threading.Thread(target=lambda: outcome.update(pid=executor.run(sleep_job, 1.5, timeout=10)))
+    other.start()
+    time.sleep(0.3)
+    with pytest.raises(DeadlineExceeded):
+        executor.run(sleep_job, 30, deadline=Deadline(0.2))
+    other.join()
+
+    assert 'pid' in outcome  # el trabajo del otro proceso terminó bien
+    assert executor.run(sleep_job, 0, timeout=10)  # el proceso matado se reemplaza
+    stats = executor.stats()
+    assert stats["killed"] == 1 and stats["completed"] == 2
+
+
+def test_killing_a_finished_job_spares_the_next_one():
+    executor = OCRExecutor(max_workers=1, queue_size=1)
+    try:
+        finished = executor.submit(sleep_job, 0)
+        executor.result(finished, timeout=10)
+        # El mismo proceso ya ejecuta otro trabajo cuando llega la orden tardía
+        following = executor.submit(sleep_job, 0.5)
+        time.sleep(0.2)
+        executor._kill(finished)
+        assert executor.result(following, timeout=10)
+        assert executor.stats()["killed"] == 0
+    finally:
+        executor.shutdown(wait=False)
+
+
+def test_failures_are_counted_apart(executor):
+    executor.run(sleep_job, 0, timeout=10)
+    with pytest.raises(ValueError):
+        executor.run(failing_job, timeout=10)
+    stats = executor.stats()
+    assert stats["completed"] == 1 and stats["failed"] == 1
+
+
+def test_cancelled_deadline_frees_the_process(executor):
+    deadline = Deadline(60)
+    started = time.time()
+    threading.Timer(0.3, deadline.cancel).start()
+    with pytest.raises(DeadlineExceeded):
+        executor.run(sleep_job, 30, deadline=deadline)
+    assert time.time() - started < 5
+    assert executor.stats()["active_workers"] == 0
+
+
+def test_full_queue_is_rejected():
+    executor = OCRExecutor(max_workers=1, queue_size=0)
+    try:
+        future = executor.submit(sleep_job, 0.5)
+        with pytest.raises(ExecutorBusyError):
+            executor.submit(sleep_job, 0)
+        executor.result(future, timeout=10)
+        assert executor.stats()["rejected"] == 1
+    finally:
+        executor.shutdown(wait=False)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Pruebas de los trabajos asíncronos (ocr_jobs) y de su retención en el worker web
+
+Uso:
+    python -m pytest test_ocr_jobs.py
+"""
+
+import os
+import time
+import importlib.util
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import ocr_jobs
+from ocr_deadline import DeadlineExceeded
+from ocr_executor import ExecutorBusyError
+from ocr_jobs import CANCELLED, COMPLETED, FAILED, JobManager, JobQueueFullError
+
+
+def wait_state(job, states, timeout=5.0):
+    """Consulta el trabajo como lo haría el cliente hasta que llegue a uno de `states`"""
+    limit = time.time() + timeout
+    while job.state not in states:
+        assert time.time() < limit, f"El trabajo sigue en {job.state}"
+        time.sleep(0.01)
+    return job
+
+
+def load_gunicorn_conf():
+    """gunicorn.conf.py como módulo, sin dejar sus variables de entorno en la prueba"""
+    with mock.patch.dict(os.environ):
+        spec = importlib.util.spec_from_file_location(
+            'gunicorn_conf', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+def test_job_completes_and_can_be_polled():
+    manager = JobManager(lambda data, filename, options, deadline: {"archivo_procesado": filename}, threads=1)
+    job = manager.submit(b'datos', 'factura.png', {})
+    wait_state(job, (COMPLETED,))
+    polled = manager.get(job.id).to_dict()
+    assert polled["estado"] == COMPLETED and polled["resultado"] == {"archivo_procesado": 'factura.png'}
+    assert manager.stats()["completed"] == 1
+
+
+def test_failed_job_reports_stage():
+    def handler(data, filename, options, deadline):
+        raise DeadlineExceeded('ocr', 1.0)
+
+    manager = JobManager(handler, threads=1)
+    job = wait_state(manager.submit(b'datos', 'factura.png', {}), (FAILED,))
+    assert job.to_dict()["error"]["etapa"] == 'ocr'
+
+
+def test_busy_executor_is_retried():
+    attempts = []
+
+    def handler(data, filename, options, deadline):
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise ExecutorBusyError("lleno")
+        return {"ok": True}
+
+    manager = JobManager(handler, threads=1)
+    job = wait_state(manager.submit(b'datos', 'factura.png', {}), (COMPLETED,))
+    assert job.result == {"ok": True} and len(attempts) == 2
+
+
+def test_cancel_running_job_cancels_its_deadline():
+    seen = []
+
+    def handler(data, filename, options, deadline):
+        seen.append(deadline)
+        while not deadline.cancelled:
+            time.sleep(0.01)
+        raise DeadlineExceeded(deadline.stage, deadline.budget)
+
+    manager = JobManager(handler, threads=1)
+    job = manager.submit(b'datos', 'factura.png', {})
+    while not seen:
+        time.sleep(0.01)
+    manager.cancel(job.id)
+    assert seen[0].cancelled and seen[0].remaining() <= 0
+    assert manager.get(job.id).state == CANCELLED
+
+
+def test_queue_full_is_rejected():
+    manager = JobManager(lambda *args: time.sleep(1), threads=1, queue_size=1)
+    manager.submit(b'1', 'a.png', {})
+    with pytest.raises(JobQueueFullError):
+        for _ in range(3):
+            manager.submit(b'2', 'b.png', {})
+
+
+def test_recycling_waits_for_retained_jobs(monkeypatch):
+    conf = load_gunicorn_conf()
+    # Un solo worker web por defecto: las consultas siempre llegan al dueño del trabajo
+    assert conf.workers == int(os.environ.get('GUNICORN_WORKERS', 1))
+
+    manager = JobManager(lambda *args: {"ok": True}, threads=1)
+    monkeypatch.setattr(ocr_jobs, '_manager', manager)
+    log = SimpleNamespace(debug=lambda message: None)
+    worker = SimpleNamespace(nr=9, max_requests=10, log=log)
+
+    job = manager.submit(b'datos', 'factura.png', {})
+    wait_state(job, (COMPLETED,))
+    # La petición que reciclaría el worker con el resultado aún sin consultar
+    conf.pre_request(worker, None)
+    assert worker.max_requests > worker.nr + 1
+    # Peticiones siguientes (p. ej. las consultas del cliente) lo siguen encontrando
+    for _ in range(5):
+        worker.nr += 1
+        conf.pre_request(worker, None)
+        assert manager.get(job.id).state == COMPLETED
+        assert worker.max_requests > worker.nr + 1
+
+    # Consultado y eliminado, el worker se recicla con la petición siguiente
+    manager.cancel(job.id)
+    conf.pre_request(worker, None)
+    worker.nr += 1
+    assert worker.nr + 1 >= worker.max_requests
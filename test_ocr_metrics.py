@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Pruebas del registro de métricas (ocr_metrics)
+
+Uso:
+    python -m pytest test_ocr_metrics.py
+"""
+
+import gc
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ocr_metrics import MetricsRegistry, file_type
+
+
+def test_finished_threads_do_not_leak_shards():
+    registry = MetricsRegistry(enabled=True, directory='')
+    counter = registry.counter('prueba_total', 'Prueba', ('tipo',))
+    histogram = registry.histogram('prueba_segundos', 'Prueba', ('tipo',))
+
+    def work(_):
+        counter.inc(tipo='pdf')
+        histogram.observe(0.01, tipo='pdf')
+
+    # Cada pool crea hilos nuevos, como los hilos de lote o de Gunicorn que se reemplazan
+    for _ in range(50):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(work, range(8)))
+    gc.collect()
+
+    assert len(registry._shards) <= 1  # a lo sumo el del hilo de la prueba
+    snapshot = registry.snapshot()
+    assert snapshot[('prueba_total', ('pdf',))] == 400
+    assert snapshot[('prueba_segundos', ('pdf',))][-1] == 400
+
+
+def test_values_of_live_threads_are_included():
+    registry = MetricsRegistry(enabled=True, directory='')
+    counter = registry.counter('vivos_total', 'Prueba')
+    counted, release = threading.Event(), threading.Event()
+
+    def work():
+        counter.inc()
+        counted.set()
+        release.wait()
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    counted.wait()
+    counter.inc()
+    assert registry.snapshot()[('vivos_total', ())] == 2
+    release.set()
+    thread.join()
+    gc.collect()
+    assert registry.snapshot()[('vivos_total', ())] == 2
+
+
+def test_file_type_label_is_bounded():
+    assert file_type('factura.PDF') == 'pdf'
+    assert file_type('foto.jpeg') == 'jpg'
+    assert file_type('foto.jpg') == 'jpg'
+    # Nombres del cliente no crean series nuevas
+    assert file_type('malicioso.exe') == 'otro'
+    assert file_type('sin_extension') == 'otro'
+    assert file_type('x.' + 'a' * 200) == 'otro'
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Pruebas de las opciones de procesamiento (ocr_pipeline) y de su clave de caché
+
+Uso:
+    python -m pytest test_ocr_pipeline.py
+"""
+
+import pytest
+
+import ocr_preprocess
+from ocr_cache import cache_key
+from ocr_pipeline import DEFAULT_PAGES, OCRProcessingError, parse_options
+
+
+def test_defaults_are_resolved():
+    options = parse_options({})
+    assert options == {"pages": DEFAULT_PAGES, "text_layer": True, "templates": options["templates"],
+                       "preprocess": ",".join(ocr_preprocess.parse_steps(None)) or 'none'}
+    # Pedir explícitamente el valor por defecto es la misma configuración
+    assert parse_options({"pages": DEFAULT_PAGES, "text_layer": '1', "preprocess": 'default'}) == options
+
+
+def test_preprocess_default_changes_the_key(monkeypatch):
+    monkeypatch.setattr(ocr_preprocess, 'OCR_PREPROCESS', 'grayscale')
+    before = cache_key(b'factura', parse_options({}))
+    monkeypatch.setattr(ocr_preprocess, 'OCR_PREPROCESS', 'grayscale,deskew')
+    after = cache_key(b'factura', parse_options({}))
+    assert before != after
+
+
+def test_options_change_the_key():
+    keys = {cache_key(b'factura', parse_options(values)) for values in
+            ({}, {"pages": 'all'}, {"text_layer": '0'}, {"templates": '0'}, {"preprocess": 'none'})}
+    assert len(keys) == 5
+
+
+def test_invalid_options_are_rejected():
+    with pytest.raises(OCRProcessingError):
+        parse_options({"pages": 'ultima'})
+    with pytest.raises(OCRProcessingError):
+        parse_options({"preprocess": 'sharpen'})
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Pruebas del preprocesamiento de imágenes (ocr_preprocess)
+
+Uso:
+    python -m pytest test_ocr_preprocess.py
+"""
+
+import numpy as np
+from PIL import Image
+
+from ocr_preprocess import OCR_PREPROCESS, downscale, parse_steps, preprocess
+
+
+def test_default_is_grayscale_only():
+    if OCR_PREPROCESS == 'grayscale':
+        assert parse_steps('default') == ['grayscale']
+    assert parse_steps('none') == []
+    assert parse_steps('deskew,grayscale') == ['grayscale', 'deskew']
+
+
+def test_phone_photo_is_downscaled_to_target_dpi():
+    # Foto de 12 MP de una A4: unos 345 dpi, por debajo de dos veces el objetivo
+    pixels = np.full((4032, 3024), 200, dtype=np.uint8)
+    reduced, dpi = downscale(pixels, 345.0, 300)
+    assert round(dpi) == 300
+    assert reduced.shape == (round(4032 * 300 / 345), round(3024 * 300 / 345))
+
+
+def test_close_to_target_is_left_alone():
+    pixels = np.full((1000, 800), 200, dtype=np.uint8)
+    reduced, dpi = downscale(pixels, 305.0, 300)
+    assert reduced is pixels and dpi == 305.0
+
+
+def test_report_includes_effective_dpi():
+    image = Image.new('RGB', (3024, 4032), 'white')
+    pixels, report = preprocess(image, ['grayscale', 'downscale'], target_dpi=300)
+    assert pixels.ndim == 2
+    assert report["dpi_efectivo"] == 300
+    assert set(report["etapas_ms"]) == {'grayscale', 'downscale'}
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Pruebas de casi duplicados (ocr_similar)
+Un reescaneo se marca como posible duplicado, pero la respuesta siempre trae
+los campos del OCR de ese documento, nunca los de otro.
+
+Uso:
+    python -m pytest test_ocr_similar.py
+"""
+
+import io
+import hashlib
+
+import pytest
+from PIL import Image, ImageDraw
+
+import app
+from ocr_cache import ResultCache
+from ocr_similar import SimilarityIndex, document_hashes, options_digest, process_with_hashes
+
+
+def invoice_png(total: str) -> bytes:
+    """Factura sintética con bloques de texto y tablas, como PNG"""
+    image = Image.new('RGB', (850, 1100), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((40, 40, 810, 160), outline='black', width=3)
+    draw.text((60, 60), "FERRETERIA EL PERNO S.A.", fill='black')
+    draw.text((60, 100), "RUC: 1790011674001", fill='black')
+    for row in range(12):
+        y = 220 + row * 50
+        draw.rectangle((40, y, 810, y + 40), outline='black', width=1)
+        draw.rectangle((60, y + 10, 60 + 30 * (row % 7 + 3), y + 30), fill='black')
+    draw.text((600, 900), f"TOTAL: ${total}", fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def as_jpeg(data: bytes, quality: int = 80) -> bytes:
+    """El mismo documento reescaneado: otro formato y compresión con pérdida"""
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(data)).convert('RGB').save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def fake_process(data, filename, options=None, deadline=None):
+    """Procesamiento sin Tesseract: el monto depende de los bytes del documento"""
+    return {"proveedor": "FERRETERIA EL PERNO S.A.", "monto": int(hashlib.sha256(data).hexdigest()[:6], 16) / 100,
+            "fecha": "2024-01-15", "numero_factura": "001-001-000123", "ruc": "1790011674001",
+            "archivo_procesado": filename, "timestamp": "2024-01-15T10:00:00", "status": "success",
+            "metodo_extraccion": "ocr", "paginas_procesadas": [1]}
+
+
+@pytest.fixture
+def isolated_app(tmp_path, monkeypatch):
+    """La app con caché e índice propios de la prueba y un OCR falso"""
+    cache = ResultCache(directory=str(tmp_path / 'ocr'))
+    index = SimilarityIndex(path=str(tmp_path / 'similitud.bin'))
+    monkeypatch.setattr(app, 'get_result_cache', lambda: cache)
+    monkeypatch.setattr(app, 'get_similarity_index', lambda: index)
+    monkeypatch.setattr(app, 'get_admission_controller', lambda: None)
+    monkeypatch.setattr(app, 'process_document', fake_process)
+    return cache, index
+
+
+def test_reencoded_document_is_near_duplicate():
+    original = invoice_png("150.00")
+    index = SimilarityIndex(path=None)
+    index.add(document_hashes(original, 'a.png'), options_digest({}), 'ab' * 32)
+
+    match = index.search(document_hashes(as_jpeg(original), 'b.jpg'), options_digest({}))
+    assert match is not None and match[0] == 'ab' * 32
+    # Con otras opciones el mismo documento no se compara
+    assert index.search(document_hashes(as_jpeg(original), 'b.jpg'), options_digest({'pages': 'all'})) is None
+
+
+def test_hashes_are_computed_in_the_ocr_job():
+    data = invoice_png("10.00")
+    result, hashes = process_with_hashes(fake_process, data, 'a.png', {}, None)
+    assert result["archivo_procesado"] == 'a.png'
+    assert hashes == document_hashes(data, 'a.png')
+
+
+def test_near_duplicate_keeps_its_own_fields(isolated_app):
+    original = invoice_png("150.00")
+    rescan = as_jpeg(original)
+
+    first = app.run_document(original, 'original.png', {})
+    second = app.run_document(rescan, 'reescaneo.jpg', {})
+
+    assert not first.get("posible_duplicado")
+    assert second["posible_duplicado"] is True
+    assert second["duplicado_de"]["archivo_procesado"] == 'original.png'
+    # Los campos son los del OCR del reescaneo, no los del documento anterior
+    assert second["archivo_procesado"] == 'reescaneo.jpg'
+    assert second["monto"] == fake_process(rescan, 'reescaneo.jpg')["monto"]
+    assert second["monto"] != first["monto"]
+    assert second["duplicado_de"]["mismos_valores"] is False
+    assert second["cache_hit"] is False
+    # Leer el original no es un acierto de la caché pedido por un cliente
+    stats = isolated_app[0].stats()
+    assert stats["memory_hits"] + stats["disk_hits"] == 0 and stats["misses"] == 2
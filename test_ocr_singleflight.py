@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la coalescencia de peticiones (ocr_singleflight)
+
+Uso:
+    python -m pytest test_ocr_singleflight.py
+"""
+
+import threading
+import time
+
+import pytest
+
+from ocr_deadline import DeadlineExceeded
+from ocr_singleflight import SingleFlight
+
+
+def test_leader_mutation_does_not_reach_waiters():
+    flight = SingleFlight()
+    errors = []
+
+    def compute():
+        time.sleep(0.05)
+        return {f"campo{i}": list(range(20)) for i in range(200)}
+
+    def leader():
+        result, shared = flight.do('clave', compute)
+        assert not shared
+        # Como hace run_document: el líder anota su propia respuesta
+        for i in range(1000):
+            result[f"anotado{i}"] = i
+
+    def waiter():
+        try:
+            result, shared = flight.do('clave', compute)
+            assert shared and len(result) == 200
+        except Exception as e:
+            errors.append(e)
+
+    for _ in range(10):
+        first = threading.Thread(target=leader)
+        first.start()
+        time.sleep(0.01)
+        waiters = [threading.Thread(target=waiter) for _ in range(6)]
+        for thread in waiters:
+            thread.start()
+        for thread in waiters + [first]:
+            thread.join()
+
+    assert errors == []
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_waiters_get_independent_copies():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def compute():
+        started.set()
+        release.wait()
+        return {"monto": 10.0}
+
+    leader = threading.Thread(target=lambda: results.append(flight.do('clave', compute)))
+    leader.start()
+    started.wait()
+    waiter = threading.Thread(target=lambda: results.append(flight.do('clave', compute)))
+    waiter.start()
+    while flight.stats()["waiting"] == 0:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    waiter.join()
+
+    (first, _), (second, _) = results
+    assert first == second and first is not second
+    first["monto"] = 0
+    assert second["monto"] == 10.0
+
+
+def test_waiter_retries_when_leader_fails_its_own_deadline():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def failing():
+        started.set()
+        release.wait()
+        raise DeadlineExceeded('ocr', 1.0)
+
+    def retried():
+        calls.append(1)
+        return {"monto": 5.0}
+
+    leader_error = []
+
+    def leader():
+        try:
+            flight.do('clave', failing)
+        except DeadlineExceeded as e:
+            leader_error.append(e)
+
+    first = threading.Thread(target=leader)
+    first.start()
+    started.wait()
+    outcome = []
+    waiter = threading.Thread(target=lambda: outcome.append(flight.do('clave', retried)))
+    waiter.start()
+    while flight.stats()["waiting"] == 0:
+        time.sleep(0.001)
+    release.set()
+    first.join()
+    waiter.join()
+
+    assert leader_error and outcome[0] == ({"monto": 5.0}, False) and calls == [1]
+    assert flight.stats()["retried"] == 1
+
+
+def test_leader_error_propagates():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do('clave', lambda: (_ for _ in ()).throw(ValueError("falló")))
+    assert flight.stats()["in_flight"] == 0
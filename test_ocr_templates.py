@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Pruebas del aprendizaje de plantillas por proveedor (ocr_templates)
+
+Uso:
+    python -m pytest test_ocr_templates.py
+"""
+
+import json
+import time
+import multiprocessing
+
+import ocr_templates
+from ocr_executor import OCRExecutor
+from ocr_templates import OCR_TEMPLATE_FLUSH_SAMPLES, TEMPLATE_FIELDS, TemplateStore, is_ready
+
+STEPS = ['grayscale']
+RUC = '1790011674001'
+
+
+def sample_fields():
+    """Campos de un OCR de página completa con el RUC en el encabezado"""
+    fields = {name: {"valor": "x", "fuente": "texto", "pagina": 1, "bbox_relativo": [0.5, 0.3, 0.7, 0.32]}
+              for name in TEMPLATE_FIELDS}
+    fields["ruc"] = {"valor": RUC, "fuente": "texto", "pagina": 1, "bbox_relativo": [0.1, 0.1, 0.3, 0.12]}
+    return fields
+
+
+def learn_many(directory, count):
+    store = TemplateStore(directory)
+    for _ in range(count):
+        store.learn(sample_fields(), STEPS)
+    store.flush()
+
+
+def learn_in_worker(directory, count):
+    """Trabajo del ejecutor: aprende en la instancia del proceso OCR sin llamar a flush()"""
+    ocr_templates._store = TemplateStore(directory)
+    for _ in range(count):
+        ocr_templates._store.learn(sample_fields(), STEPS)
+
+
+def test_no_probe_without_ready_templates(tmp_path):
+    store = TemplateStore(str(tmp_path))
+    assert store.ruc_region(STEPS) is None
+    store.learn(sample_fields(), STEPS)
+    store.flush()
+    # Una muestra no alcanza: las páginas se siguen reconociendo completas
+    assert store.ruc_region(STEPS) is None
+
+
+def test_writes_are_batched(tmp_path):
+    store = TemplateStore(str(tmp_path))
+    store.learn(sample_fields(), STEPS)
+    assert not list(tmp_path.glob('*.json'))
+    store.flush()
+    assert len(list(tmp_path.glob('*.json'))) == 1
+
+
+def test_concurrent_processes_do_not_lose_samples(tmp_path):
+    processes = [multiprocessing.Process(target=learn_many, args=(str(tmp_path), 25)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    (path,) = tmp_path.glob('*.json')
+    template = json.loads(path.read_text(encoding='utf-8'))
+    assert all(field["muestras"] == 100 for field in template["campos"].values())
+    assert is_ready(template)
+
+    store = TemplateStore(str(tmp_path))
+    assert store.get(RUC, STEPS) is not None
+    assert store.ruc_region(STEPS) == [0.1, 0.1, 0.3, 0.12]
+    # Otro preprocesamiento no usa estas cajas
+    assert store.ruc_region(['grayscale', 'deskew']) is None
+
+
+def test_pending_samples_are_written_by_the_timer(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_templates, 'OCR_TEMPLATE_FLUSH_SECONDS', 0.2)
+    store = TemplateStore(str(tmp_path))
+    store.learn(sample_fields(), STEPS)
+    # Sin más muestras ni flush() explícito
+    time.sleep(0.6)
+    assert len(list(tmp_path.glob('*.json'))) == 1
+
+
+def test_ocr_worker_writes_pending_samples_on_exit(tmp_path):
+    executor = OCRExecutor(max_workers=1, queue_size=1)
+    executor.run(learn_in_worker, str(tmp_path), OCR_TEMPLATE_FLUSH_SAMPLES - 1, timeout=30)
+    executor.shutdown(wait=True)
+
+    (path,) = tmp_path.glob('*.json')
+    template = json.loads(path.read_text(encoding='utf-8'))
+    assert template["campos"]["ruc"]["muestras"] == OCR_TEMPLATE_FLUSH_SAMPLES - 1
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la capa de texto nativa de PDFs (ocr_textlayer)
+pdftotext se reemplaza por una respuesta fija para ver qué páginas se piden.
+
+Uso:
+    python -m pytest test_ocr_textlayer.py
+"""
+
+import subprocess
+
+import ocr_textlayer
+from ocr_textlayer import _page_runs, extract_text_layer
+
+
+def fake_pdftotext(calls):
+    """subprocess.run que registra el tramo pedido y devuelve una página con texto por cada una"""
+    def run(cmd, **kwargs):
+        first, last = int(cmd[cmd.index('-f') + 1]), int(cmd[cmd.index('-l') + 1])
+        calls.append((first, last))
+        pages = "".join(
+            f'<page width="612" height="792"><word xMin="10" yMin="10" xMax="60" yMax="20">pagina{n}</word></page>'
+            for n in range(first, last + 1))
+        stdout = f'<html xmlns="http://www.w3.org/1999/xhtml"><body><doc>{pages}</doc></body></html>'
+        return subprocess.CompletedProcess(cmd, 0, stdout=stdout.encode('utf-8'), stderr=b'')
+    return run
+
+
+def test_consecutive_pages_are_grouped():
+    assert _page_runs([5000, 1, 2, 3, 7, 2]) == [(1, 3), (7, 7), (5000, 5000)]
+
+
+def test_only_selected_pages_are_read(monkeypatch):
+    calls = []
+    monkeypatch.setattr(ocr_textlayer.subprocess, 'run', fake_pdftotext(calls))
+
+    pages = extract_text_layer('factura.pdf', [1, 5000], timeout=5)
+
+    assert calls == [(1, 1), (5000, 5000)]
+    assert sorted(pages) == [1, 5000]
+    assert pages[5000]["text"] == 'pagina5000'
+
+
+def test_failure_keeps_pages_already_read(monkeypatch):
+    calls = []
+    run = fake_pdftotext(calls)
+
+    def flaky(cmd, **kwargs):
+        if calls:
+            raise subprocess.TimeoutExpired(cmd, kwargs.get('timeout'))
+        return run(cmd, **kwargs)
+
+    monkeypatch.setattr(ocr_textlayer.subprocess, 'run', flaky)
+    pages = extract_text_layer('factura.pdf', [1, 2, 9], timeout=5)
+    assert sorted(pages) == [1, 2]
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Reporte de percentiles por etapa a partir del log de trazas (OCR_TRACE_LOG)
+Lee las líneas JSON escritas por el servicio (también el archivo rotado .1) y
+muestra p50/p95/p99 de cada etapa por documento o por petición, agrupadas
+opcionalmente por tipo de archivo, resultado o endpoint, y los casos más lentos
+con la etapa que dominó su duración
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List
+
+from ocr_trace import OCR_TRACE_LOG
+
+PERCENTILES = (50, 95, 99)
+
+
+def read_records(paths: Iterable[str], tipo: str, endpoint: str = None, since: float = None) -> Iterator[dict]:
+    """Registros del tipo pedido, ignorando líneas incompletas (p. ej. la última de un log en uso)"""
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("tipo") != tipo:
+                    continue
+                if endpoint and record.get("endpoint") != endpoint:
+                    continue
+                if since and record.get("ts", 0) < since:
+                    continue
+                yield record
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentil q (0-100) con interpolación lineal sobre valores ordenados"""
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summarize(records: List[dict]) -> List[dict]:
+    """Filas por etapa (y la del total): casos, percentiles y parte del tiempo total que ocupa"""
+    stages = defaultdict(list)
+    totals = []
+    for record in records:
+        totals.append(record["total_ms"])
+        for stage, ms in record.get("etapas_ms", {}).items():
+            stages[stage].append(ms)
+    grand_total = sum(totals) or 1.0
+    rows = []
+    for stage, values in list(stages.items()) + [("total", totals)]:
+        values.sort()
+        rows.append({
+            "etapa": stage,
+            "n": len(values),
+            **{f"p{q}": round(percentile(values, q), 2) for q in PERCENTILES},
+            "max": values[-1],
+            "porcentaje_tiempo": round(100 * sum(values) / grand_total, 1),
+        })
+    return rows
+
+
+def slowest(records: List[dict], count: int) -> List[dict]:
+    """Los registros más lentos con su etapa dominante"""
+    result = []
+    for record in sorted(records, key=lambda r: r["total_ms"], reverse=True)[:count]:
+        stages = record.get("etapas_ms") or {"-": 0.0}
+        stage = max(stages, key=stages.get)
+        result.append({
+            "request_id": record.get("request_id"),
+            "archivo": record.get("archivo", record.get("endpoint")),
+            "total_ms": record["total_ms"],
+            "etapa_dominante": stage,
+            "etapa_ms": stages[stage],
+        })
+    return result
+
+
+def print_table(title: str, rows: List[dict]):
+    print(f"\n📊 {title}")
+    print(f"{'etapa':<18} {'n':>7} " + " ".join(f"{'p' + str(q):>10}" for q in PERCENTILES)
+          + f" {'max':>10} {'% tiempo':>9}")
+    for row in rows:
+        print(f"{row['etapa']:<18} {row['n']:>7} " + " ".join(f"{row['p' + str(q)]:>8.1f}ms" for q in PERCENTILES)
+              + f" {row['max']:>8.1f}ms {row['porcentaje_tiempo']:>8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Percentiles por etapa del log de trazas OCR")
+    parser.add_argument('paths', nargs='*',
+                        help="Logs de trazas (por defecto OCR_TRACE_LOG y su archivo rotado .1)")
+    parser.add_argument('--tipo', choices=['documento', 'peticion'], default='documento',
+                        help="Agregar por documento (etapas del pipeline) o por petición completa")
+    parser.add_argument('--by', choices=['none', 'file_type', 'outcome', 'endpoint'], default='none',
+                        help="Agrupar las filas por este campo")
+    parser.add_argument('--endpoint', help="Solo este endpoint (p. ej. /ocr)")
+    parser.add_argument('--minutes', type=float, help="Solo los últimos N minutos")
+    parser.add_argument('--slowest', type=int, default=5, help="Casos más lentos a listar (0: ninguno)")
+    parser.add_argument('--json', action='store_true', help="Salida JSON en lugar de tablas")
+    args = parser.parse_args()
+
+    paths = args.paths or [p for p in (OCR_TRACE_LOG + '.1', OCR_TRACE_LOG) if os.path.exists(p)]
+    if not paths:
+        print("❌ No hay logs de trazas (¿OCR_TRACE_LOG vacío o sin peticiones aún?)")
+        sys.exit(1)
+    since = time.time() - args.minutes * 60 if args.minutes else None
+    records = list(read_records(paths, args.tipo, args.endpoint, since))
+    if not records:
+        print(f"❌ Sin registros de tipo '{args.tipo}' en {', '.join(paths)}")
+        sys.exit(1)
+
+    groups: Dict[str, List[dict]] = defaultdict(list)
+    for record in records:
+        groups[str(record.get(args.by)) if args.by != 'none' else 'todos'].append(record)
+    report = {
+        "registros": len(records),
+        "grupos": {name: summarize(group) for name, group in sorted(groups.items())},
+        "mas_lentos": slowest(records, args.slowest),
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"📄 {len(records)} registros de tipo '{args.tipo}' en {', '.join(paths)}")
+    for name, rows in report["grupos"].items():
+        print_table(name if args.by == 'none' else f"{args.by} = {name}", rows)
+    if report["mas_lentos"]:
+        print("\n🐢 Más lentos:")
+        for case in report["mas_lentos"]:
+            print(f"  {case['total_ms']:>10.1f}ms  {case['archivo']}  ({case['request_id']}): "
+                  f"{case['etapa_dominante']} {case['etapa_ms']:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()